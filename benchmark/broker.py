@@ -0,0 +1,218 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ("Broker", )
+
+
+import asyncio
+import threading
+import typing
+import ssl
+import struct
+import json
+
+
+stats_request_topic = "$bench/stats/request"
+stats_topic = "$bench/stats"
+
+
+def _encode_length(length: int) -> bytes:
+    encoded = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        if length:
+            byte |= 0x80
+        encoded.append(byte)
+        if not length:
+            return bytes(encoded)
+
+
+def _encode_string(value: bytes) -> bytes:
+    return struct.pack("!H", len(value)) + value
+
+
+def _packet(header: int, body: bytes) -> bytes:
+    return bytes((header, )) + _encode_length(len(body)) + body
+
+
+def _matches(topic_filter: typing.Tuple[str, ...], topic: typing.List[str]) -> bool:
+    if topic and topic[0].startswith("$") and topic_filter[0] in ("+", "#"):
+        return False
+    for i, level in enumerate(topic_filter):
+        if level == "#":
+            return True
+        if i >= len(topic) or (level != "+" and level != topic[i]):
+            return False
+    return len(topic_filter) == len(topic)
+
+
+class _Client:
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.id = ""
+        self.will: typing.Optional[typing.Tuple[str, bytes, bool]] = None
+        self.subscriptions: typing.Set[str] = set()
+
+
+class Broker(threading.Thread):
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, ssl_context: typing.Optional[ssl.SSLContext] = None, ack_delay: float = 0, ack_delay_filter: str = "#"):
+        super().__init__(name="bench-broker", daemon=True)
+        self.host = host
+        self.port = port
+        self.ssl_context = ssl_context
+        # delays PUBACK/PUBREC for matching topics like a device on a slow network
+        self.ack_delay = ack_delay
+        self.__ack_delay_filter = tuple(ack_delay_filter.split("/"))
+        self.published: typing.Dict[str, int] = dict()
+        self.ready = threading.Event()
+        self.__exact: typing.Dict[str, typing.Set[_Client]] = dict()
+        self.__wildcards: typing.Dict[str, typing.Tuple[typing.Tuple[str, ...], typing.Set[_Client]]] = dict()
+        self.__retained: typing.Dict[str, bytes] = dict()
+        self.__loop: typing.Optional[asyncio.AbstractEventLoop] = None
+
+    def run(self):
+        self.__loop = asyncio.new_event_loop()
+        server = self.__loop.run_until_complete(asyncio.start_server(self.__handle, self.host, self.port, backlog=4096, ssl=self.ssl_context))
+        self.port = server.sockets[0].getsockname()[1]
+        self.ready.set()
+        self.__loop.run_forever()
+
+    def __subscribe(self, client: _Client, topic_filter: str):
+        client.subscriptions.add(topic_filter)
+        if "+" in topic_filter or "#" in topic_filter:
+            self.__wildcards.setdefault(topic_filter, (tuple(topic_filter.split("/")), set()))[1].add(client)
+        else:
+            self.__exact.setdefault(topic_filter, set()).add(client)
+        levels = tuple(topic_filter.split("/"))
+        for topic, payload in self.__retained.items():
+            if _matches(levels, topic.split("/")):
+                self.__send_publish(client, topic, payload, True)
+
+    def __unsubscribe(self, client: _Client, topic_filter: str):
+        client.subscriptions.discard(topic_filter)
+        if topic_filter in self.__exact:
+            self.__exact[topic_filter].discard(client)
+        elif topic_filter in self.__wildcards:
+            self.__wildcards[topic_filter][1].discard(client)
+
+    def __send_publish(self, client: _Client, topic: str, payload: bytes, retain: bool = False):
+        if not client.writer.is_closing():
+            client.writer.write(_packet(0x30 | int(retain), _encode_string(topic.encode()) + payload))
+
+    @staticmethod
+    def __send_ack(writer: asyncio.StreamWriter, packet: bytes):
+        if not writer.is_closing():
+            writer.write(packet)
+
+    def __route(self, sender: typing.Optional[_Client], topic: str, payload: bytes, retain: bool):
+        if sender:
+            self.published[sender.id] = self.published.get(sender.id, 0) + 1
+        if topic == stats_request_topic:
+            topic, payload, retain = stats_topic, json.dumps(self.published).encode(), False
+        if retain:
+            if payload:
+                self.__retained[topic] = payload
+            else:
+                self.__retained.pop(topic, None)
+        receivers = set(self.__exact.get(topic, ()))
+        if self.__wildcards:
+            levels = topic.split("/")
+            for topic_filter, clients in self.__wildcards.values():
+                if clients and _matches(topic_filter, levels):
+                    receivers.update(clients)
+        for receiver in receivers:
+            self.__send_publish(receiver, topic, payload)
+
+    async def __handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        client = _Client(writer)
+        clean = False
+        try:
+            while True:
+                header = (await reader.readexactly(1))[0]
+                length, multiplier = 0, 1
+                while True:
+                    byte = (await reader.readexactly(1))[0]
+                    length += (byte & 0x7F) * multiplier
+                    multiplier *= 128
+                    if not byte & 0x80:
+                        break
+                body = await reader.readexactly(length) if length else b""
+                packet_type = header >> 4
+                if packet_type == 1:
+                    pos = 2 + struct.unpack("!H", body[:2])[0] + 1
+                    flags = body[pos]
+                    pos += 3
+                    id_len = struct.unpack("!H", body[pos:pos + 2])[0]
+                    client.id = body[pos + 2:pos + 2 + id_len].decode()
+                    pos += 2 + id_len
+                    if flags & 0x04:
+                        topic_len = struct.unpack("!H", body[pos:pos + 2])[0]
+                        topic = body[pos + 2:pos + 2 + topic_len].decode()
+                        pos += 2 + topic_len
+                        msg_len = struct.unpack("!H", body[pos:pos + 2])[0]
+                        client.will = (topic, body[pos + 2:pos + 2 + msg_len], bool(flags & 0x20))
+                    writer.write(_packet(0x20, b"\x00\x00"))
+                elif packet_type == 3:
+                    qos = (header >> 1) & 0x03
+                    topic_len = struct.unpack("!H", body[:2])[0]
+                    topic = body[2:2 + topic_len].decode()
+                    pos = 2 + topic_len
+                    if qos:
+                        packet_id = body[pos:pos + 2]
+                        pos += 2
+                        if self.ack_delay and _matches(self.__ack_delay_filter, topic.split("/")):
+                            self.__loop.call_later(self.ack_delay, self.__send_ack, writer, _packet(0x40 if qos == 1 else 0x50, packet_id))
+                        else:
+                            writer.write(_packet(0x40 if qos == 1 else 0x50, packet_id))
+                    self.__route(client, topic, body[pos:], bool(header & 0x01))
+                elif packet_type == 6:
+                    writer.write(_packet(0x70, body[:2]))
+                elif packet_type == 8:
+                    pos = 2
+                    granted = bytearray()
+                    while pos < len(body):
+                        topic_len = struct.unpack("!H", body[pos:pos + 2])[0]
+                        topic_filter = body[pos + 2:pos + 2 + topic_len].decode()
+                        granted.append(min(body[pos + 2 + topic_len], 1))
+                        pos += 3 + topic_len
+                        self.__subscribe(client, topic_filter)
+                    writer.write(_packet(0x90, body[:2] + bytes(granted)))
+                elif packet_type == 10:
+                    pos = 2
+                    while pos < len(body):
+                        topic_len = struct.unpack("!H", body[pos:pos + 2])[0]
+                        self.__unsubscribe(client, body[pos + 2:pos + 2 + topic_len].decode())
+                        pos += 2 + topic_len
+                    writer.write(_packet(0xB0, body[:2]))
+                elif packet_type == 12:
+                    writer.write(b"\xd0\x00")
+                elif packet_type == 14:
+                    clean = True
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ssl.SSLError):
+            pass
+        finally:
+            for topic_filter in list(client.subscriptions):
+                self.__unsubscribe(client, topic_filter)
+            if client.will and not clean:
+                self.__route(None, *client.will)
+            writer.close()
+
+    def stop(self):
+        if self.__loop:
+            self.__loop.call_soon_threadsafe(self.__loop.stop)
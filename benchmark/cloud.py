@@ -0,0 +1,236 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ("CloudStub", )
+
+
+import http.server
+import threading
+import argparse
+import typing
+import base64
+import json
+import time
+import sys
+import os
+
+
+auth_api = "v1/userregistration/authenticate"
+provisioning_api = "v1/provisioningservice/manifest"
+key = bytes(range(1, 33))
+
+
+def encrypt_password(password: str) -> str:
+    import Crypto.Cipher.AES
+    padding = 16 - len(password) % 16
+    cipher = Crypto.Cipher.AES.new(key, Crypto.Cipher.AES.MODE_CBC, bytes(16))
+    return base64.b64encode(cipher.encrypt((password + chr(padding) * padding).encode())).decode()
+
+
+class CloudStub(threading.Thread):
+    """
+    Stand-in for the Dyson cloud API: authenticates one account, serves a device manifest with an ETag and answers
+    conditional requests with 304. Tokens can be revoked to provoke 401 responses and requests can be failed to
+    provoke back off.
+    """
+
+    def __init__(self, email: str, password: str, host: str = "127.0.0.1", port: int = 0):
+        super().__init__(name="bench-cloud", daemon=True)
+        self.__email = email
+        self.__password = password
+        self.__token: typing.Optional[str] = None
+        self.__tokens = 0
+        self.__manifest: typing.List[dict] = list()
+        self.__version = 0
+        self.__failures = 0
+        self.__lock = threading.Lock()
+        self.requests: typing.Dict[str, int] = dict()
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def __reply(self, status: int, body: typing.Optional[typing.Any] = None, headers: typing.Optional[dict] = None):
+                payload = json.dumps(body).encode() if body is not None else b""
+                self.send_response(status)
+                for name, value in (headers or dict()).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):
+                status, body = stub.authenticate(
+                    self.path,
+                    json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                )
+                self.__reply(status, body)
+
+            def do_GET(self):
+                status, body, headers = stub.manifest(
+                    self.path,
+                    self.headers.get("Authorization"),
+                    self.headers.get("If-None-Match")
+                )
+                self.__reply(status, body, headers)
+
+        self.__server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.url = "http://{}:{}".format(*self.__server.server_address)
+
+    def __count(self, status: int) -> int:
+        self.requests[str(status)] = self.requests.get(str(status), 0) + 1
+        return status
+
+    def __failing(self) -> bool:
+        if self.__failures:
+            self.__failures -= 1
+            return True
+        return False
+
+    def authenticate(self, path: str, login: dict) -> typing.Tuple[int, typing.Optional[dict]]:
+        with self.__lock:
+            if not path.startswith("/{}".format(auth_api)):
+                return self.__count(404), None
+            if self.__failing():
+                return self.__count(503), None
+            if login.get("Email") != self.__email or login.get("Password") != self.__password:
+                return self.__count(401), None
+            if not self.__token:
+                self.__tokens += 1
+                self.__token = "token-{}".format(self.__tokens)
+            self.requests["auth"] = self.requests.get("auth", 0) + 1
+            return self.__count(200), {"Account": self.__email, "Password": self.__token}
+
+    def manifest(self, path: str, authorization: typing.Optional[str], etag: typing.Optional[str]) -> typing.Tuple[int, typing.Optional[list], dict]:
+        with self.__lock:
+            if path != "/{}".format(provisioning_api):
+                return self.__count(404), None, dict()
+            if self.__failing():
+                return self.__count(503), None, dict()
+            expected = "Basic {}".format(base64.b64encode("{}:{}".format(self.__email, self.__token).encode()).decode())
+            if not self.__token or authorization != expected:
+                return self.__count(401), None, dict()
+            current = '"{}"'.format(self.__version)
+            if etag == current:
+                return self.__count(304), None, {"ETag": current}
+            return self.__count(200), self.__manifest, {"ETag": current}
+
+    def set_devices(self, devices: typing.Sequence[typing.Tuple[str, str, str, str]]):
+        """devices as (serial, name, product type, local password)"""
+        with self.__lock:
+            self.__manifest = [
+                {
+                    "Serial": serial,
+                    "Name": name,
+                    "ProductType": product_type,
+                    "LocalCredentials": encrypt_password(json.dumps({"serial": serial, "apPasswordHash": password}))
+                }
+                for serial, name, product_type, password in devices
+            ]
+            self.__version += 1
+
+    def revoke(self):
+        with self.__lock:
+            self.__token = None
+
+    def fail(self, count: int):
+        with self.__lock:
+            self.__failures = count
+
+    def run(self):
+        self.__server.serve_forever(poll_interval=0.1)
+
+    def stop(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Cloud client check: runs CloudClient against the local stand-in cloud API and verifies "
+                    "authentication, conditional manifest requests, re-authentication on 401 and back off after "
+                    "failures. Exits non-zero if a step fails."
+    )
+    parser.add_argument("--backoff", type=float, default=0.2, help="back off base in seconds")
+    args = parser.parse_args()
+    os.environ.setdefault("CONF_SENERGY_DT_PURE_COOL_LINK", "bench-pure-cool-link")
+    from dyson.cloud import CloudClient
+    stub = CloudStub(email="bench@example.com", password="bench")
+    stub.set_devices([("BEN-CH-000000", "bench 0", "475", "hash-0")])
+    stub.start()
+    client = CloudClient(
+        url=stub.url,
+        auth_api=auth_api,
+        provisioning_api=provisioning_api,
+        email="bench@example.com",
+        password="bench",
+        country="DE",
+        device_id_prefix="bench-",
+        timeout=5,
+        backoff=args.backoff,
+        backoff_max=args.backoff * 4
+    )
+    results = list()
+
+    def step(name: str, check: typing.Callable[[], bool]):
+        try:
+            ok = check()
+        except Exception as ex:
+            ok = False
+            name = "{} ({})".format(name, ex)
+        results.append((name, ok))
+
+    def fetch() -> dict:
+        return client.get_devices()
+
+    def counts() -> dict:
+        return dict(stub.requests)
+
+    try:
+        step("authenticates and fetches manifest", lambda: list(fetch()) == ["bench-BEN-CH-000000"] and counts() == {"auth": 1, "200": 2})
+        step("unchanged manifest answered with 304", lambda: fetch()["bench-BEN-CH-000000"]["name"] == "bench 0" and counts().get("304") == 1 and counts()["auth"] == 1)
+        stub.revoke()
+        step("re-authenticates after 401", lambda: len(fetch()) == 1 and counts().get("401") == 1 and counts()["auth"] == 2)
+        stub.set_devices([("BEN-CH-000000", "bench 0", "475", "hash-0"), ("BEN-CH-000001", "bench 1", "475", "hash-1")])
+        step(
+            "changed manifest fetched and decrypted",
+            lambda: json.loads(fetch()["bench-BEN-CH-000001"]["local_credentials"])["apPasswordHash"] == "hash-1"
+        )
+        stub.fail(1)
+        step("failure raises", lambda: isinstance(_raises(fetch), RuntimeError))
+        step("request postponed during back off", lambda: "postponed" in str(_raises(fetch)) and counts().get("503") == 1)
+        time.sleep(args.backoff * 1.1)
+        step("recovers after back off", lambda: len(fetch()) == 2)
+    finally:
+        client.close()
+        stub.stop()
+    for name, ok in results:
+        print("{:>4}  {}".format("ok" if ok else "FAIL", name))
+    print("requests: {}".format(json.dumps(stub.requests, sort_keys=True)))
+    sys.exit(0 if all(ok for _, ok in results) else 1)
+
+
+def _raises(func: typing.Callable) -> typing.Optional[Exception]:
+    try:
+        func()
+    except Exception as ex:
+        return ex
+    return None
+
+
+if __name__ == "__main__":
+    main()
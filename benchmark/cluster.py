@@ -0,0 +1,164 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from benchmark.broker import Broker
+from benchmark.fleet import Fleet, gen_serial
+from benchmark.e2e import gen_env, wait_for, repo_path
+import argparse
+import subprocess
+import tempfile
+import threading
+import typing
+import signal
+import json
+import time
+import sys
+import os
+
+
+def run_child(size: int, port: int):
+    from util import conf, MQTTClient, Router, Cluster, init_logger
+    from dyson import Discovery, SessionRegistry
+    from dyson.session import SessionEvent
+    import dyson.discovery
+    init_logger(conf.Logger.level)
+    positive_hosts = {"{}.BENCH".format(gen_serial(i)): ("127.0.0.1", port) for i in range(size)}
+    dyson.discovery.discover_hosts = lambda: list(positive_hosts)
+    dyson.discovery.probe_hosts = lambda hosts: positive_hosts
+    cluster = Cluster(
+        instance_id=conf.Client.id,
+        host=conf.MsgBroker.host,
+        port=conf.MsgBroker.port,
+        topic=conf.Cluster.topic,
+        heartbeat_interval=conf.Cluster.heartbeat_interval,
+        lease_timeout=conf.Cluster.lease_timeout,
+        vnodes=conf.Cluster.vnodes
+    )
+    cluster.start()
+    device_sessions = SessionRegistry()
+    mqtt_client = MQTTClient()
+    discovery = Discovery(mqtt_client=mqtt_client, device_sessions=device_sessions, cluster=cluster)
+    router = Router(refresh_callback=discovery.schedule_publish, device_sessions=device_sessions)
+    mqtt_client.on_connect = discovery.schedule_publish
+    mqtt_client.on_message = router.route
+    discovery.start()
+    threading.Thread(target=mqtt_client.start, name="bench-dc-client", daemon=True).start()
+    while True:
+        online = [device_id for device_id in device_sessions if device_sessions.state(device_id) == SessionEvent.online]
+        print(json.dumps(online), flush=True)
+        time.sleep(0.2)
+
+
+class Instance:
+    def __init__(self, index: int, size: int, port: int, work_dir: str):
+        self.id = "bench-dc-{}".format(index)
+        self.online: typing.Set[str] = set()
+        env = {
+            **os.environ,
+            **gen_env(size, port, work_dir, 10),
+            "CONF_CLIENT_ID": self.id,
+            "CONF_DISCOVERY_DELAY": "2",
+            "CONF_CLUSTER_ENABLED": "true",
+            "CONF_CLUSTER_HEARTBEAT_INTERVAL": "1",
+            "CONF_CLUSTER_LEASE_TIMEOUT": "3",
+            "CONF_CLUSTER_HANDOVER_DELAY": "1"
+        }
+        self.__proc = subprocess.Popen(
+            [sys.executable, "-m", "benchmark.cluster", "--child", "--sizes", str(size), "--port", str(port)],
+            cwd=repo_path,
+            env=env,
+            stdout=subprocess.PIPE
+        )
+        threading.Thread(target=self.__read, name="{}-reader".format(self.id), daemon=True).start()
+
+    def __read(self):
+        for line in self.__proc.stdout:
+            try:
+                self.online = set(json.loads(line))
+            except ValueError:
+                pass
+        self.online = set()
+
+    def kill(self):
+        self.__proc.send_signal(signal.SIGKILL)
+        self.__proc.wait()
+
+    def stop(self):
+        self.__proc.terminate()
+        try:
+            self.__proc.wait(5)
+        except subprocess.TimeoutExpired:
+            self.kill()
+
+
+def balanced(instances: typing.Sequence[Instance], size: int) -> bool:
+    owned = [instance.online for instance in instances]
+    return sum(len(online) for online in owned) == size and len(set().union(*owned)) == size
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Cluster benchmark: runs several instances with cluster mode against a local stand-in broker and "
+                    "an emulated fleet, then kills one instance and starts a new one. Reports how long it takes until "
+                    "every device is online on exactly one instance."
+    )
+    parser.add_argument("--sizes", default="100", help="fleet size")
+    parser.add_argument("--instances", type=int, default=3, help="number of instances")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for each phase")
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    size = int(args.sizes)
+    if args.child:
+        run_child(size, args.port)
+        return
+    broker = Broker()
+    broker.start()
+    broker.ready.wait()
+    fleet = Fleet(size, "127.0.0.1", broker.port)
+    fleet.start()
+    instances: typing.List[Instance] = list()
+    result = {"size": size, "instances": args.instances}
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            def start_instance(index: int) -> Instance:
+                path = os.path.join(work_dir, str(index))
+                os.makedirs(path, exist_ok=True)
+                return Instance(index, size, broker.port, path)
+
+            instances.extend(start_instance(index) for index in range(args.instances))
+            result["settle_s"] = round(wait_for(lambda: balanced(instances, size), args.timeout, 0.1), 2)
+            result["owned"] = [len(instance.online) for instance in instances]
+            instances[0].kill()
+            killed = instances.pop(0)
+            result["takeover_s"] = round(wait_for(lambda: balanced(instances, size), args.timeout, 0.1), 2)
+            instances.append(start_instance(args.instances))
+            result["rebalance_s"] = round(
+                wait_for(lambda: instances[-1].online and balanced(instances, size), args.timeout, 0.1),
+                2
+            )
+            result["owned_after"] = [len(instance.online) for instance in instances]
+            result["killed"] = killed.id
+    finally:
+        for instance in instances:
+            instance.stop()
+        fleet.stop()
+        broker.stop()
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import argparse
+import statistics
+import timeit
+import typing
+import copy
+import json
+import sys
+import os
+
+
+benchmark_path = os.path.dirname(os.path.abspath(__file__))
+payloads_path = os.path.join(benchmark_path, "payloads", "475.json")
+baseline_path = os.path.join(benchmark_path, "codec_baseline.json")
+
+# compiled codec case -> hand-written case it replaces
+hand_written = {
+    "codec.apply_device_state[STATE-CHANGE]": "pcl_475.update_device_state[STATE-CHANGE]",
+    "codec.push_device_state": "pcl_475.push_device_state",
+    "codec.push_sensor_readings": "pcl_475.push_sensor_readings",
+    "codec.gen_state_req_msg": "pcl_475._gen_msg",
+    "codec.setSpeed": "pcl_475.set_speed"
+}
+
+os.environ.setdefault("CONF_SENERGY_DT_PURE_COOL_LINK", "bench-pure-cool-link")
+
+
+class _Session:
+    def __init__(self, device_state: dict):
+        self.device_state = device_state
+
+
+def load_payloads() -> dict:
+    with open(payloads_path, "r") as file:
+        return json.load(file)
+
+
+def gen_cases(payloads: dict) -> typing.Dict[str, typing.Callable[[], typing.Any]]:
+    from benchmark import pcl_475
+    from dyson.model import model_map
+    from dyson.state import DeviceState
+    current_state = payloads["CURRENT-STATE"]
+    state_change = payloads["STATE-CHANGE"]
+    sensor_data = payloads["ENVIRONMENTAL-CURRENT-SENSOR-DATA"]
+    state = pcl_475.parse_device_state(current_state)
+    full_state = dict(state)
+    session = _Session(dict(state))
+    model = model_map["475"]
+    device_state = DeviceState()
+    model.parse_device_state(device_state, current_state)
+    compiled_session = _Session(device_state)
+    return {
+        "pcl_475.parse_device_state[CURRENT-STATE]": lambda: pcl_475.parse_device_state(current_state),
+        "pcl_475.parse_device_state[STATE-CHANGE]": lambda: pcl_475.parse_device_state(state_change),
+        # parse_device_state alone drops all keys missing from a STATE-CHANGE, keeping a full state needs the update
+        "pcl_475.update_device_state[STATE-CHANGE]": lambda: full_state.update(pcl_475.parse_device_state(state_change)),
+        "pcl_475.push_device_state": lambda: pcl_475.push_device_state(state),
+        "pcl_475.push_sensor_readings": lambda: pcl_475.push_sensor_readings({"data": dict(sensor_data["data"])}),
+        "pcl_475._gen_set_state_msg": lambda: pcl_475._gen_set_state_msg(dict(state)),
+        "pcl_475._gen_msg": lambda: pcl_475._gen_msg("REQUEST-CURRENT-STATE"),
+        "pcl_475.set_speed": lambda: pcl_475.set_speed(session, 7),
+        "codec.apply_device_state[STATE-CHANGE]": lambda: model.parse_device_state(device_state, state_change),
+        "codec.push_device_state": lambda: model.push_state_srv[1](device_state.data),
+        "codec.push_sensor_readings": lambda: model.push_readings_srv[1](sensor_data),
+        "codec.gen_state_req_msg": model.gen_state_req_msg,
+        "codec.setSpeed": lambda: model.set_services["setSpeed"](compiled_session, 7)
+    }
+
+
+def _calibrate(timer: timeit.Timer, min_time: float) -> int:
+    number, _ = timer.autorange()
+    return max(int(number * min_time / 0.2), 1)
+
+
+def measure(func: typing.Callable, reference: typing.Callable, repeat: int, min_time: float) -> typing.Tuple[float, float, float]:
+    timer = timeit.Timer(func)
+    reference_timer = timeit.Timer(reference)
+    number = _calibrate(timer, min_time)
+    reference_number = _calibrate(reference_timer, min_time)
+    runs = list()
+    ratios = list()
+    for _ in range(repeat):
+        reference_time = reference_timer.timeit(reference_number) / reference_number
+        run_time = timer.timeit(number) / number
+        runs.append(run_time)
+        ratios.append(run_time / reference_time)
+    return min(runs), statistics.median(runs), statistics.median(ratios)
+
+
+def run(repeat: int, min_time: float) -> typing.Dict[str, dict]:
+    payloads = load_payloads()
+    reference_payload = json.dumps(payloads["CURRENT-STATE"])
+    results = dict()
+    for name, func in gen_cases(payloads).items():
+        best, median, relative = measure(func, lambda: copy.deepcopy(json.loads(reference_payload)), repeat, min_time)
+        results[name] = {"ns": round(best * 1e9, 1), "median_ns": round(median * 1e9, 1), "relative": round(relative, 4)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Micro-benchmarks for the per-message codec functions using recorded 475 payloads. Costs are "
+                    "reported in ns per call and as the median ratio to a json decode/copy reference timed right before "
+                    "each repeat. The baseline check compares that ratio, so results stay comparable across machines. "
+                    "Compiled codec cases must also be at least as fast as the hand-written functions they replace."
+    )
+    parser.add_argument("--repeat", type=int, default=25)
+    parser.add_argument("--min-time", type=float, default=0.05, help="seconds per repeat and case")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="allowed relative slowdown before failing")
+    parser.add_argument("--check", action="store_true", help="fail if a case regressed against the baseline or a compiled case is slower than its hand-written counterpart")
+    parser.add_argument("--save", action="store_true", help="write results as new baseline")
+    args = parser.parse_args()
+    results = run(args.repeat, args.min_time)
+    baseline = dict()
+    if os.path.exists(baseline_path):
+        with open(baseline_path, "r") as file:
+            baseline = json.load(file)
+    regressions = list()
+    slower = list()
+    print("{:<45} {:>12} {:>12} {:>10} {:>10} {:>14}".format("case", "ns/call", "median ns", "relative", "baseline", "/hand-written"))
+    for name, result in results.items():
+        expected = baseline.get(name)
+        versus = None
+        if name in hand_written:
+            versus = round(result["relative"] / results[hand_written[name]]["relative"], 3)
+            if versus > 1:
+                slower.append(name)
+        print(
+            "{:<45} {:>12} {:>12} {:>10} {:>10} {:>14}".format(
+                name,
+                result["ns"],
+                result["median_ns"],
+                result["relative"],
+                expected if expected is not None else "-",
+                versus if versus is not None else "-"
+            )
+        )
+        if expected is not None and result["relative"] > expected * (1 + args.tolerance):
+            regressions.append(name)
+    if args.save:
+        with open(baseline_path, "w") as file:
+            json.dump({name: result["relative"] for name, result in results.items()}, file, indent=2)
+            file.write("\n")
+    if args.check and (regressions or slower):
+        if regressions:
+            print("regressed: {}".format(", ".join(regressions)), file=sys.stderr)
+        if slower:
+            print("slower than hand-written: {}".format(", ".join(slower)), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
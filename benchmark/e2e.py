@@ -0,0 +1,300 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from benchmark.broker import Broker, stats_topic, stats_request_topic
+from benchmark.fleet import Fleet, gen_serial
+import paho.mqtt.client
+import mgw_dc
+import argparse
+import subprocess
+import tempfile
+import resource
+import threading
+import typing
+import random
+import math
+import json
+import time
+import sys
+import os
+
+
+repo_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values: typing.Sequence[float], p: float) -> typing.Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(math.ceil(p * len(values)) - 1, 0)]
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/status", "r") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def wait_for(condition: typing.Callable[[], bool], timeout: float, interval: float = 0.01) -> float:
+    started = time.monotonic()
+    while not condition():
+        if time.monotonic() - started > timeout:
+            raise RuntimeError("timed out after {}s".format(timeout))
+        time.sleep(interval)
+    return time.monotonic() - started
+
+
+def gen_env(size: int, port: int, work_dir: str, sensor_interval: float) -> dict:
+    provisioning_file = os.path.join(work_dir, "devices.json")
+    with open(provisioning_file, "w") as file:
+        json.dump(
+            [
+                {"serial": gen_serial(i), "password_hash": "bench", "model": "475", "name": "bench {}".format(i)}
+                for i in range(size)
+            ],
+            file
+        )
+    ip_file = os.path.join(work_dir, "host_ip")
+    with open(ip_file, "w") as file:
+        file.write("127.0.0.1\n")
+    return {
+        "CONF_MSGBROKER_HOST": "127.0.0.1",
+        "CONF_MSGBROKER_PORT": str(port),
+        "CONF_LOGGER_LEVEL": "warning",
+        "CONF_SENERGY_DT_PURE_COOL_LINK": "bench-pure-cool-link",
+        "CONF_DISCOVERY_SOURCE": "file",
+        "CONF_DISCOVERY_PROVISIONING_FILE": provisioning_file,
+        "CONF_DISCOVERY_DB_PATH": work_dir,
+        "CONF_DISCOVERY_IP_FILE": ip_file,
+        "CONF_DISCOVERY_DEVICE_ID_PREFIX": "bench-",
+        "CONF_SESSION_SENSOR_INTERVAL": str(sensor_interval)
+    }
+
+
+class Platform:
+    def __init__(self, port: int):
+        self.__client = paho.mqtt.client.Client(client_id="bench-platform")
+        self.__client.on_message = self.__on_message
+        self.__client.connect("127.0.0.1", port)
+        self.__client.loop_start()
+        self.__client.subscribe(stats_topic, 0)
+        self.__subscribed = set()
+        self.__pending: typing.Dict[str, threading.Event] = dict()
+        self.__responses: typing.Dict[str, typing.Optional[dict]] = dict()
+        self.__stats: typing.Optional[dict] = None
+        self.__stats_event = threading.Event()
+
+    def __on_message(self, client, userdata, message):
+        payload = json.loads(message.payload)
+        if message.topic == stats_topic:
+            self.__stats = payload
+            self.__stats_event.set()
+        else:
+            event = self.__pending.pop(payload.get(mgw_dc.com.command.id), None)
+            if payload.get(mgw_dc.com.command.id) in self.__responses:
+                self.__responses[payload[mgw_dc.com.command.id]] = payload
+            if event:
+                event.set()
+
+    def published(self, client_id: str, timeout: float = 5) -> int:
+        self.__stats_event.clear()
+        self.__client.publish(stats_request_topic, b"", qos=0)
+        if not self.__stats_event.wait(timeout):
+            raise RuntimeError("no broker stats")
+        return self.__stats.get(client_id, 0)
+
+    def command(self, device_id: str, service_id: str, data: typing.Optional[dict], timeout: float = 10) -> float:
+        response_topic = mgw_dc.com.gen_response_topic(device_id, service_id)
+        if response_topic not in self.__subscribed:
+            self.__client.subscribe(response_topic, 1)
+            self.__subscribed.add(response_topic)
+            time.sleep(0.05)
+        cmd_id = "{}-{}".format(time.monotonic_ns(), random.random())
+        event = threading.Event()
+        self.__pending[cmd_id] = event
+        started = time.monotonic()
+        self.__client.publish(
+            mgw_dc.com.gen_command_topic(device_id, service_id),
+            json.dumps({mgw_dc.com.command.id: cmd_id, mgw_dc.com.command.data: json.dumps(data) if data else None}),
+            qos=1
+        )
+        if not event.wait(timeout):
+            self.__pending.pop(cmd_id, None)
+            raise RuntimeError("no response for '{}'".format(service_id))
+        return time.monotonic() - started
+
+    def group_command(self, client_id: str, service_id: str, data: typing.Optional[dict], timeout: float = 30) -> typing.Tuple[float, dict]:
+        response_topic = "{}/group/response".format(client_id)
+        if response_topic not in self.__subscribed:
+            self.__client.subscribe(response_topic, 1)
+            self.__subscribed.add(response_topic)
+            time.sleep(0.05)
+        cmd_id = "{}-{}".format(time.monotonic_ns(), random.random())
+        event = threading.Event()
+        self.__pending[cmd_id] = event
+        self.__responses[cmd_id] = None
+        started = time.monotonic()
+        self.__client.publish(
+            "{}/group/command".format(client_id),
+            json.dumps(
+                {
+                    mgw_dc.com.command.id: cmd_id,
+                    mgw_dc.com.command.data: json.dumps(data) if data else None,
+                    "service_id": service_id,
+                    "tag": "all"
+                }
+            ),
+            qos=1
+        )
+        if not event.wait(timeout):
+            self.__pending.pop(cmd_id, None)
+            raise RuntimeError("no response for group command '{}'".format(service_id))
+        return time.monotonic() - started, json.loads(self.__responses.pop(cmd_id)[mgw_dc.com.command.data])
+
+
+def run_child(size: int, port: int, window: float, commands: int, timeout: float) -> dict:
+    from util import conf, MQTTClient, Router, init_logger
+    from dyson import Discovery, SessionRegistry, GroupCommands
+    import dyson.discovery
+    init_logger(conf.Logger.level)
+    positive_hosts = {"{}.BENCH".format(gen_serial(i)): ("127.0.0.1", port) for i in range(size)}
+    dyson.discovery.discover_hosts = lambda: list(positive_hosts)
+    dyson.discovery.probe_hosts = lambda hosts: positive_hosts
+    device_sessions = SessionRegistry()
+    mqtt_client = MQTTClient()
+    discovery = Discovery(mqtt_client=mqtt_client, device_sessions=device_sessions)
+    group_commands = GroupCommands(
+        mqtt_client=mqtt_client,
+        device_sessions=device_sessions,
+        response_topic="{}/group/response".format(conf.Client.id)
+    )
+    router = Router(
+        refresh_callback=discovery.schedule_publish,
+        device_sessions=device_sessions,
+        group_topic="{}/group/command".format(conf.Client.id),
+        group_callback=group_commands.handle_command
+    )
+    mqtt_client.on_connect = discovery.schedule_publish
+    mqtt_client.on_message = router.route
+    mqtt_client.add_subscription("{}/group/command".format(conf.Client.id), 1)
+    threading.Thread(target=mqtt_client.start, name="bench-dc-client", daemon=True).start()
+    wait_for(mqtt_client.connected, timeout)
+    cpu_start = resource.getrusage(resource.RUSAGE_SELF)
+    discovery.start()
+    result = {"size": size}
+    result["discovery_s"] = wait_for(lambda: len(device_sessions) >= size, timeout)
+    result["all_online_s"] = result["discovery_s"] + wait_for(
+        lambda: all(session.wait_for_connect(0) for session in list(device_sessions.values())),
+        timeout
+    )
+    platform = Platform(port)
+    published = platform.published(conf.Client.id)
+    time.sleep(window)
+    result["events_per_s"] = (platform.published(conf.Client.id) - published) / window
+    device_ids = list(device_sessions)
+    for service_id, data in (("getPower", None), ("setPower", {"power": True})):
+        rtts = list()
+        failed = 0
+        for i in range(commands):
+            try:
+                rtts.append(platform.command(random.choice(device_ids), service_id, data))
+            except Exception:
+                failed += 1
+        for p in (0.5, 0.9, 0.99):
+            value = percentile(rtts, p)
+            result["{}_p{}_ms".format(service_id, int(p * 100))] = round(value * 1000, 2) if value is not None else None
+        result["{}_failed".format(service_id)] = failed
+    try:
+        duration, responses = platform.group_command(conf.Client.id, "setPower", {"power": False}, timeout=timeout)
+        result["group_setPower_ms"] = round(duration * 1000, 2)
+        result["group_setPower_failed"] = size - sum(1 for response in responses.values() if "data" in response)
+    except Exception:
+        result["group_setPower_ms"] = None
+        result["group_setPower_failed"] = size
+    cpu_end = resource.getrusage(resource.RUSAGE_SELF)
+    result["cpu_s"] = round((cpu_end.ru_utime + cpu_end.ru_stime) - (cpu_start.ru_utime + cpu_start.ru_stime), 2)
+    result["rss_mb"] = round(rss_mb(), 1)
+    return result
+
+
+def run_size(size: int, window: float, commands: int, sensor_interval: float, timeout: float, ack_delay: float = 0) -> dict:
+    # only device command topics, the upstream side keeps acknowledging right away
+    broker = Broker(ack_delay=ack_delay, ack_delay_filter="+/+/command")
+    broker.start()
+    broker.ready.wait()
+    fleet = Fleet(size, "127.0.0.1", broker.port)
+    fleet.start()
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            proc = subprocess.run(
+                [
+                    sys.executable, "-m", "benchmark.e2e", "--child",
+                    "--sizes", str(size),
+                    "--port", str(broker.port),
+                    "--window", str(window),
+                    "--commands", str(commands),
+                    "--timeout", str(timeout)
+                ],
+                cwd=repo_path,
+                env={**os.environ, **gen_env(size, broker.port, work_dir, sensor_interval)},
+                stdout=subprocess.PIPE,
+                timeout=timeout * 4 + window + commands * 20
+            )
+        if proc.returncode != 0:
+            raise RuntimeError("benchmark for {} devices failed with exit code {}".format(size, proc.returncode))
+        return json.loads(proc.stdout.decode().strip().splitlines()[-1])
+    finally:
+        fleet.stop()
+        broker.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="End-to-end benchmark: runs the discovery, session and upstream components against a local "
+                    "stand-in broker and an emulated fleet of Dyson 475 devices. Host discovery is replaced by the "
+                    "emulated fleet's hosts, everything else runs unmodified."
+    )
+    parser.add_argument("--sizes", default="1,10,100,1000", help="comma separated fleet sizes")
+    parser.add_argument("--window", type=float, default=10, help="seconds to measure event throughput")
+    parser.add_argument("--commands", type=int, default=50, help="commands per service for round-trip times")
+    parser.add_argument("--sensor-interval", type=float, default=1, help="sensor polling interval in seconds")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds to wait for discovery and connects")
+    parser.add_argument("--ack-delay", type=float, default=0, help="seconds devices take to acknowledge commands")
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+    if args.child:
+        print(json.dumps(run_child(sizes[0], args.port, args.window, args.commands, args.timeout)), flush=True)
+        os._exit(0)
+    results = list()
+    for size in sizes:
+        result = run_size(size, args.window, args.commands, args.sensor_interval, args.timeout, args.ack_delay)
+        results.append(result)
+        print(json.dumps(result), file=sys.stderr, flush=True)
+    columns = list(results[0])
+    print(" ".join("{:>16}".format(column) for column in columns))
+    for result in results:
+        print(" ".join("{:>16}".format(str(result[column])) for column in columns))
+
+
+if __name__ == "__main__":
+    main()
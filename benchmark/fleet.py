@@ -0,0 +1,109 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ("Fleet", "gen_serial")
+
+
+import paho.mqtt.client
+import threading
+import typing
+import random
+import json
+import time
+
+
+def gen_serial(index: int) -> str:
+    return "BEN-CH-{:06d}".format(index)
+
+
+def _msg_time() -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+
+class Fleet:
+    def __init__(self, size: int, host: str, port: int, product_type: str = "475"):
+        self.serials = [gen_serial(i) for i in range(size)]
+        self.__product_type = product_type
+        self.__states = {
+            serial: {
+                "fmod": "FAN",
+                "fnst": "FAN",
+                "fnsp": "0004",
+                "qtar": "0003",
+                "oson": "ON",
+                "rhtm": "ON",
+                "filf": "2159",
+                "ercd": "NONE",
+                "nmod": "OFF",
+                "wacd": "NONE"
+            } for serial in self.serials
+        }
+        self.__host = host
+        self.__port = port
+        self.__client = paho.mqtt.client.Client(client_id="bench-fleet")
+        self.__client.on_connect = self.__on_connect
+        self.__client.on_message = self.__on_message
+        self.__connected = threading.Event()
+        self.handled = 0
+
+    def __on_connect(self, client, userdata, flags, rc):
+        self.__client.subscribe("{}/+/command".format(self.__product_type), 1)
+        self.__connected.set()
+
+    def __publish(self, serial: str, msg: dict):
+        self.__client.publish("{}/{}/status/current".format(self.__product_type, serial), json.dumps(msg), qos=0)
+
+    def __on_message(self, client, userdata, message: paho.mqtt.client.MQTTMessage):
+        serial = message.topic.split("/")[1]
+        state = self.__states.get(serial)
+        if state is None:
+            return
+        self.handled += 1
+        msg = json.loads(message.payload)
+        if msg["msg"] == "REQUEST-CURRENT-STATE":
+            self.__publish(serial, {"msg": "CURRENT-STATE", "time": _msg_time(), "mode-reason": "PUI", "product-state": state})
+        elif msg["msg"] == "REQUEST-PRODUCT-ENVIRONMENT-CURRENT-SENSOR-DATA":
+            self.__publish(
+                serial,
+                {
+                    "msg": "ENVIRONMENTAL-CURRENT-SENSOR-DATA",
+                    "time": _msg_time(),
+                    "data": {
+                        "tact": str(2950 + random.randint(-20, 20)),
+                        "hact": "{:04d}".format(random.randint(30, 60)),
+                        "pact": "{:04d}".format(random.randint(0, 10)),
+                        "vact": "{:04d}".format(random.randint(0, 5)),
+                        "sltm": "OFF"
+                    }
+                }
+            )
+        elif msg["msg"] == "STATE-SET":
+            changes = dict()
+            for key, val in msg["data"].items():
+                if key in state:
+                    changes[key] = [state[key], val]
+                    state[key] = val
+            self.__publish(serial, {"msg": "STATE-CHANGE", "time": _msg_time(), "mode-reason": "LAPP", "product-state": changes})
+
+    def start(self, timeout: float = 10):
+        self.__client.connect(self.__host, self.__port)
+        self.__client.loop_start()
+        if not self.__connected.wait(timeout):
+            raise RuntimeError("fleet could not connect to broker")
+
+    def stop(self):
+        self.__client.disconnect()
+        self.__client.loop_stop()
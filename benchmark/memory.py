@@ -0,0 +1,136 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from benchmark.broker import Broker
+from benchmark.fleet import Fleet, gen_serial
+from benchmark.e2e import gen_env, wait_for, rss_mb, repo_path
+import subprocess
+import tracemalloc
+import tempfile
+import argparse
+import json
+import time
+import sys
+import gc
+import os
+
+
+def run_child(size: int, port: int, settle: float, timeout: float, top: int) -> dict:
+    from util import conf, MQTTClient, init_logger
+    from dyson import Device, SessionRegistry
+    from dyson.session import Session
+    from dyson.announcer import Announcer
+    import threading
+    init_logger(conf.Logger.level)
+    mqtt_client = MQTTClient()
+    threading.Thread(target=mqtt_client.start, name="bench-dc-client", daemon=True).start()
+    wait_for(mqtt_client.connected, timeout)
+    announcer = Announcer(mqtt_client=mqtt_client, rate=conf.Discovery.announce_rate, burst=conf.Discovery.announce_burst)
+    announcer.start()
+    device_sessions = SessionRegistry()
+    gc.collect()
+    rss_before = rss_mb()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for i in range(size):
+        device = Device(
+            id="bench-{}".format(gen_serial(i)),
+            model="475",
+            name="bench {}".format(i),
+            local_credentials=json.dumps({"serial": gen_serial(i), "apPasswordHash": "bench"})
+        )
+        session = Session(mqtt_client=mqtt_client, device=device, ip="127.0.0.1", port=port, announcer=announcer)
+        device_sessions.put(session)
+        session.start()
+    wait_for(lambda: all(session.wait_for_connect(0) for session in device_sessions.values()), timeout)
+    # let state and sensor messages flow so buffers and device state are populated
+    time.sleep(settle)
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    rss_after = rss_mb()
+    filters = (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap>"))
+    stats = after.filter_traces(filters).compare_to(before.filter_traces(filters), "filename")
+    total = sum(stat.size_diff for stat in stats)
+    return {
+        "size": size,
+        "bytes_per_device": round(total / size),
+        "rss_kb_per_device": round((rss_after - rss_before) * 1024 / size, 1),
+        "top": [
+            (os.path.relpath(stat.traceback[0].filename, repo_path), round(stat.size_diff / size))
+            for stat in stats[:top]
+        ]
+    }
+
+
+def run_size(size: int, settle: float, sensor_interval: float, timeout: float, top: int) -> dict:
+    broker = Broker()
+    broker.start()
+    broker.ready.wait()
+    fleet = Fleet(size, "127.0.0.1", broker.port)
+    fleet.start()
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            proc = subprocess.run(
+                [
+                    sys.executable, "-m", "benchmark.memory", "--child",
+                    "--sizes", str(size),
+                    "--port", str(broker.port),
+                    "--settle", str(settle),
+                    "--timeout", str(timeout),
+                    "--top", str(top)
+                ],
+                cwd=repo_path,
+                env={**os.environ, **gen_env(size, broker.port, work_dir, sensor_interval)},
+                stdout=subprocess.PIPE,
+                timeout=timeout * 2 + settle + 60
+            )
+        if proc.returncode != 0:
+            raise RuntimeError("benchmark for {} devices failed with exit code {}".format(size, proc.returncode))
+        return json.loads(proc.stdout.decode().strip().splitlines()[-1])
+    finally:
+        fleet.stop()
+        broker.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Memory benchmark: connects device sessions to an emulated fleet of Dyson 475 devices behind the "
+                    "local stand-in broker and reports the Python heap growth per device traced with tracemalloc, "
+                    "the resident memory growth per device and the source files allocating most per device."
+    )
+    parser.add_argument("--sizes", default="10,100,1000", help="comma separated fleet sizes")
+    parser.add_argument("--settle", type=float, default=5, help="seconds of message traffic before measuring")
+    parser.add_argument("--sensor-interval", type=float, default=1, help="sensor polling interval in seconds")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds to wait for connects")
+    parser.add_argument("--top", type=int, default=8, help="number of source files to list")
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+    if args.child:
+        print(json.dumps(run_child(sizes[0], args.port, args.settle, args.timeout, args.top)), flush=True)
+        os._exit(0)
+    results = [run_size(size, args.settle, args.sensor_interval, args.timeout, args.top) for size in sizes]
+    print("{:>8} {:>18} {:>18}".format("devices", "bytes_per_device", "rss_kb_per_device"))
+    for result in results:
+        print("{:>8} {:>18} {:>18}".format(result["size"], result["bytes_per_device"], result["rss_kb_per_device"]))
+    print("\nper device by file at {} devices:".format(results[-1]["size"]))
+    for filename, size in results[-1]["top"]:
+        print("{:>10}  {}".format(size, filename))
+
+
+if __name__ == "__main__":
+    main()
@@ -15,6 +15,9 @@
 """
 
 
+# Frozen copy of the former hand-written codec for the 475, kept as the reference that benchmark/codec.py measures
+# the compiled codecs against. It is not used by the service and works on the state as a plain dict.
+
 import datetime
 import time
 
@@ -0,0 +1,118 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from benchmark.broker import Broker
+from benchmark.e2e import gen_env, percentile, rss_mb, repo_path
+import argparse
+import subprocess
+import tempfile
+import threading
+import json
+import time
+import sys
+import os
+
+
+heavy_modules = ("libdyson", "requests", "urllib3", "Crypto")
+
+
+def run_child(started: float, timeout: float) -> dict:
+    from util import conf, MQTTClient, Router, init_logger
+    from dyson import Discovery, SessionRegistry
+    import dyson.discovery
+    imported = time.time()
+    init_logger(conf.Logger.level)
+    swept = threading.Event()
+
+    def discover_hosts():
+        swept.set()
+        return list()
+
+    dyson.discovery.discover_hosts = discover_hosts
+    dyson.discovery.probe_hosts = lambda hosts: dict()
+    device_sessions = SessionRegistry()
+    mqtt_client = MQTTClient()
+    discovery = Discovery(mqtt_client=mqtt_client, device_sessions=device_sessions)
+    router = Router(refresh_callback=discovery.schedule_publish, device_sessions=device_sessions)
+    mqtt_client.on_connect = discovery.schedule_publish
+    mqtt_client.on_message = router.route
+    discovery.start()
+    threading.Thread(target=mqtt_client.start, name="bench-dc-client", daemon=True).start()
+    if not mqtt_client.wait_for_connect(timeout):
+        raise RuntimeError("not connected after {}s".format(timeout))
+    connected = time.time()
+    if not swept.wait(timeout):
+        raise RuntimeError("no discovery sweep after {}s".format(timeout))
+    return {
+        "import_s": imported - started,
+        "connected_s": connected - started,
+        "first_sweep_s": time.time() - started,
+        "rss_mb": rss_mb(),
+        "heavy_modules": [name for name in heavy_modules if name in sys.modules]
+    }
+
+
+def run_once(port: int, timeout: float) -> dict:
+    with tempfile.TemporaryDirectory() as work_dir:
+        env = {**os.environ, **gen_env(0, port, work_dir, 10)}
+        started = time.time()
+        proc = subprocess.run(
+            [sys.executable, "-m", "benchmark.startup", "--child", "--started", repr(started), "--timeout", str(timeout)],
+            cwd=repo_path,
+            env=env,
+            stdout=subprocess.PIPE,
+            timeout=timeout * 3
+        )
+    if proc.returncode != 0:
+        raise RuntimeError("startup benchmark failed with exit code {}".format(proc.returncode))
+    return json.loads(proc.stdout.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Startup benchmark: measures the time from spawning a fresh interpreter until the modules are "
+                    "imported, the upstream broker connection is established and the first discovery sweep begins. "
+                    "Runs against the local stand-in broker with an empty provisioning file."
+    )
+    parser.add_argument("--repeat", type=int, default=10, help="number of cold starts")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds to wait for connect and first sweep")
+    parser.add_argument("--started", type=float, help=argparse.SUPPRESS)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        print(json.dumps(run_child(args.started, args.timeout)), flush=True)
+        os._exit(0)
+    broker = Broker()
+    broker.start()
+    broker.ready.wait()
+    try:
+        results = [run_once(broker.port, args.timeout) for _ in range(args.repeat)]
+    finally:
+        broker.stop()
+    columns = ("import_s", "connected_s", "first_sweep_s", "rss_mb")
+    print(" ".join("{:>16}".format(column) for column in ("",) + columns))
+    for p in (0.5, 0.9):
+        print(
+            " ".join(
+                ["{:>16}".format("p{}".format(int(p * 100)))] +
+                ["{:>16}".format(round(percentile([result[column] for result in results], p), 3)) for column in columns]
+            )
+        )
+    print("heavy modules loaded: {}".format(", ".join(results[-1]["heavy_modules"]) or "none"))
+
+
+if __name__ == "__main__":
+    main()
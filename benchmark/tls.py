@@ -0,0 +1,110 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from benchmark.broker import Broker
+from benchmark.e2e import percentile
+import paho.mqtt.client
+import subprocess
+import tempfile
+import threading
+import argparse
+import typing
+import time
+import ssl
+import os
+
+
+def gen_server_context(work_dir: str) -> ssl.SSLContext:
+    cert_file = os.path.join(work_dir, "cert.pem")
+    key_file = os.path.join(work_dir, "key.pem")
+    subprocess.run(
+        (
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=bench-device",
+            "-keyout", key_file, "-out", cert_file
+        ),
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_file, key_file)
+    return context
+
+
+def connect_once(port: int, timeout: float) -> typing.Tuple[float, bool]:
+    from dyson.tls import ResumingContext
+    tls_context = ResumingContext("127.0.0.1", port)
+    client = paho.mqtt.client.Client(client_id="bench-tls-session")
+    client.tls_set_context(tls_context)
+    connected = threading.Event()
+    result = dict()
+
+    def on_connect(_client, userdata, flags, rc):
+        sock = _client.socket()
+        tls_context.store_session(sock)
+        result["resumed"] = sock.session_reused
+        connected.set()
+
+    client.on_connect = on_connect
+    started = time.perf_counter()
+    client.connect("127.0.0.1", port)
+    client.loop_start()
+    try:
+        if not connected.wait(timeout):
+            raise RuntimeError("not connected after {}s".format(timeout))
+        return time.perf_counter() - started, result["resumed"]
+    finally:
+        client.disconnect()
+        client.loop_stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="TLS session benchmark: repeatedly connects a device session client to the local stand-in broker "
+                    "over TLS and measures the time until the broker acknowledged the connection, once with full "
+                    "handshakes and once resuming the previous TLS session."
+    )
+    parser.add_argument("--repeat", type=int, default=50, help="connects per mode")
+    parser.add_argument("--timeout", type=float, default=10, help="seconds to wait for each connect")
+    args = parser.parse_args()
+    os.environ.setdefault("CONF_SENERGY_DT_PURE_COOL_LINK", "bench-pure-cool-link")
+    from util import conf
+    with tempfile.TemporaryDirectory() as work_dir:
+        broker = Broker(ssl_context=gen_server_context(work_dir))
+        broker.start()
+        broker.ready.wait()
+        try:
+            results = dict()
+            for mode, cache_size in (("full", 0), ("resumed", 1024)):
+                conf.Session.tls_session_cache = cache_size
+                results[mode] = [connect_once(broker.port, args.timeout) for _ in range(args.repeat)]
+        finally:
+            broker.stop()
+    columns = ("p50_ms", "p90_ms", "resumed")
+    print(" ".join("{:>10}".format(column) for column in ("",) + columns))
+    for mode, samples in results.items():
+        durations = [duration for duration, _ in samples]
+        print(
+            " ".join(
+                ["{:>10}".format(mode)] +
+                ["{:>10}".format(round(percentile(durations, p) * 1000, 2)) for p in (0.5, 0.9)] +
+                ["{:>10}".format("{}/{}".format(sum(resumed for _, resumed in samples), len(samples)))]
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
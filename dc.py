@@ -15,8 +15,9 @@
 """
 
 
-from util import init_logger, conf, MQTTClient, handle_sigterm, delay_start, Router
-from dyson import Discovery
+from util import init_logger, conf, MQTTClient, handle_sigterm, delay_start, Router, TimeSeriesStore, MetricsServer, Profiler, ConfigReloader, Cluster
+from dyson import Discovery, SessionRegistry, GroupCommands, sensor_fields
+import functools
 import signal
 
 
@@ -25,15 +26,87 @@ if __name__ == '__main__':
     signal.signal(signal.SIGINT, handle_sigterm)
     if conf.StartDelay.enabled:
         delay_start(conf.StartDelay.min, conf.StartDelay.max)
-    init_logger(conf.Logger.level)
+    init_logger(conf.Logger.level, conf.Logger.rate_limit_interval, conf.Logger.rate_limit_burst)
+    sensor_history = None
+    cluster = None
     try:
-        device_sessions = dict()
+        profiler = None
+        admin_topic = None
+        if conf.Profiler.enabled:
+            admin_topic = "{}/admin/profiler".format(conf.Client.id)
+            profiler = Profiler(
+                path=conf.Discovery.db_path,
+                interval=conf.Profiler.interval,
+                max_duration=conf.Profiler.max_duration
+            )
+            signal.signal(signal.SIGUSR1, lambda signo, stack_frame: profiler.toggle())
+            signal.signal(signal.SIGUSR2, lambda signo, stack_frame: profiler.dump_stacks())
+        if conf.Metrics.enabled:
+            MetricsServer(host=conf.Metrics.host, port=conf.Metrics.port).start()
+        device_sessions = SessionRegistry()
         mqtt_client = MQTTClient()
-        discovery = Discovery(mqtt_client=mqtt_client, device_sessions=device_sessions)
-        router = Router(refresh_callback=discovery.schedule_publish, device_sessions=device_sessions)
-        mqtt_client.on_connect = discovery.schedule_publish
+        if conf.History.enabled:
+            sensor_history = TimeSeriesStore(
+                path=conf.Discovery.db_path,
+                name="history",
+                fields=sensor_fields,
+                resolutions=[int(res) for res in str(conf.History.resolutions).split(";")],
+                retentions=[int(ret) for ret in str(conf.History.retentions).split(";")],
+                block_size=conf.History.block_size,
+                flush_interval=conf.History.flush_interval,
+                max_pending=conf.History.max_pending_blocks
+            )
+            sensor_history.start()
+        if conf.Cluster.enabled:
+            cluster = Cluster(
+                instance_id=conf.Client.id,
+                host=conf.MsgBroker.host,
+                port=conf.MsgBroker.port,
+                topic=conf.Cluster.topic,
+                heartbeat_interval=conf.Cluster.heartbeat_interval,
+                lease_timeout=conf.Cluster.lease_timeout,
+                vnodes=conf.Cluster.vnodes
+            )
+            cluster.start()
+        discovery = Discovery(
+            mqtt_client=mqtt_client,
+            device_sessions=device_sessions,
+            sensor_history=sensor_history,
+            cluster=cluster
+        )
+        group_topic = None
+        group_commands = None
+        if conf.Group.enabled:
+            group_topic = "{}/group/command".format(conf.Client.id)
+            group_commands = GroupCommands(
+                mqtt_client=mqtt_client,
+                device_sessions=device_sessions,
+                response_topic="{}/group/response".format(conf.Client.id)
+            )
+        router = Router(
+            refresh_callback=functools.partial(discovery.schedule_publish, force=True),
+            device_sessions=device_sessions,
+            admin_topic=admin_topic,
+            admin_callback=profiler.handle_command if profiler else None,
+            group_topic=group_topic,
+            group_callback=group_commands.handle_command if group_commands else None
+        )
+        if admin_topic:
+            mqtt_client.add_subscription(admin_topic, 1)
+        if group_topic:
+            mqtt_client.add_subscription(group_topic, 1)
+        if conf.Reload.file:
+            reloader = ConfigReloader(path=conf.Reload.file, interval=conf.Reload.interval)
+            reloader.add_listener(discovery.reconfigure)
+            signal.signal(signal.SIGHUP, lambda signo, stack_frame: reloader.trigger())
+            reloader.start()
+        # the broker or device manager may have restarted, so unchanged devices are announced again
+        mqtt_client.on_connect = functools.partial(discovery.schedule_publish, force=True)
         mqtt_client.on_message = router.route
         discovery.start()
         mqtt_client.start()
     finally:
-        pass
+        if cluster:
+            cluster.stop()
+        if sensor_history:
+            sensor_history.flush()
@@ -15,12 +15,23 @@
 """
 
 
+from .announcer import *
+from .cloud import *
 from .device import *
 from .discovery import *
+from .group import *
+from .model import *
+from .provisioning import *
 from .session import *
+from .session_registry import *
+from .sharding import *
+from .state import *
 
 
 __all__ = (
     device.__all__,
-    discovery.__all__
+    discovery.__all__,
+    group.__all__,
+    model.__all__,
+    session_registry.__all__
 )
@@ -0,0 +1,79 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ("Announcer", )
+
+
+from util import get_logger, conf, MQTTClient, TokenBucket
+from .device import Device
+import collections
+import threading
+import typing
+import json
+import mgw_dc
+
+
+logger = get_logger(__name__.split(".", 1)[-1])
+
+
+class Announcer(threading.Thread):
+    def __init__(self, mqtt_client: MQTTClient, rate: float, burst: int):
+        super().__init__(name="announcer", daemon=True)
+        self.__mqtt_client = mqtt_client
+        self.__bucket = TokenBucket(rate=rate, burst=burst)
+        self.__pending: typing.OrderedDict[str, typing.Tuple[Device, bool, bool]] = collections.OrderedDict()
+        self.__announced: typing.Dict[str, int] = dict()
+        self.__condition = threading.Condition()
+
+    def __put(self, device: Device, force: bool, delete: bool):
+        with self.__condition:
+            if device.id in self.__pending:
+                force = force or self.__pending[device.id][1]
+            self.__pending[device.id] = (device, force, delete)
+            self.__condition.notify()
+
+    def configure(self, rate: float, burst: int):
+        self.__bucket.configure(rate=rate, burst=burst)
+
+    def announce(self, device: Device, force: bool = False):
+        self.__put(device, force, False)
+
+    def remove(self, device: Device):
+        self.__put(device, True, True)
+
+    def run(self):
+        logger.info("starting {} ...".format(self.name))
+        while True:
+            with self.__condition:
+                while not self.__pending:
+                    self.__condition.wait()
+                device_id, (device, force, delete) = self.__pending.popitem(last=False)
+            try:
+                if delete:
+                    payload = json.dumps(mgw_dc.dm.gen_delete_device_msg(device.to_dm()))
+                else:
+                    payload = json.dumps(mgw_dc.dm.gen_set_device_msg(device.to_dm()))
+                    digest = hash(payload)
+                    if not force and self.__announced.get(device_id) == digest:
+                        continue
+                self.__bucket.consume()
+                self.__mqtt_client.publish(topic=mgw_dc.dm.gen_device_topic(conf.Client.id), payload=payload, qos=1)
+                if delete:
+                    self.__announced.pop(device_id, None)
+                else:
+                    self.__announced[device_id] = digest
+            except Exception as ex:
+                logger.error("announcing '%s' failed - %s", device_id, ex)
@@ -0,0 +1,120 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ("CloudClient", )
+
+
+from util import get_logger, decrypt_password
+import typing
+import time
+
+
+logger = get_logger(__name__.split(".", 1)[-1])
+
+
+class CloudClient:
+    def __init__(self, url: str, auth_api: str, provisioning_api: str, email: str, password: str, country: str, device_id_prefix: str, timeout: float = 10, backoff: float = 30, backoff_max: float = 3600, verify: bool = False):
+        self.__auth_url = "{}/{}".format(url, auth_api)
+        self.__manifest_url = "{}/{}".format(url, provisioning_api)
+        self.__login = {"Email": email, "Password": password}
+        self.__country = country
+        self.__device_id_prefix = device_id_prefix
+        self.__timeout = timeout
+        self.__backoff = backoff
+        self.__backoff_max = backoff_max
+        # requests and urllib3 are only needed for the cloud source and imported here to keep the cold start light
+        import requests.adapters
+        import urllib3
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+        self.__session = requests.Session()
+        self.__session.verify = verify
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=2)
+        self.__session.mount("https://", adapter)
+        self.__session.mount("http://", adapter)
+        self.__credentials: typing.Optional[typing.Tuple[str, str]] = None
+        self.__manifest: typing.Optional[typing.List[dict]] = None
+        self.__validators: typing.Dict[str, str] = dict()
+        self.__failures = 0
+        self.__retry_at = 0.0
+
+    def __authenticate(self):
+        logger.debug("requesting cloud credentials ...")
+        resp = self.__session.post(
+            url=self.__auth_url,
+            params={"country": self.__country},
+            json=self.__login,
+            timeout=self.__timeout
+        )
+        if not resp.ok:
+            raise RuntimeError("retrieving cloud credentials failed - {}".format(resp.status_code))
+        data = resp.json()
+        self.__credentials = (data["Account"], data["Password"])
+
+    def __request_manifest(self) -> "requests.Response":
+        headers = dict()
+        if self.__manifest is not None:
+            if "ETag" in self.__validators:
+                headers["If-None-Match"] = self.__validators["ETag"]
+            if "Last-Modified" in self.__validators:
+                headers["If-Modified-Since"] = self.__validators["Last-Modified"]
+        return self.__session.get(
+            url=self.__manifest_url,
+            auth=self.__credentials,
+            headers=headers,
+            timeout=self.__timeout
+        )
+
+    def __refresh_manifest(self):
+        if not self.__credentials:
+            self.__authenticate()
+        resp = self.__request_manifest()
+        if resp.status_code in (401, 403):
+            logger.debug("cloud credentials rejected - re-authenticating ...")
+            self.__credentials = None
+            self.__authenticate()
+            resp = self.__request_manifest()
+        if resp.status_code == 304 and self.__manifest is not None:
+            logger.debug("cloud manifest not modified")
+        elif resp.ok:
+            self.__manifest = resp.json()
+            self.__validators = {key: resp.headers[key] for key in ("ETag", "Last-Modified") if key in resp.headers}
+        else:
+            raise RuntimeError(resp.status_code)
+
+    def get_devices(self) -> dict:
+        now = time.time()
+        if now < self.__retry_at:
+            raise RuntimeError("retrieving devices from cloud postponed for {}s".format(round(self.__retry_at - now)))
+        try:
+            self.__refresh_manifest()
+            self.__failures = 0
+            self.__retry_at = 0.0
+        except Exception as ex:
+            self.__failures += 1
+            self.__retry_at = now + min(self.__backoff * 2 ** (self.__failures - 1), self.__backoff_max)
+            raise RuntimeError("retrieving devices from cloud failed - {}".format(ex))
+        devices = dict()
+        for item in self.__manifest:
+            devices["{}{}".format(self.__device_id_prefix, item["Serial"])] = {
+                "name": item["Name"],
+                "model": item["ProductType"],
+                "local_credentials": decrypt_password(item["LocalCredentials"]),
+                "last_seen": now
+            }
+        return devices
+
+    def close(self):
+        self.__session.close()
@@ -0,0 +1,166 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ("compile_spec", )
+
+
+from .service import common
+import datetime
+import typing
+import time
+
+
+_not_ready = frozenset(("OFF", "INIT"))
+
+
+class _Compiler:
+    def __init__(self, name: str):
+        self.__name = name
+        self.__namespace = {
+            "_utcnow": datetime.datetime.utcnow,
+            "_strftime": time.strftime,
+            "_gmtime": time.gmtime,
+            "_not_ready": _not_ready
+        }
+
+    def const(self, value) -> str:
+        name = "_c{}".format(len(self.__namespace))
+        self.__namespace[name] = value
+        return name
+
+    def compile(self, func_name: str, args: str, body: typing.List[str]) -> typing.Callable:
+        source = "def {}({}):\n{}\n".format(func_name, args, "\n".join("    " + line for line in body))
+        exec(compile(source, "<codec-{}-{}>".format(self.__name, func_name), "exec"), self.__namespace)
+        func = self.__namespace.pop(func_name)
+        func.__source__ = source
+        return func
+
+    def decode_field(self, source: str, spec: dict) -> typing.Tuple[typing.List[str], str]:
+        value = "{}[{!r}]".format(source, spec["key"])
+        numeric = "int({0})"
+        if "divisor" in spec:
+            numeric = "{} / {!r}".format(numeric, spec["divisor"])
+        if "multiplier" in spec:
+            numeric = "{} * {!r}".format(numeric, spec["multiplier"])
+        if "round" in spec:
+            numeric = "round({}, {})".format(numeric, spec["round"])
+        if "enum" not in spec:
+            return [], numeric.format(value)
+        enum = self.const(dict(spec["enum"]))
+        if spec.get("numeric", False):
+            return ["v = {}".format(value)], "{0}[v] if v in {0} else {1}".format(enum, numeric.format("v"))
+        return [], "{}[{}]".format(enum, value)
+
+    def encode_field(self, argument: str, spec: dict) -> str:
+        if "enum" in spec:
+            enum = self.const(dict(spec["enum"]))
+            if all(isinstance(key, bool) for key in spec["enum"]):
+                return "{}[bool({})]".format(enum, argument)
+            return "{}[{}]".format(enum, argument)
+        if "multiplier" in spec:
+            value = "round({} * {!r})".format(argument, spec["multiplier"])
+        else:
+            value = "int({})".format(argument)
+        return "{}.format({})".format(repr(spec.get("format", "{}")), value)
+
+    def decoder(self, func_name: str, args: str, source: str, fields: typing.Dict[str, dict], pre: typing.Sequence[str] = ()) -> typing.Callable:
+        body = list(pre)
+        items = list()
+        for i, (name, spec) in enumerate(fields.items()):
+            lines, expression = self.decode_field(source, spec)
+            # fields needing a temporary are evaluated up front, all others inline in the returned dict
+            if lines:
+                body.extend(lines)
+                body.append("f{} = {}".format(i, expression))
+                expression = "f{}".format(i)
+            items.append("{!r}: {}".format(name, expression))
+        items.append("'time': _utcnow().isoformat() + 'Z'")
+        body.append("return {{{}}}".format(", ".join(items)))
+        return self.compile(func_name, args, body)
+
+    def encoder(self, func_name: str, spec: dict, set_msg: dict) -> typing.Callable:
+        argument = spec["argument"]
+        value = self.encode_field(argument, spec)
+        if set_msg["mode"] == "full":
+            body = [
+                "d = session.device_state.set_data({}, {}, {!r}, {})".format(
+                    self.const(frozenset(set_msg.get("drop_keys", ()))),
+                    self.const(dict(set_msg.get("extra", dict()))),
+                    spec["key"],
+                    value
+                )
+            ]
+        else:
+            body = ["d = {{{!r}: {}}}".format(spec["key"], value)]
+        body.append(
+            "return {{'msg': {!r}, 'time': _strftime('%Y-%m-%dT%H:%M:%SZ', _gmtime()), 'mode-reason': {!r}, 'data': d}}".format(
+                set_msg["msg"],
+                set_msg["mode_reason"]
+            )
+        )
+        return self.compile(func_name, "session, {}".format(argument), body)
+
+    def request(self, func_name: str, msg: str) -> typing.Callable:
+        return self.compile(func_name, "", ["return {{'msg': {!r}, 'time': _strftime('%Y-%m-%dT%H:%M:%SZ', _gmtime())}}".format(msg)])
+
+
+def compile_spec(spec: dict) -> dict:
+    compiler = _Compiler(spec["name"])
+    state_fields = spec["state"]
+    sensor_fields = spec.get("sensors")
+    set_services = dict()
+    for srv_id, srv_spec in spec.get("set", dict()).items():
+        set_services[srv_id] = compiler.encoder(srv_id, srv_spec, spec["set_msg"])
+    get_services = dict()
+    for srv_id, names in spec.get("get", dict()).items():
+        get_services[srv_id] = compiler.decoder(
+            srv_id,
+            "session",
+            "d",
+            {name: state_fields[name] for name in names},
+            pre=("d = session.device_state.data", )
+        )
+    push_readings_srv = None
+    gen_sensor_data_req_msg = None
+    if sensor_fields:
+        not_ready = " or ".join("d[{!r}] in _not_ready".format(field["key"]) for field in sensor_fields.values())
+        push_readings_srv = (
+            spec["push_readings_srv"],
+            compiler.decoder(
+                "push_sensor_readings",
+                "data",
+                "d",
+                sensor_fields,
+                pre=("d = data['data']", "if {}:".format(not_ready), "    raise RuntimeError('sensors not ready')")
+            )
+        )
+        gen_sensor_data_req_msg = compiler.request("gen_sensor_data_req_msg", spec["sensor_req_msg"])
+        get_services["getSensorHistory"] = common.get_sensor_history
+    return dict(
+        type=spec["device_type"],
+        command_topic=spec["command_topic"],
+        state_topic=spec["state_topic"],
+        msg_type_field="msg",
+        device_state_msg_types=spec["state_msg_types"],
+        set_services=set_services,
+        get_services=get_services,
+        gen_state_req_msg=compiler.request("gen_state_req_msg", spec["state_req_msg"]),
+        gen_sensor_data_req_msg=gen_sensor_data_req_msg,
+        sensor_data_msg_types=spec.get("sensor_msg_types", tuple()),
+        push_state_srv=(spec["push_state_srv"], compiler.decoder("push_device_state", "d", "d", state_fields)),
+        push_readings_srv=push_readings_srv,
+        parse_device_state=common.apply_device_state
+    )
@@ -22,8 +22,21 @@ from .model import Model, model_map
 import mgw_dc
 
 
-class Device(mgw_dc.dm.Device):
+class Device:
+    """
+    Device known to the connector. Kept slotted for large fleets, the mgw_dc.dm.Device needed for device-manager
+    messages is only created when announcing.
+    """
+
+    __slots__ = ("id", "name", "type", "state", "model", "local_credentials")
+
     def __init__(self, id: str, model: str, name: str, local_credentials: str):
         self.model: Model = model_map[model]
         self.local_credentials = local_credentials
-        super().__init__(id=id, name=name, type=self.model.type, state=mgw_dc.dm.device_state.offline)
+        self.id = id
+        self.name = name
+        self.type = self.model.type
+        self.state = mgw_dc.dm.device_state.offline
+
+    def to_dm(self) -> mgw_dc.dm.Device:
+        return mgw_dc.dm.Device(id=self.id, name=self.name, type=self.type, state=self.state)
@@ -18,85 +18,54 @@
 __all__ = ("Discovery", )
 
 
-from util import get_logger, conf, MQTTClient, Storage, diff, to_dict
+from util import get_logger, conf, MQTTClient, Storage, TimeSeriesStore, Cluster, HashRing, registry, diff, to_dict
 from .device import Device
-from .session import Session
-import urllib3
+from .session import Session, SessionEvent
+from .session_registry import SessionRegistry
+from .sharding import WorkerPool, ShardedSession
+from .announcer import Announcer
+from .cloud import CloudClient
+from .provisioning import Provisioner, read_provisioning_file
+import concurrent.futures
 import threading
 import subprocess
-import requests
+import queue
 import time
-import json
 import typing
 import socket
+import selectors
+import errno
 import mgw_dc
-import libdyson
 
 
 logger = get_logger(__name__.split(".", 1)[-1])
 
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
 probe_ports = [int(port) for port in str(conf.Discovery.ports).split(";")]
 
-
-def get_cloud_credentials() -> typing.Tuple[str, str]:
-    try:
-        resp = requests.post(
-            url="{}/{}?country={}".format(conf.Discovery.cloud_url, conf.Discovery.cloud_auth_api, conf.Account.country),
-            json={"Email": conf.Account.email, "Password": conf.Account.pw},
-            verify=False
-        )
-        if resp.ok:
-            data = resp.json()
-            return data["Account"], data["Password"]
-        else:
-            raise RuntimeError(resp.status_code)
-    except Exception as ex:
-        raise RuntimeError("retrieving cloud credentials failed - {}".format(ex))
-
-
-def get_cloud_devices(acc: str, pw: str):
-    try:
-        resp = requests.get(
-            url="{}/{}".format(conf.Discovery.cloud_url, conf.Discovery.cloud_provisioning_api),
-            auth=(acc, pw),
-            verify=False
-        )
-        if resp.ok:
-            data = resp.json()
-            devices = dict()
-            for item in data:
-                devices["{}{}".format(conf.Discovery.device_id_prefix, item['Serial'])] = {
-                    "name": item["Name"],
-                    "model": item["ProductType"],
-                    "local_credentials": item["LocalCredentials"],
-                    "last_seen": time.time()
-                }
-            return devices
-        else:
-            raise RuntimeError(resp.status_code)
-    except Exception as ex:
-        raise RuntimeError("retrieving devices from cloud failed - {}".format(ex))
-
-
-def get_static_device():
-    try:
-        serial, pw_hash, model = libdyson.get_mqtt_info_from_wifi_info(
-            wifi_ssid=conf.Discovery.device_wifi_ssid,
-            wifi_password=conf.Discovery.device_wifi_password
-        )
-        devices = {
-            "{}{}".format(conf.Discovery.device_id_prefix, serial): {
-                "name": conf.Discovery.device_name,
-                "model": model,
-                "local_credentials": "{" + '"serial": "{}", "apPasswordHash": "{}"'.format(serial, pw_hash) + "}",
-                "last_seen": time.time()
-            }
+sweep_duration = registry.histogram(
+    "dyson_dc_discovery_sweep_duration_seconds",
+    "Duration of host discovery and probing sweeps.",
+    buckets=(1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+)
+hosts_alive = registry.gauge("dyson_dc_discovery_hosts_alive", "Hosts answering pings in the last sweep.")
+hosts_probed = registry.gauge("dyson_dc_discovery_hosts_probed", "Hosts with an open device port in the last sweep.")
+probe_cache_hits = registry.counter("dyson_dc_discovery_probe_cache_hits_total", "Hosts not probed due to a cached result.")
+
+# host -> (expiry, (hostname, (host, port)) or None)
+_probe_cache: typing.Dict[str, typing.Tuple[float, typing.Optional[typing.Tuple[str, tuple]]]] = dict()
+_probe_cache_lock = threading.Lock()
+# host -> hardware address from the last sweep
+_neighbours: typing.Dict[str, str] = dict()
+
+
+def get_static_entries() -> typing.List[dict]:
+    return [
+        {
+            "wifi_ssid": conf.Discovery.device_wifi_ssid,
+            "wifi_password": conf.Discovery.device_wifi_password,
+            "name": conf.Discovery.device_name
         }
-        return devices
-    except Exception as ex:
-        raise RuntimeError("retrieving static device failed - {}".format(ex))
+    ]
 
 
 def ping(host) -> bool:
@@ -108,7 +77,7 @@ def get_local_ip() -> str:
         with open(conf.Discovery.ip_file, "r") as file:
             ip_addr = file.readline().strip()
         if ip_addr:
-            logger.debug("host ip address is '{}'".format(ip_addr))
+            logger.debug("host ip address is '%s'", ip_addr)
             return ip_addr
         else:
             raise RuntimeError("file empty")
@@ -134,7 +103,7 @@ def discover_hosts_worker(ip_range, alive_hosts):
 
 def discover_hosts() -> list:
     ip_range = get_ip_range(get_local_ip())
-    logger.debug("scanning ip range '{}-254' ...".format(ip_range[0]))
+    logger.debug("scanning ip range '%s-254' ...", ip_range[0])
     alive_hosts = list()
     workers = list()
     bin = 0
@@ -154,23 +123,96 @@ def discover_hosts() -> list:
     return alive_hosts
 
 
+def read_neighbours() -> typing.Dict[str, str]:
+    neighbours = dict()
+    with open(conf.Discovery.arp_file, "r") as file:
+        next(file)
+        for line in file:
+            fields = line.split()
+            # incomplete entries carry no hardware address
+            if len(fields) >= 4 and int(fields[2], 16) and fields[3] != "00:00:00:00:00:00":
+                neighbours[fields[0]] = fields[3]
+    return neighbours
+
+
+def refresh_neighbours():
+    try:
+        neighbours = read_neighbours()
+    except Exception as ex:
+        logger.debug("reading neighbour table failed - %s", ex)
+        return
+    # a new or replaced hardware address means a different device may answer, cached results do not apply anymore
+    for host, hw_addr in neighbours.items():
+        if _neighbours.get(host) != hw_addr:
+            invalidate_probe_cache(host)
+    _neighbours.clear()
+    _neighbours.update(neighbours)
+
+
+def invalidate_probe_cache(host: typing.Optional[str] = None):
+    with _probe_cache_lock:
+        if host:
+            _probe_cache.pop(host, None)
+        else:
+            _probe_cache.clear()
+
+
+def probe_host(host) -> typing.Optional[int]:
+    ports = list(probe_ports)
+    selector = selectors.DefaultSelector()
+    try:
+        for port in ports:
+            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            s.setblocking(False)
+            err = s.connect_ex((host, port))
+            if err in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                selector.register(s, selectors.EVENT_WRITE, port)
+            else:
+                s.close()
+        deadline = time.monotonic() + conf.Discovery.probe_timeout
+        open_ports = set()
+        while selector.get_map() and not open_ports:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            for key, _ in selector.select(remaining):
+                if not key.fileobj.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR):
+                    open_ports.add(key.data)
+                selector.unregister(key.fileobj)
+                key.fileobj.close()
+        # ports connecting in the same round are ranked by their configured order
+        for port in ports:
+            if port in open_ports:
+                return port
+    finally:
+        for key in list(selector.get_map().values()):
+            key.fileobj.close()
+        selector.close()
+
+
 def probe_hosts_worker(hosts, positive_hosts: dict):
     for host in hosts:
-        try:
-            hostname = socket.getfqdn(host)
-            if hostname != host:
-                for port in probe_ports:
-                    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                    s.settimeout(conf.Discovery.probe_timeout)
-                    try:
-                        s.connect((host, port))
-                        s.close()
-                        positive_hosts[hostname.upper()] = (host, port)
-                        break
-                    except Exception:
-                        pass
-        except Exception:
-            pass
+        with _probe_cache_lock:
+            expiry, result = _probe_cache.get(host, (0, None))
+        if expiry > time.time():
+            probe_cache_hits.inc()
+        else:
+            result = None
+            try:
+                hostname = socket.getfqdn(host)
+                # hosts without a reverse name are cached like closed ports, a device joining later shows up in
+                # the neighbour table and is looked up again
+                if hostname != host:
+                    port = probe_host(host)
+                    if port:
+                        result = (hostname.upper(), (host, port))
+                ttl = conf.Discovery.probe_ttl if result else conf.Discovery.probe_negative_ttl
+                with _probe_cache_lock:
+                    _probe_cache[host] = (time.time() + ttl, result)
+            except Exception:
+                pass
+        if result:
+            positive_hosts[result[0]] = result[1]
 
 
 def probe_hosts(hosts) -> dict:
@@ -208,78 +250,149 @@ class Discovery(threading.Thread):
             "last_seen TEXT NOT NULL"
         )
     )
+    __locations_table = (
+        "locations",
+        (
+            "id TEXT NOT NULL UNIQUE PRIMARY KEY",
+            "ip TEXT NOT NULL",
+            "port INTEGER NOT NULL",
+            "last_seen TEXT NOT NULL"
+        )
+    )
 
-    def __init__(self, mqtt_client: MQTTClient, device_sessions: typing.Dict[str, Session]):
+    def __init__(self, mqtt_client: MQTTClient, device_sessions: SessionRegistry, sensor_history: typing.Optional[TimeSeriesStore] = None, cluster: typing.Optional[Cluster] = None):
         super().__init__(name="discovery", daemon=True)
         self.__mqtt_client = mqtt_client
+        self.__cluster = cluster
+        self.__ring: typing.Optional[HashRing] = None
+        self.__ring_changed = threading.Event()
+        self.__takeovers: typing.Dict[str, float] = dict()
         self.__device_sessions = device_sessions
+        self.__sensor_history = sensor_history
         self.__device_pool: typing.Dict[str, Device] = dict()
-        self.__publish_flag = False
+        self.__publish_flag = 0
+        self.__force_publish = False
         self.__lock = threading.Lock()
-        self.__local_storage = Storage(conf.Discovery.db_path, "devices", (Discovery.__devices_table,))
+        self.__session_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=conf.Discovery.session_workers,
+            thread_name_prefix="session-starter"
+        )
+        self.__connect_results = queue.Queue()
+        self.__exited_sessions = queue.Queue()
+        self.__connect_retries: typing.Dict[str, typing.Tuple[float, tuple, int]] = dict()
+        self.__connecting: typing.Set[str] = set()
+        self.__resuming: typing.Set[str] = set()
+        self.__positive_hosts: typing.Dict[str, tuple] = dict()
+        registry.gauge(
+            "dyson_dc_sessions_alive",
+            "Device sessions with a running thread.",
+            func=lambda: self.__device_sessions.count(SessionEvent.started, SessionEvent.online, SessionEvent.offline)
+        )
+        registry.gauge(
+            "dyson_dc_sessions_online",
+            "Device sessions connected to their device.",
+            func=lambda: self.__device_sessions.count(SessionEvent.online)
+        )
+        self.__device_sessions.subscribe(SessionEvent.exited, self.__exited_sessions.put)
+        registry.gauge(
+            "dyson_dc_command_queue_depth",
+            "Commands waiting in all session queues.",
+            func=lambda: sum(session.command_queue_size() for session in self.__device_sessions.values())
+        )
+        self.__announcer = Announcer(
+            mqtt_client=mqtt_client,
+            rate=conf.Discovery.announce_rate,
+            burst=conf.Discovery.announce_burst
+        )
+        self.__worker_pool = WorkerPool(
+            size=conf.Sharding.workers,
+            mqtt_client=mqtt_client,
+            announcer=self.__announcer,
+            sensor_history=sensor_history
+        ) if conf.Sharding.workers > 0 else None
+        self.__local_storage = Storage(
+            conf.Discovery.db_path,
+            "devices",
+            (Discovery.__devices_table, Discovery.__locations_table)
+        )
+        self.__locations: typing.Dict[str, tuple] = {
+            item["id"]: (item["ip"], item["port"]) for item in self.__local_storage.read(Discovery.__locations_table[0])
+        }
+        self.__cloud_client = CloudClient(
+            url=conf.Discovery.cloud_url,
+            auth_api=conf.Discovery.cloud_auth_api,
+            provisioning_api=conf.Discovery.cloud_provisioning_api,
+            email=conf.Account.email,
+            password=conf.Account.pw,
+            country=conf.Account.country,
+            device_id_prefix=conf.Discovery.device_id_prefix,
+            timeout=conf.Discovery.cloud_timeout,
+            backoff=conf.Discovery.cloud_backoff,
+            backoff_max=conf.Discovery.cloud_backoff_max
+        ) if conf.Discovery.source == "cloud" else None
+        if cluster:
+            cluster.on_change = self.__ring_changed.set
+        self.__provisioner = Provisioner(
+            db_path=conf.Discovery.db_path,
+            device_id_prefix=conf.Discovery.device_id_prefix
+        ) if conf.Discovery.source != "cloud" else None
 
     def __handle_new_device(self, device_id: str, data: dict):
         try:
-            logger.info("adding '{}'".format(device_id))
+            logger.info("adding '%s'", device_id)
             del data["last_seen"]
             device = Device(id=device_id, **data)
-            self.__mqtt_client.publish(
-                topic=mgw_dc.dm.gen_device_topic(conf.Client.id),
-                payload=json.dumps(mgw_dc.dm.gen_set_device_msg(device)),
-                qos=1
-            )
+            if self.__owns(device_id):
+                self.__announcer.announce(device)
             self.__device_pool[device_id] = device
         except Exception as ex:
-            logger.error("adding '{}' failed - {}".format(device_id, ex))
+            logger.error("adding '%s' failed - %s", device_id, ex)
 
     def __handle_missing_device(self, device_id: str):
         try:
-            logger.info("removing '{}' ...".format(device_id))
+            logger.info("removing '%s' ...", device_id)
             device = self.__device_pool[device_id]
-            self.__mqtt_client.publish(
-                topic=mgw_dc.dm.gen_device_topic(conf.Client.id),
-                payload=json.dumps(mgw_dc.dm.gen_delete_device_msg(device)),
-                qos=1
-            )
+            self.__announcer.remove(device)
             del self.__device_pool[device_id]
+            # per-device series would otherwise accumulate for every device ever seen
+            if self.__worker_pool:
+                self.__worker_pool.remove_series(device_id)
+            else:
+                registry.remove_series("device", device_id)
         except Exception as ex:
-            logger.error("removing '{}' failed - {}".format(device_id, ex))
+            logger.error("removing '%s' failed - %s", device_id, ex)
 
     def __handle_existing_device(self, device_id: str, data: dict):
         try:
-            logger.info("updating '{}' ...".format(device_id))
+            logger.info("updating '%s' ...", device_id)
             device = self.__device_pool[device_id]
             if device.name != data["name"]:
-                name_bk = device.name
                 device.name = data["name"]
-                try:
-                    self.__mqtt_client.publish(
-                        topic=mgw_dc.dm.gen_device_topic(conf.Client.id),
-                        payload=json.dumps(mgw_dc.dm.gen_set_device_msg(device)),
-                        qos=1
-                    )
-                except Exception as ex:
-                    device.name = name_bk
-                    raise ex
+                if self.__owns(device_id):
+                    self.__announcer.announce(device)
             # if device.local_credentials != data["local_credentials"]:
             #     device.local_credentials = data["local_credentials"]
         except Exception as ex:
-            logger.error("updating '{}' failed - {}".format(device_id, ex))
+            logger.error("updating '%s' failed - %s", device_id, ex)
 
     def __refresh_local_storage(self):
         try:
             logger.info("refreshing local storage ...")
             local_devices = to_dict(self.__local_storage.read(Discovery.__devices_table[0]), "id")
-            # remote_devices = get_cloud_devices(*get_cloud_credentials())
-            remote_devices = get_static_device()
+            if self.__cloud_client:
+                remote_devices = self.__cloud_client.get_devices()
+            elif conf.Discovery.source == "file":
+                remote_devices = self.__provisioner.get_devices(read_provisioning_file(conf.Discovery.provisioning_file))
+            else:
+                remote_devices = self.__provisioner.get_devices(get_static_entries())
             new_devices, missing_devices, existing_devices = diff(local_devices, remote_devices)
             if new_devices:
                 for device_id in new_devices:
-                    logger.info("adding record for '{}' ...".format(device_id))
+                    logger.info("adding record for '%s' ...", device_id)
                     try:
                         self.__local_storage.create(Discovery.__devices_table[0], {"id": device_id, **remote_devices[device_id]})
                     except Exception as ex:
-                        logger.error("adding record for '{}' failed - {}".format(device_id, ex))
+                        logger.error("adding record for '%s' failed - %s", device_id, ex)
             if missing_devices:
                 for device_id in missing_devices:
                     try:
@@ -287,29 +400,30 @@ class Discovery(threading.Thread):
                         now = time.time()
                         age = now - float(device_data[0]["last_seen"])
                         if age > conf.Discovery.grace_period:
-                            logger.info("removing record for '{}' due to exceeded grace period ...".format(device_id))
+                            logger.info("removing record for '%s' due to exceeded grace period ...", device_id)
                             try:
                                 self.__local_storage.delete(Discovery.__devices_table[0], id=device_id)
+                                self.__local_storage.delete(Discovery.__locations_table[0], id=device_id)
+                                self.__locations.pop(device_id, None)
                             except Exception as ex:
-                                logger.error("removing record for '{}' failed - {}".format(device_id, ex))
+                                logger.error("removing record for '%s' failed - %s", device_id, ex)
                         else:
                             logger.info(
-                                "remaining grace period for missing '{}': {}s".format(
-                                    device_id,
-                                    conf.Discovery.grace_period - age
-                                )
+                                "remaining grace period for missing '%s': %ss",
+                                device_id,
+                                conf.Discovery.grace_period - age
                             )
                     except Exception as ex:
-                        logger.error("can't calculate grace period for missing '{}' - {}".format(device_id, ex))
+                        logger.error("can't calculate grace period for missing '%s' - %s", device_id, ex)
             if existing_devices:
                 for device_id in existing_devices:
-                    logger.info("updating record for '{}' ...".format(device_id))
+                    logger.info("updating record for '%s' ...", device_id)
                     try:
                         self.__local_storage.update(Discovery.__devices_table[0], remote_devices[device_id], id=device_id)
                     except Exception as ex:
-                        logger.error("updating record for '{}' failed - {}".format(device_id, ex))
+                        logger.error("updating record for '%s' failed - %s", device_id, ex)
         except Exception as ex:
-            logger.error("refreshing local storage failed - {}".format(ex))
+            logger.error("refreshing local storage failed - %s", ex)
 
     def __refresh_devices(self):
         try:
@@ -325,71 +439,265 @@ class Discovery(threading.Thread):
                 for device_id in existing_devices:
                     self.__handle_existing_device(device_id, stored_devices[device_id])
         except Exception as ex:
-            logger.error("refreshing devices failed - {}".format(ex))
-
-    def __start_device_session(self, device: Device, location: tuple):
-        logger.info("found '{}' at '{}'".format(device.id, location[0]))
-        session = Session(
-            mqtt_client=self.__mqtt_client,
-            device=device,
-            ip=location[0],
-            port=location[1]
-        )
-        session.start()
-        self.__device_sessions[device.id] = session
+            logger.error("refreshing devices failed - %s", ex)
+
+    def __store_location(self, device_id: str, location: tuple):
+        try:
+            record = {"ip": location[0], "port": location[1], "last_seen": str(time.time())}
+            if device_id in self.__locations:
+                self.__local_storage.update(Discovery.__locations_table[0], record, id=device_id)
+            else:
+                self.__local_storage.create(Discovery.__locations_table[0], {"id": device_id, **record})
+            self.__locations[device_id] = location
+        except Exception as ex:
+            logger.error("storing location of '%s' failed - %s", device_id, ex)
+
+    def __find_location(self, device_id: str) -> typing.Optional[tuple]:
+        serial = device_id.replace(conf.Discovery.device_id_prefix, "")
+        for hostname, data in self.__positive_hosts.items():
+            if serial in hostname:
+                return data
+
+    def __owns(self, device_id: str) -> bool:
+        return not self.__ring or self.__ring.owner(device_id) == self.__cluster.instance_id
+
+    def __handle_ring_change(self):
+        self.__ring_changed.clear()
+        old_ring, self.__ring = self.__ring, self.__cluster.ring
+        instance_id = self.__cluster.instance_id
+        for device_id, device in self.__device_pool.items():
+            old_owner = old_ring.owner(device_id)
+            new_owner = self.__ring.owner(device_id)
+            if old_owner == instance_id and new_owner != instance_id:
+                logger.info("handing over '%s' to '%s'", device_id, new_owner)
+                self.__takeovers.pop(device_id, None)
+                self.__connect_retries.pop(device_id, None)
+                self.__connecting.discard(device_id)
+                self.__resuming.discard(device_id)
+                session = self.__device_sessions.get(device_id)
+                # the device stays announced, the new owner only takes over its session and command topic
+                if session:
+                    self.__device_sessions.remove(device_id, session)
+                    session.stop()
+                try:
+                    self.__mqtt_client.unsubscribe(topic=mgw_dc.com.gen_command_topic(device_id))
+                except Exception as ex:
+                    logger.error("unsubscribing device '%s' failed - %s", device_id, ex)
+            elif old_owner != instance_id and new_owner == instance_id:
+                # a live previous owner needs a moment to release the device, a departed one does not
+                delay = conf.Cluster.handover_delay if old_owner in self.__ring.members else 0
+                logger.info("taking over '%s' from '%s' in %ss", device_id, old_owner, delay)
+                self.__takeovers[device_id] = time.time() + delay
+
+    def __handle_takeovers(self):
+        now = time.time()
+        for device_id, due in list(self.__takeovers.items()):
+            if due > now:
+                continue
+            del self.__takeovers[device_id]
+            device = self.__device_pool.get(device_id)
+            if not device or not self.__owns(device_id):
+                continue
+            self.__announcer.announce(device)
+            if device_id not in self.__device_sessions:
+                location = self.__find_location(device_id) or self.__locations.get(device_id)
+                if location:
+                    self.__start_device_session(device=device, location=location)
+
+    def __resume_sessions(self):
+        for device_id, location in self.__locations.items():
+            device = self.__device_pool.get(device_id)
+            if device and device_id not in self.__device_sessions and self.__owns(device_id):
+                logger.info("resuming '%s' at last known '%s' ...", device_id, location[0])
+                self.__resuming.add(device_id)
+                self.__start_device_session(device=device, location=location)
+
+    def __connect_session(self, session: Session, location: tuple, attempt: int):
+        error = None
+        try:
+            session.connect()
+            session.start()
+            if not session.wait_for_connect(timeout=conf.Discovery.connect_timeout):
+                raise RuntimeError("no connection after {}s".format(conf.Discovery.connect_timeout))
+        except Exception as ex:
+            error = ex
+        self.__connect_results.put((session, location, attempt, error))
+
+    def __start_device_session(self, device: Device, location: tuple, attempt: int = 0):
+        logger.info("found '%s' at '%s'", device.id, location[0])
+        if self.__worker_pool:
+            session = ShardedSession(
+                pool=self.__worker_pool,
+                device=device,
+                ip=location[0],
+                port=location[1],
+                lifecycle_callback=self.__device_sessions.notify
+            )
+        else:
+            session = Session(
+                mqtt_client=self.__mqtt_client,
+                device=device,
+                ip=location[0],
+                port=location[1],
+                announcer=self.__announcer,
+                sensor_history=self.__sensor_history,
+                lifecycle_callback=self.__device_sessions.notify
+            )
+        self.__device_sessions.put(session)
+        self.__connect_retries.pop(device.id, None)
+        self.__connecting.add(device.id)
+        self.__session_pool.submit(self.__connect_session, session, location, attempt)
+
+    def __handle_connect_results(self, timeout: float):
+        try:
+            session, location, attempt, error = self.__connect_results.get(timeout=timeout)
+            while True:
+                device_id = session.device_id
+                if self.__device_sessions.get(device_id) is session:
+                    self.__connecting.discard(device_id)
+                    resumed = device_id in self.__resuming
+                    self.__resuming.discard(device_id)
+                    if not error:
+                        logger.info("connected '%s' at '%s'", device_id, location[0])
+                        if self.__locations.get(device_id) != location:
+                            self.__store_location(device_id, location)
+                        if self.__device_sessions.state(device_id) == SessionEvent.exited:
+                            self.__device_sessions.remove(device_id, session)
+                    elif session.is_alive():
+                        logger.warning("connecting '%s' at '%s' pending - %s", device_id, location[0], error)
+                    elif resumed:
+                        logger.warning(
+                            "resuming '%s' at '%s' failed - %s - waiting for discovery",
+                            device_id,
+                            location[0],
+                            error
+                        )
+                        self.__device_sessions.remove(device_id, session)
+                        location = self.__find_location(device_id)
+                        device = self.__device_pool.get(device_id)
+                        if location and device:
+                            self.__start_device_session(device=device, location=location)
+                    elif attempt < conf.Discovery.connect_retries:
+                        invalidate_probe_cache(location[0])
+                        logger.warning(
+                            "connecting '%s' at '%s' failed - %s - retrying in %ss",
+                            device_id,
+                            location[0],
+                            error,
+                            conf.Discovery.connect_retry_delay
+                        )
+                        self.__connect_retries[device_id] = (
+                            time.time() + conf.Discovery.connect_retry_delay,
+                            location,
+                            attempt + 1
+                        )
+                    else:
+                        invalidate_probe_cache(location[0])
+                        logger.error("connecting '%s' at '%s' failed - %s", device_id, location[0], error)
+                        self.__device_sessions.remove(device_id, session)
+                session, location, attempt, error = self.__connect_results.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            while True:
+                session = self.__exited_sessions.get_nowait()
+                device_id = session.device_id
+                if device_id not in self.__connecting and device_id not in self.__connect_retries:
+                    self.__device_sessions.remove(device_id, session)
+        except queue.Empty:
+            pass
+        now = time.time()
+        for device_id, (retry_at, location, attempt) in list(self.__connect_retries.items()):
+            if retry_at <= now:
+                del self.__connect_retries[device_id]
+                device = self.__device_pool.get(device_id)
+                session = self.__device_sessions.get(device_id)
+                if device and session and not session.is_alive() and self.__owns(device_id):
+                    self.__start_device_session(device=device, location=location, attempt=attempt)
 
     def run(self) -> None:
-        if not self.__mqtt_client.connected():
-            time.sleep(3)
-        logger.info("starting {} ...".format(self.name))
+        if not self.__mqtt_client.wait_for_connect(conf.Discovery.broker_timeout):
+            logger.warning(
+                "not connected to '%s' after %ss - starting discovery anyway",
+                conf.MsgBroker.host,
+                conf.Discovery.broker_timeout
+            )
+        if self.__cluster:
+            if not self.__cluster.wait_ready(conf.Discovery.broker_timeout):
+                logger.warning("cluster membership unknown after %ss", conf.Discovery.broker_timeout)
+            self.__ring = self.__cluster.ring
+        logger.info("starting %s ...", self.name)
+        self.__announcer.start()
+        if self.__worker_pool:
+            self.__worker_pool.start()
+        if conf.Discovery.fast_resume:
+            self.__refresh_devices()
+            self.__resume_sessions()
         self.__refresh_local_storage()
-        # last_cloud_check = time.time()
+        last_source_check = time.time()
         self.__refresh_devices()
+        last_sweep = 0
         while True:
+            if self.__ring_changed.is_set():
+                self.__handle_ring_change()
+            if self.__takeovers:
+                self.__handle_takeovers()
             if self.__publish_flag:
                 self.__publish_devices(self.__publish_flag)
-            # if time.time() - last_cloud_check > conf.Discovery.cloud_delay:
-            #     self.__refresh_local_storage()
-            #     last_cloud_check = time.time()
-            #     self.__refresh_devices()
-            try:
-                positive_hosts = probe_hosts(discover_hosts())
-                for device in self.__device_pool.values():
-                    if device.id not in self.__device_sessions:
-                        for hostname, data in positive_hosts.items():
-                            if device.id.replace(conf.Discovery.device_id_prefix, "") in hostname:
-                                self.__start_device_session(device=device, location=data)
-                                break
-                    else:
-                        if not self.__device_sessions[device.id].is_alive():
-                            del self.__device_sessions[device.id]
-                            for hostname, data in positive_hosts.items():
-                                if device.id.replace(conf.Discovery.device_id_prefix, "") in hostname:
-                                    self.__start_device_session(device=device, location=data)
-                                    break
-            except Exception as ex:
-                logger.error("discovery failed - {}".format(ex))
-            time.sleep(conf.Discovery.delay)
+            if conf.Discovery.source != "static" and time.time() - last_source_check > conf.Discovery.cloud_delay:
+                self.__refresh_local_storage()
+                last_source_check = time.time()
+                self.__refresh_devices()
+            if time.time() >= last_sweep + conf.Discovery.delay:
+                try:
+                    started = time.monotonic()
+                    alive_hosts = discover_hosts()
+                    refresh_neighbours()
+                    self.__positive_hosts = probe_hosts(alive_hosts)
+                    sweep_duration.observe(time.monotonic() - started)
+                    hosts_alive.set(len(alive_hosts))
+                    hosts_probed.set(len(self.__positive_hosts))
+                    for device in self.__device_pool.values():
+                        if device.id not in self.__device_sessions and device.id not in self.__takeovers and self.__owns(device.id):
+                            location = self.__find_location(device.id)
+                            if location:
+                                self.__start_device_session(device=device, location=location)
+                except Exception as ex:
+                    logger.error("discovery failed - %s", ex)
+                last_sweep = time.time()
+            self.__handle_connect_results(timeout=max(min(last_sweep + conf.Discovery.delay - time.time(), 1), 0))
 
     def __publish_devices(self, flag: int):
         with self.__lock:
+            force = self.__force_publish
             if self.__publish_flag == flag:
                 self.__publish_flag = 0
+                self.__force_publish = False
         for device in self.__device_pool.values():
-            try:
-                self.__mqtt_client.publish(
-                    topic=mgw_dc.dm.gen_device_topic(conf.Client.id),
-                    payload=json.dumps(mgw_dc.dm.gen_set_device_msg(device)),
-                    qos=1
-                )
-            except Exception as ex:
-                logger.error("setting device '{}' failed - {}".format(device.id, ex))
+            if not self.__owns(device.id):
+                continue
+            self.__announcer.announce(device, force=force)
             if flag > 1 and device.state == mgw_dc.dm.device_state.online:
                 try:
                     self.__mqtt_client.subscribe(topic=mgw_dc.com.gen_command_topic(device.id), qos=1)
                 except Exception as ex:
-                    logger.error("subscribing device '{}' failed - {}".format(device.id, ex))
+                    logger.error("subscribing device '%s' failed - %s", device.id, ex)
+
+    def reconfigure(self, changed: typing.Set[typing.Tuple[str, str]]):
+        if ("Discovery", "ports") in changed:
+            probe_ports[:] = [int(port) for port in str(conf.Discovery.ports).split(";")]
+            invalidate_probe_cache()
+        if ("Discovery", "announce_rate") in changed or ("Discovery", "announce_burst") in changed:
+            self.__announcer.configure(rate=conf.Discovery.announce_rate, burst=conf.Discovery.announce_burst)
+        if any(section == "Session" for section, _ in changed):
+            for session in self.__device_sessions.values():
+                session.reconfigure()
+        if self.__worker_pool:
+            self.__worker_pool.reconfigure(
+                {(section, key): getattr(getattr(conf, section), key) for section, key in changed}
+            )
 
-    def schedule_publish(self, subscribe: bool = False):
+    def schedule_publish(self, subscribe: bool = False, force: bool = False):
         with self.__lock:
-            self.__publish_flag = max(self.__publish_flag, int(subscribe) + 1)
\ No newline at end of file
+            self.__publish_flag = max(self.__publish_flag, int(subscribe) + 1)
+            self.__force_publish = self.__force_publish or force
\ No newline at end of file
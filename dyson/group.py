@@ -0,0 +1,147 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ("GroupCommands", )
+
+
+from util import get_logger, conf, MQTTClient, registry
+from .session_registry import SessionRegistry
+import threading
+import typing
+import json
+import time
+import mgw_dc
+
+
+logger = get_logger(__name__.split(".", 1)[-1])
+
+group_commands = registry.counter("dyson_dc_group_commands_total", "Group commands received.")
+group_latency = registry.histogram(
+    "dyson_dc_group_command_latency_seconds",
+    "Time from receiving a group command until its aggregated response was published.",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+
+
+class _Fanout:
+    def __init__(self, device_ids: typing.Iterable[str], timeout: float, done: typing.Callable[[dict], None]):
+        self.__pending = set(device_ids)
+        self.__results = dict()
+        self.__done = done
+        self.__finished = False
+        self.__lock = threading.Lock()
+        self.__timer = threading.Timer(timeout, self.__expire)
+        self.__timer.daemon = True
+
+    def start(self):
+        if self.__pending:
+            self.__timer.start()
+        else:
+            self.__finish()
+
+    def resolve(self, device_id: str, resp_msg: typing.Optional[dict] = None, error: typing.Optional[str] = None):
+        with self.__lock:
+            if self.__finished or device_id not in self.__pending:
+                return
+            self.__pending.discard(device_id)
+            self.__results[device_id] = {"error": error} if error else {"data": resp_msg.get(mgw_dc.com.command.data)}
+            if self.__pending:
+                return
+        self.__timer.cancel()
+        self.__finish()
+
+    def __expire(self):
+        with self.__lock:
+            if self.__finished:
+                return
+            for device_id in self.__pending:
+                self.__results[device_id] = {"error": "no response after {}s".format(conf.Group.timeout)}
+            self.__pending.clear()
+        self.__finish()
+
+    def __finish(self):
+        with self.__lock:
+            if self.__finished:
+                return
+            self.__finished = True
+        self.__done(self.__results)
+
+
+class GroupCommands:
+    """
+    Handles commands addressed to several devices at once. A group command names either device IDs or a tag, which
+    is 'all' or a device type ID. The command is queued at every matching session in one go, so devices handle
+    it in parallel, and the responses are published as one message once all arrived or conf.Group.timeout elapsed.
+
+    {"command_id": "...", "service_id": "setPower", "data": "{\"power\": false}", "device_ids": ["..."]}
+    {"command_id": "...", "data": "{\"<device id>\": {\"data\": \"...\"}, \"<device id>\": {\"error\": \"...\"}}"}
+    """
+
+    def __init__(self, mqtt_client: MQTTClient, device_sessions: SessionRegistry, response_topic: str):
+        self.__mqtt_client = mqtt_client
+        self.__device_sessions = device_sessions
+        self.__response_topic = response_topic
+
+    def __select(self, msg: dict) -> typing.List[str]:
+        if msg.get("device_ids"):
+            return list(dict.fromkeys(msg["device_ids"]))
+        tag = msg.get("tag")
+        if not tag:
+            raise RuntimeError("neither device IDs nor tag given")
+        return [
+            device_id for device_id, session in self.__device_sessions.items()
+            if tag == "all" or tag == session.device.type
+        ]
+
+    def __publish(self, cmd_id: str, received: float, results: dict):
+        logger.debug("group command '%s' done - %s", cmd_id, results)
+        try:
+            self.__mqtt_client.publish(
+                topic=self.__response_topic,
+                payload=json.dumps(mgw_dc.com.gen_response_msg(cmd_id, json.dumps(results))),
+                qos=1
+            )
+        except Exception as ex:
+            logger.error("could not send response for group command '{}' - {}".format(cmd_id, ex))
+        group_latency.observe(time.monotonic() - received)
+
+    def handle_command(self, payload: str):
+        received = time.monotonic()
+        group_commands.inc()
+        try:
+            msg = json.loads(payload)
+            cmd_id = msg[mgw_dc.com.command.id]
+            srv_id = msg["service_id"]
+            device_ids = self.__select(msg)
+        except Exception as ex:
+            logger.error("invalid group command - {}".format(ex))
+            return
+        logger.debug("group command '%s': '%s' -> %s", cmd_id, srv_id, device_ids)
+        cmd = json.dumps({mgw_dc.com.command.id: cmd_id, mgw_dc.com.command.data: msg.get(mgw_dc.com.command.data)})
+        fanout = _Fanout(device_ids, conf.Group.timeout, lambda results: self.__publish(cmd_id, received, results))
+        fanout.start()
+        for device_id in device_ids:
+            session = self.__device_sessions.get(device_id)
+            if not session:
+                fanout.resolve(device_id, error="no session")
+                continue
+            try:
+                session.put_command(
+                    (srv_id, cmd),
+                    callback=lambda resp_msg, error, device_id=device_id: fanout.resolve(device_id, resp_msg, error)
+                )
+            except Exception as ex:
+                fanout.resolve(device_id, error=str(ex))
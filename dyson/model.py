@@ -15,15 +15,31 @@
 """
 
 
-__all__ = ("Model", "model_map")
+__all__ = ("Model", "model_map", "model_specs", "sensor_fields")
 
 
 from util import conf
-from . import service
+from .codec import compile_spec
 import typing
 
 
 class Model:
+    __slots__ = (
+        "type",
+        "command_topic",
+        "state_topic",
+        "msg_type_field",
+        "set_services",
+        "get_services",
+        "gen_state_req_msg",
+        "gen_sensor_data_req_msg",
+        "device_state_msg_types",
+        "sensor_data_msg_types",
+        "push_state_srv",
+        "push_readings_srv",
+        "parse_device_state"
+    )
+
     def __init__(
             self,
             type: str,
@@ -55,33 +71,190 @@ class Model:
         self.parse_device_state = parse_device_state
 
 
-pure_cool_link = Model(
-    command_topic="475/{}/command",
-    state_topic="475/{}/status/current",
-    type=conf.Senergy.dt_pure_cool_link,
-    msg_type_field="msg",
-    set_services={
-        "setPower": service.pcl_475.set_power,
-        "setOscillation": service.pcl_475.set_oscillation,
-        "setSpeed": service.pcl_475.set_speed,
-        "setMonitoring": service.pcl_475.set_monitoring,
-    },
-    get_services={
-        "getPower": service.pcl_475.get_power,
-        "getOscillation": service.pcl_475.get_oscillation,
-        "getSpeed": service.pcl_475.get_speed,
-        "getMonitoring": service.pcl_475.get_monitoring,
-        "getFilterLife": service.pcl_475.get_filter_life
-    },
-    gen_state_req_msg=service.pcl_475.gen_device_state_req_msg,
-    gen_sensor_data_req_msg=service.pcl_475.gen_sensor_data_req_msg,
-    device_state_msg_types=("CURRENT-STATE", "STATE-CHANGE"),
-    sensor_data_msg_types=("ENVIRONMENTAL-CURRENT-SENSOR-DATA", ),
-    push_state_srv=("getDeviceState", service.pcl_475.push_device_state),
-    push_readings_srv=("getSensorReadings", service.pcl_475.push_sensor_readings),
-    parse_device_state=service.pcl_475.parse_device_state
-)
+_on_off = {"ON": True, "OFF": False}
+
+_protocol = {
+    "command_topic": "{}/{{}}/command",
+    "state_topic": "{}/{{}}/status/current",
+    "state_msg_types": ("CURRENT-STATE", "STATE-CHANGE"),
+    "sensor_msg_types": ("ENVIRONMENTAL-CURRENT-SENSOR-DATA", ),
+    "state_req_msg": "REQUEST-CURRENT-STATE",
+    "sensor_req_msg": "REQUEST-PRODUCT-ENVIRONMENT-CURRENT-SENSOR-DATA",
+    "push_state_srv": "getDeviceState",
+    "push_readings_srv": "getSensorReadings"
+}
+
+_link_state = {
+    "power": {"key": "fmod", "enum": {"FAN": True, "AUTO": True, "OFF": False}},
+    "oscillation": {"key": "oson", "enum": _on_off},
+    "speed": {"key": "fnsp", "enum": {"AUTO": 0}, "numeric": True},
+    "monitoring": {"key": "rhtm", "enum": _on_off},
+    "filter_life": {"key": "filf", "divisor": 4300, "multiplier": 100, "round": 2}
+}
+
+_link_sensors = {
+    "temperature": {"key": "tact", "divisor": 10},
+    "humidity": {"key": "hact"},
+    "particles": {"key": "pact"},
+    "volatile_components": {"key": "vact"}
+}
+
+_link_set = {
+    "setPower": {"argument": "power", "key": "fmod", "enum": {True: "FAN", False: "OFF"}},
+    "setOscillation": {"argument": "oscillation", "key": "oson", "enum": {True: "ON", False: "OFF"}},
+    "setSpeed": {"argument": "speed", "key": "fnsp", "format": "{:04d}"},
+    "setMonitoring": {"argument": "monitoring", "key": "rhtm", "enum": {True: "ON", False: "OFF"}}
+}
+
+_link_get = {
+    "getPower": ("power", ),
+    "getOscillation": ("oscillation", ),
+    "getSpeed": ("speed", ),
+    "getMonitoring": ("monitoring", ),
+    "getFilterLife": ("filter_life", )
+}
+
+_link_set_msg = {
+    "mode": "full",
+    "msg": "STATE-SET",
+    "mode_reason": "LAPP",
+    "drop_keys": ("filf", "fnst", "ercd", "wacd"),
+    "extra": {"sltm": "STET", "rstf": "STET"}
+}
+
+_heating_state = {
+    "heating": {"key": "hmod", "enum": {"HEAT": True, "OFF": False}},
+    "target_temperature": {"key": "hmax", "divisor": 10}
+}
+
+_heating_set = {
+    "setHeating": {"argument": "heating", "key": "hmod", "enum": {True: "HEAT", False: "OFF"}},
+    "setTargetTemperature": {"argument": "target_temperature", "key": "hmax", "multiplier": 10, "format": "{:04d}"}
+}
+
+_heating_get = {
+    "getHeating": ("heating", ),
+    "getTargetTemperature": ("target_temperature", )
+}
+
+_pure_state = {
+    "power": {"key": "fpwr", "enum": _on_off},
+    "auto_mode": {"key": "auto", "enum": _on_off},
+    "oscillation": {"key": "oson", "enum": {"ON": True, "OION": True, "OFF": False, "OIOF": False}},
+    "speed": {"key": "fnsp", "enum": {"AUTO": 0}, "numeric": True},
+    "night_mode": {"key": "nmod", "enum": _on_off},
+    "front_airflow": {"key": "fdir", "enum": _on_off},
+    "monitoring": {"key": "rhtm", "enum": _on_off},
+    "hepa_filter_life": {"key": "hflr", "enum": {"INV": None}, "numeric": True},
+    "carbon_filter_life": {"key": "cflr", "enum": {"INV": None}, "numeric": True}
+}
+
+_pure_sensors = {
+    "temperature": {"key": "tact", "divisor": 10},
+    "humidity": {"key": "hact"},
+    "pm25": {"key": "pm25"},
+    "pm10": {"key": "pm10"},
+    "volatile_components": {"key": "va10"},
+    "nitrogen_dioxide": {"key": "noxl"}
+}
+
+_pure_set = {
+    "setPower": {"argument": "power", "key": "fpwr", "enum": {True: "ON", False: "OFF"}},
+    "setAutoMode": {"argument": "auto_mode", "key": "auto", "enum": {True: "ON", False: "OFF"}},
+    "setOscillation": {"argument": "oscillation", "key": "oson", "enum": {True: "ON", False: "OFF"}},
+    "setSpeed": {"argument": "speed", "key": "fnsp", "format": "{:04d}"},
+    "setNightMode": {"argument": "night_mode", "key": "nmod", "enum": {True: "ON", False: "OFF"}},
+    "setFrontAirflow": {"argument": "front_airflow", "key": "fdir", "enum": {True: "ON", False: "OFF"}},
+    "setMonitoring": {"argument": "monitoring", "key": "rhtm", "enum": {True: "ON", False: "OFF"}}
+}
+
+_pure_get = {
+    "getPower": ("power", ),
+    "getAutoMode": ("auto_mode", ),
+    "getOscillation": ("oscillation", ),
+    "getSpeed": ("speed", ),
+    "getNightMode": ("night_mode", ),
+    "getFrontAirflow": ("front_airflow", ),
+    "getMonitoring": ("monitoring", ),
+    "getFilterLife": ("hepa_filter_life", "carbon_filter_life")
+}
+
+_pure_set_msg = {
+    "mode": "partial",
+    "msg": "STATE-SET",
+    "mode_reason": "LAPP"
+}
+
+
+def _spec(product_type: str, device_type: str, msg: dict, **kwargs) -> dict:
+    return {
+        "name": product_type,
+        "device_type": device_type,
+        **msg,
+        "command_topic": msg["command_topic"].format(product_type),
+        "state_topic": msg["state_topic"].format(product_type),
+        **kwargs
+    }
+
+
+model_specs = {
+    "475": _spec(
+        "475",
+        conf.Senergy.dt_pure_cool_link,
+        _protocol,
+        state=_link_state,
+        sensors=_link_sensors,
+        set=_link_set,
+        get=_link_get,
+        set_msg=_link_set_msg
+    ),
+    "455": _spec(
+        "455",
+        conf.Senergy.dt_pure_hot_cool_link,
+        _protocol,
+        state={**_link_state, **_heating_state, "focus": {"key": "ffoc", "enum": _on_off}},
+        sensors=_link_sensors,
+        set={**_link_set, **_heating_set, "setFocus": {"argument": "focus", "key": "ffoc", "enum": {True: "ON", False: "OFF"}}},
+        get={**_link_get, **_heating_get, "getFocus": ("focus", )},
+        set_msg=_link_set_msg
+    ),
+    "438": _spec(
+        "438",
+        conf.Senergy.dt_pure_cool,
+        _protocol,
+        state=_pure_state,
+        sensors=_pure_sensors,
+        set=_pure_set,
+        get=_pure_get,
+        set_msg=_pure_set_msg
+    ),
+    "520": _spec(
+        "520",
+        conf.Senergy.dt_pure_cool_desk,
+        _protocol,
+        state=_pure_state,
+        sensors=_pure_sensors,
+        set=_pure_set,
+        get=_pure_get,
+        set_msg=_pure_set_msg
+    ),
+    "527": _spec(
+        "527",
+        conf.Senergy.dt_pure_hot_cool,
+        _protocol,
+        state={**_pure_state, **_heating_state},
+        sensors=_pure_sensors,
+        set={**_pure_set, **_heating_set},
+        get={**_pure_get, **_heating_get},
+        set_msg=_pure_set_msg
+    )
+}
 
 model_map = {
-    "475": pure_cool_link
+    product_type: Model(**compile_spec(spec)) for product_type, spec in model_specs.items() if spec["device_type"]
 }
+
+# sensor readings of all models in declaration order, history stores one column per field
+sensor_fields = tuple(
+    dict.fromkeys(field for spec in model_specs.values() if spec["device_type"] for field in spec.get("sensors", dict()))
+)
@@ -0,0 +1,73 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ("AdaptiveInterval", )
+
+
+from util import conf
+import typing
+
+
+_thresholds: typing.Tuple[typing.Optional[str], typing.Dict[str, float]] = (None, dict())
+
+
+def get_thresholds() -> typing.Dict[str, float]:
+    global _thresholds
+    raw = conf.Session.sensor_thresholds
+    if _thresholds[0] != raw:
+        parsed = dict()
+        if raw:
+            for item in str(raw).split(";"):
+                field, value = item.split(":")
+                parsed[field.strip()] = float(value)
+        _thresholds = (raw, parsed)
+    return _thresholds[1]
+
+
+class AdaptiveInterval:
+    """
+    Sensor polling interval of one device. Drops to conf.Session.sensor_interval as soon as a reading moved beyond its
+    threshold relative to the last significant reading and grows by conf.Session.sensor_interval_growth per stable
+    reading up to conf.Session.sensor_interval_max. Adaptation is off while the maximum is not above the interval.
+    """
+
+    def __init__(self):
+        self.__interval = conf.Session.sensor_interval
+        self.__reference: typing.Optional[dict] = None
+
+    @property
+    def interval(self) -> float:
+        if conf.Session.sensor_interval_max <= conf.Session.sensor_interval:
+            return conf.Session.sensor_interval
+        return min(max(self.__interval, conf.Session.sensor_interval), conf.Session.sensor_interval_max)
+
+    def __changed(self, readings: dict) -> bool:
+        thresholds = get_thresholds()
+        for field, value in readings.items():
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                continue
+            reference = self.__reference.get(field)
+            if reference is None or abs(value - reference) > thresholds.get(field, 0):
+                return True
+        return False
+
+    def update(self, readings: dict) -> float:
+        if self.__reference is None or self.__changed(readings):
+            self.__reference = readings
+            self.__interval = conf.Session.sensor_interval
+        else:
+            self.__interval = self.interval * conf.Session.sensor_interval_growth
+        return self.interval
@@ -0,0 +1,99 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ("Provisioner", "read_provisioning_file")
+
+
+from util import get_logger, Storage, to_dict
+import hashlib
+import typing
+import json
+import time
+import csv
+import os
+
+
+logger = get_logger(__name__.split(".", 1)[-1])
+
+
+def read_provisioning_file(path: str) -> typing.List[dict]:
+    try:
+        with open(path, "r", newline="") as file:
+            if os.path.splitext(path)[1].lower() == ".csv":
+                entries = [dict(row) for row in csv.DictReader(file)]
+            else:
+                entries = json.load(file)
+        if not isinstance(entries, list):
+            raise RuntimeError("expected list of devices")
+        return entries
+    except Exception as ex:
+        raise RuntimeError("reading provisioning file '{}' failed - {}".format(path, ex))
+
+
+class Provisioner:
+    __credentials_table = (
+        "credentials",
+        (
+            "wifi_ssid TEXT NOT NULL UNIQUE PRIMARY KEY",
+            "wifi_password_digest TEXT NOT NULL",
+            "serial TEXT NOT NULL",
+            "pw_hash TEXT NOT NULL",
+            "model TEXT NOT NULL"
+        )
+    )
+
+    def __init__(self, db_path: str, device_id_prefix: str):
+        self.__device_id_prefix = device_id_prefix
+        self.__storage = Storage(db_path, "provisioning", (Provisioner.__credentials_table,))
+        self.__cache = to_dict(self.__storage.read(Provisioner.__credentials_table[0]), "wifi_ssid")
+
+    def __get_mqtt_info(self, wifi_ssid: str, wifi_password: str) -> typing.Tuple[str, str, str]:
+        digest = hashlib.sha256(wifi_password.encode()).hexdigest()
+        cached = self.__cache.get(wifi_ssid)
+        if cached and cached["wifi_password_digest"] == digest:
+            return cached["serial"], cached["pw_hash"], cached["model"]
+        logger.debug("deriving credentials for '{}' ...".format(wifi_ssid))
+        import libdyson
+        serial, pw_hash, model = libdyson.get_mqtt_info_from_wifi_info(wifi_ssid=wifi_ssid, wifi_password=wifi_password)
+        record = {"wifi_password_digest": digest, "serial": serial, "pw_hash": pw_hash, "model": model}
+        try:
+            if cached:
+                self.__storage.update(Provisioner.__credentials_table[0], record, wifi_ssid=wifi_ssid)
+            else:
+                self.__storage.create(Provisioner.__credentials_table[0], {"wifi_ssid": wifi_ssid, **record})
+        except Exception as ex:
+            logger.error("caching credentials for '{}' failed - {}".format(wifi_ssid, ex))
+        self.__cache[wifi_ssid] = record
+        return serial, pw_hash, model
+
+    def get_devices(self, entries: typing.Iterable[dict]) -> dict:
+        devices = dict()
+        now = time.time()
+        for entry in entries:
+            try:
+                if entry.get("serial") and entry.get("password_hash") and entry.get("model"):
+                    serial, pw_hash, model = entry["serial"], entry["password_hash"], entry["model"]
+                else:
+                    serial, pw_hash, model = self.__get_mqtt_info(entry["wifi_ssid"], entry["wifi_password"])
+                devices["{}{}".format(self.__device_id_prefix, serial)] = {
+                    "name": entry.get("name") or serial,
+                    "model": model,
+                    "local_credentials": json.dumps({"serial": serial, "apPasswordHash": pw_hash}),
+                    "last_seen": now
+                }
+            except Exception as ex:
+                logger.error("provisioning '{}' failed - {}".format(entry.get("wifi_ssid", entry.get("serial")), ex))
+        return devices
@@ -14,4 +14,4 @@
    limitations under the License.
 """
 
-from . import pcl_475
\ No newline at end of file
+from . import common
@@ -0,0 +1,50 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+
+import datetime
+import typing
+
+
+def parse_timestamp(timestamp: typing.Optional[str]) -> typing.Optional[float]:
+    if timestamp is None:
+        return None
+    return datetime.datetime.fromisoformat(timestamp.rstrip("Z")).replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+def gen_timestamp(timestamp: typing.Optional[float] = None) -> str:
+    if timestamp is None:
+        return "{}Z".format(datetime.datetime.utcnow().isoformat())
+    return "{}Z".format(datetime.datetime.utcfromtimestamp(timestamp).isoformat())
+
+
+def apply_device_state(state, data: dict):
+    if data["msg"] == "CURRENT-STATE":
+        state.replace(data["product-state"])
+    elif data["msg"] == "STATE-CHANGE":
+        state.merge(data["product-state"])
+    else:
+        raise RuntimeError("unknown state type")
+
+
+def get_sensor_history(session, start: typing.Optional[str] = None, end: typing.Optional[str] = None, resolution: int = 0) -> dict:
+    readings = session.read_sensor_history(start=parse_timestamp(start), end=parse_timestamp(end), resolution=resolution)
+    for reading in readings:
+        reading["time"] = gen_timestamp(reading["time"])
+    return {
+        "readings": readings,
+        "time": gen_timestamp()
+    }
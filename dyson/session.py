@@ -15,24 +15,82 @@
 """
 
 
-from util import get_logger, conf, MQTTClient, decrypt_password
+from util import get_logger, Lazy, conf, MQTTClient, TimeSeriesStore, TTLCache, Scheduler, registry, decrypt_password
 from .device import Device
+from .announcer import Announcer
+from .state import DeviceState
+from .polling import AdaptiveInterval
+from .tls import is_tls_port, ResumingContext
+from .service.common import get_sensor_history
 import paho.mqtt.client
+import concurrent.futures
+import collections
 import time
 import json
 import threading
 import typing
-import queue
 import mgw_dc
 
 
 logger = get_logger(__name__.split(".", 1)[-1])
 
+messages = registry.counter("dyson_dc_device_messages_total", "Messages received from devices.", labels=("device", "type"))
+connects = registry.counter("dyson_dc_device_connects_total", "Successful connections to devices.", labels=("device", ))
+disconnects = registry.counter("dyson_dc_device_disconnects_total", "Disconnects from devices.", labels=("device", ))
+command_latency = registry.histogram(
+    "dyson_dc_command_latency_seconds",
+    "Time from routing a command to a session until its response was published.",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+    labels=("service", )
+)
+command_failures = registry.counter("dyson_dc_command_failures_total", "Commands that could not be handled.")
+command_duplicates = registry.counter(
+    "dyson_dc_command_duplicates_total",
+    "Redelivered commands answered with the response of their first delivery."
+)
+
+
+# shared by all sessions of a process instead of two helper threads per session
+_sensor_scheduler: typing.Optional[Scheduler] = None
+_command_pool: typing.Optional[concurrent.futures.ThreadPoolExecutor] = None
+_shared_lock = threading.Lock()
+
+
+def _get_sensor_scheduler() -> Scheduler:
+    global _sensor_scheduler
+    with _shared_lock:
+        if not _sensor_scheduler:
+            _sensor_scheduler = Scheduler(name="sensor-trigger")
+            _sensor_scheduler.start()
+        return _sensor_scheduler
+
+
+def _get_command_pool() -> concurrent.futures.ThreadPoolExecutor:
+    global _command_pool
+    with _shared_lock:
+        if not _command_pool:
+            _command_pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=conf.Session.command_workers,
+                thread_name_prefix="command-handler"
+            )
+        return _command_pool
+
+
+class SessionEvent:
+    started = "started"
+    online = "online"
+    offline = "offline"
+    exited = "exited"
+    all = (started, online, offline, exited)
+
 
 class Session(threading.Thread):
-    def __init__(self, mqtt_client: MQTTClient, device: Device, ip: str, port: int):
+    def __init__(self, mqtt_client: MQTTClient, device: Device, ip: str, port: int, announcer: Announcer, sensor_history: typing.Optional[TimeSeriesStore] = None, lifecycle_callback: typing.Optional[typing.Callable[[str, "Session"], None]] = None):
         super().__init__(name="session-{}".format(device.id), daemon=True)
         self.__dc_client = mqtt_client
+        self.__announcer = announcer
+        self.__sensor_history = sensor_history
+        self.__lifecycle_callback = lifecycle_callback
         self.__device = device
         self.__ip = ip
         self.__port = port
@@ -40,6 +98,10 @@ class Session(threading.Thread):
         self.__session_client.on_connect = self.__on_connect
         self.__session_client.on_disconnect = self.__on_disconnect
         self.__session_client.on_message = self.__on_message
+        self.__session_client.on_publish = self.__on_publish
+        self.__tls_context = ResumingContext(ip, port) if is_tls_port(port) else None
+        if self.__tls_context:
+            self.__session_client.tls_set_context(self.__tls_context)
         # credentials = json.loads(decrypt_password(device.local_credentials))
         credentials = json.loads(device.local_credentials)
         self.__serial = credentials["serial"]
@@ -47,52 +109,117 @@ class Session(threading.Thread):
         if conf.Session.logging:
             self.__session_client.enable_logger(logger.getChild("{}-mqtt".format(self.name)))
         self.__stop = False
-        self.__sensor_trigger = threading.Thread(
-            target=self.__trigger_sensor_data,
-            name="{}-sensor-trigger".format(self.name),
-            daemon=True
-        ) if self.__device.model.gen_sensor_data_req_msg else None
-        self.__command_handler = threading.Thread(
-            target=self.__handle_command,
-            name="{}-command-handler".format(self.name),
-            daemon=True
-        )
-        self.__command_queue = queue.Queue()
-        self.device_state: typing.Optional[dict] = None
+        self.__sensor_started = False
+        self.__sensor_triggered = float("-inf")
+        self.__sensor_interval = AdaptiveInterval()
+        self.__sensor_batch: typing.List[dict] = list()
+        self.__sensor_batch_deadline = 0
+        self.__sensor_batch_lock = threading.Lock()
+        self.__commands: typing.Deque[tuple] = collections.deque()
+        self.__commands_lock = threading.Lock()
+        self.__commands_ready = False
+        self.__commands_running = False
+        # set commands waiting for the device's acknowledgement, mid -> (deadline, srv_id, cmd, received, callback, msg_info)
+        self.__unacked: typing.Dict[int, tuple] = dict()
+        self.__unacked_lock = threading.Lock()
+        self.__publishing = False
+        self.__early_acks: typing.Set[int] = set()
+        # the upstream broker redelivers unacknowledged commands after a reconnect
+        self.__handled_commands = TTLCache(size=conf.Session.command_cache_size, ttl=conf.Session.command_cache_ttl)
+        # commands being handled, (srv_id, cmd_id) -> callbacks of copies that arrived meanwhile
+        self.__in_flight: typing.Dict[tuple, list] = dict()
+        self.__in_flight_lock = threading.Lock()
+        self.device_state = DeviceState()
         self.__disconnect_count = 0
+        self.__socket_connected = False
+        self.__connected = threading.Event()
+
+    @property
+    def device_id(self) -> str:
+        return self.__device.id
+
+    @property
+    def device(self) -> Device:
+        return self.__device
 
-    def put_command(self, cmd: tuple):
-        self.__command_queue.put_nowait(cmd)
+    def connect(self):
+        self.__session_client.connect(self.__ip, self.__port, keepalive=conf.Session.keepalive)
+        self.__socket_connected = True
+
+    def wait_for_connect(self, timeout: float) -> bool:
+        return self.__connected.wait(timeout=timeout)
+
+    def reconfigure(self):
+        self.__wake_sensor_trigger()
+
+    def stop(self):
+        self.__stop = True
+        self.__session_client.disconnect()
+
+    def put_command(self, cmd: tuple, callback: typing.Optional[typing.Callable[[typing.Optional[dict], typing.Optional[str]], None]] = None):
+        self.__commands.append((*cmd, time.monotonic(), callback))
+        self.__dispatch_commands()
+
+    def command_queue_size(self) -> int:
+        return len(self.__commands)
+
+    def read_sensor_history(self, start: typing.Optional[float] = None, end: typing.Optional[float] = None, resolution: int = 0) -> typing.List[dict]:
+        if not self.__sensor_history:
+            raise RuntimeError("sensor history not enabled")
+        return self.__sensor_history.query(self.__device.id, start=start, end=end, resolution=resolution)
+
+    def __emit(self, event: str):
+        if self.__lifecycle_callback:
+            self.__lifecycle_callback(event, self)
 
     def run(self):
-        logger.info("starting {} ...".format(self.name))
+        logger.info("starting %s ...", self.name)
+        self.__emit(SessionEvent.started)
         try:
-            self.__session_client.connect(self.__ip, self.__port, keepalive=conf.Session.keepalive)
+            if not self.__socket_connected:
+                self.connect()
             self.__session_client.loop_forever()
         except Exception as ex:
             logger.error(
-                "{}: could not connect to '{}' on '{}' - {}".format(
-                    self.name,
-                    self.__ip,
-                    self.__port,
-                    ex
-                )
+                "%s: could not connect to '%s' on '%s' - %s",
+                self.name,
+                self.__ip,
+                self.__port,
+                ex
             )
         self.__stop = True
-        logger.info("{} exited".format(self.name))
+        _get_sensor_scheduler().cancel(self.__trigger_sensor_data)
+        logger.info("%s exited", self.name)
+        self.__emit(SessionEvent.exited)
 
-    def __trigger_sensor_data(self):
-        logger.debug("starting {} ...".format(self.__sensor_trigger.name))
-        while not self.__stop:
-            if self.__session_client.is_connected():
-                logger.debug("{}: triggering sensor data".format(self.__sensor_trigger.name))
-                self.__session_client.publish(
-                    topic=self.__device.model.command_topic.format(self.__serial),
-                    payload=json.dumps(self.__device.model.gen_sensor_data_req_msg()),
-                    qos=1
-                )
-            time.sleep(conf.Session.sensor_interval)
-        logger.debug("{} exited".format(self.__sensor_trigger.name))
+    def __wake_sensor_trigger(self):
+        # re-evaluates the next trigger with the current interval and batch deadline
+        _get_sensor_scheduler().schedule(self.__trigger_sensor_data, time.monotonic())
+
+    def __trigger_sensor_data(self) -> typing.Optional[float]:
+        if self.__stop:
+            return None
+        now = time.monotonic()
+        if self.__sensor_batch and self.__sensor_batch_deadline <= now:
+            self.__flush_readings()
+        due = None
+        if self.__sensor_started and self.__device.model.gen_sensor_data_req_msg:
+            if now >= self.__sensor_triggered + self.__sensor_interval.interval:
+                if self.__session_client.is_connected():
+                    logger.debug("%s: triggering sensor data", self.name)
+                    self.__session_client.publish(
+                        topic=self.__device.model.command_topic.format(self.__serial),
+                        payload=json.dumps(self.__device.model.gen_sensor_data_req_msg()),
+                        qos=1
+                    )
+                self.__sensor_triggered = now
+            due = self.__sensor_triggered + self.__sensor_interval.interval
+        if self.__sensor_batch:
+            due = min(due, self.__sensor_batch_deadline) if due is not None else self.__sensor_batch_deadline
+        return due
+
+    def __serves_history(self) -> bool:
+        return self.__sensor_history is not None and "getSensorHistory" in self.__device.model.get_services
 
     def __call_service(self, service: typing.Callable, data: typing.Optional[str] = None) -> dict:
         if data:
@@ -100,114 +227,301 @@ class Session(threading.Thread):
         else:
             return service(self)
 
-    def __handle_command(self):
-        logger.debug("starting {} ...".format(self.__command_handler.name))
-        while not self.__stop:
-            try:
-                srv_id, cmd = self.__command_queue.get(timeout=30)
-                logger.debug("{}: '{}' <- '{}'".format(self.__command_handler.name, srv_id, cmd))
-                if not self.__session_client.is_connected():
-                    raise RuntimeError("not connected to device".format(self.__device.id))
-                if not self.device_state:
-                    raise RuntimeError("no device state available".format(self.__device.id))
-                cmd = json.loads(cmd)
-                if srv_id in self.__device.model.set_services:
-                    msg_info = self.__session_client.publish(
-                        topic=self.__device.model.command_topic.format(self.__serial),
-                        payload=json.dumps(
-                            self.__call_service(
-                                self.__device.model.set_services[srv_id],
-                                cmd.get(mgw_dc.com.command.data)
-                            )
-                        ),
-                        qos=1
-                    )
-                    try:
-                        msg_info.wait_for_publish(timeout=10)
-                    except Exception as ex:
-                        logger.error(
-                            "{}: could not send command '{}' to device - {}".format(
-                                self.__command_handler.name,
-                                cmd[mgw_dc.com.command.id],
-                                ex
-                            )
+    def __dispatch_commands(self):
+        with self.__commands_lock:
+            if self.__commands_running or not self.__commands_ready or not self.__commands:
+                return
+            self.__commands_running = True
+        _get_command_pool().submit(self.__handle_commands)
+
+    def __handle_commands(self):
+        # commands of a session are handled one after another by at most one pool thread
+        while True:
+            with self.__commands_lock:
+                if self.__stop or not self.__commands:
+                    self.__commands_running = False
+                    return
+                srv_id, cmd, received, callback = self.__commands.popleft()
+            self.__handle_command(srv_id, cmd, received, callback)
+
+    def __handle_command(self, srv_id: str, cmd: str, received: float, callback: typing.Optional[typing.Callable]):
+        key = None
+        try:
+            logger.debug("%s: '%s' <- '%s'", self.name, srv_id, cmd)
+            cmd = json.loads(cmd)
+            with self.__in_flight_lock:
+                resp_msg = self.__handled_commands.get((srv_id, cmd[mgw_dc.com.command.id]))
+                waiting = self.__in_flight.get((srv_id, cmd[mgw_dc.com.command.id]))
+                if waiting is not None:
+                    waiting.append(callback)
+                elif not resp_msg:
+                    key = (srv_id, cmd[mgw_dc.com.command.id])
+                    self.__in_flight[key] = list()
+            if resp_msg:
+                command_duplicates.inc()
+                logger.debug("%s: replaying response for '%s'", self.name, cmd[mgw_dc.com.command.id])
+                if callback:
+                    callback(resp_msg, None)
+                else:
+                    self.__publish_response(srv_id, cmd, resp_msg)
+                return
+            if waiting is not None:
+                # answered by __release_command once the first copy completes
+                command_duplicates.inc()
+                logger.debug("%s: '%s' already in flight", self.name, cmd[mgw_dc.com.command.id])
+                return
+            # local history is served while the device is offline, that is when it is needed most
+            if self.__device.model.get_services.get(srv_id) is get_sensor_history:
+                self.__finish_command(
+                    srv_id,
+                    cmd,
+                    received,
+                    callback,
+                    json.dumps(self.__call_service(get_sensor_history, cmd.get(mgw_dc.com.command.data)))
+                )
+                return
+            if not self.__session_client.is_connected():
+                raise RuntimeError("not connected to device".format(self.__device.id))
+            if not self.device_state.data:
+                raise RuntimeError("no device state available".format(self.__device.id))
+            if srv_id in self.__device.model.set_services:
+                self.__send_set_command(
+                    srv_id,
+                    cmd,
+                    received,
+                    callback,
+                    json.dumps(
+                        self.__call_service(
+                            self.__device.model.set_services[srv_id],
+                            cmd.get(mgw_dc.com.command.data)
                         )
-                    resp = json.dumps({"status": paho.mqtt.client.error_string(msg_info.rc)})
-                elif srv_id in self.__device.model.get_services:
-                    resp = json.dumps(
+                    )
+                )
+            elif srv_id in self.__device.model.get_services:
+                self.__finish_command(
+                    srv_id,
+                    cmd,
+                    received,
+                    callback,
+                    json.dumps(
                         self.__call_service(self.__device.model.get_services[srv_id], cmd.get(mgw_dc.com.command.data))
                     )
-                else:
-                    raise RuntimeError("service '{}' not supported".format(srv_id))
-                resp_msg = mgw_dc.com.gen_response_msg(cmd[mgw_dc.com.command.id], resp)
-                logger.debug("{}: '{}'".format(self.__command_handler.name, resp_msg))
+                )
+            else:
+                raise RuntimeError("service '{}' not supported".format(srv_id))
+        except Exception as ex:
+            command_failures.inc()
+            logger.error("%s: handling command failed - %s", self.name, ex)
+            if callback:
+                callback(None, str(ex))
+            if key:
+                self.__release_command(key, None, str(ex))
+
+    def __send_set_command(self, srv_id: str, cmd: dict, received: float, callback: typing.Optional[typing.Callable], payload: str):
+        # the response is completed by __on_publish or __expire_unacked, pool threads never wait for the device
+        with self.__unacked_lock:
+            self.__publishing = True
+        msg_info = None
+        try:
+            msg_info = self.__session_client.publish(
+                topic=self.__device.model.command_topic.format(self.__serial),
+                payload=payload,
+                qos=1
+            )
+        finally:
+            with self.__unacked_lock:
+                self.__publishing = False
+                acked = msg_info is not None and msg_info.mid in self.__early_acks
+                self.__early_acks.clear()
+                unacked = msg_info is not None and msg_info.rc == paho.mqtt.client.MQTT_ERR_SUCCESS and not acked
+                if unacked:
+                    deadline = time.monotonic() + conf.Session.command_ack_timeout
+                    self.__unacked[msg_info.mid] = (deadline, srv_id, cmd, received, callback, msg_info)
+                    first = len(self.__unacked) == 1
+        if not unacked:
+            if msg_info.rc != paho.mqtt.client.MQTT_ERR_SUCCESS:
+                logger.error(
+                    "%s: could not send command '%s' to device - %s",
+                    self.name,
+                    cmd[mgw_dc.com.command.id],
+                    paho.mqtt.client.error_string(msg_info.rc)
+                )
+            self.__finish_set_command(srv_id, cmd, received, callback, msg_info)
+        elif first:
+            _get_sensor_scheduler().schedule(self.__expire_unacked, deadline)
+
+    def __finish_set_command(self, srv_id: str, cmd: dict, received: float, callback: typing.Optional[typing.Callable], msg_info: paho.mqtt.client.MQTTMessageInfo):
+        try:
+            self.__finish_command(
+                srv_id,
+                cmd,
+                received,
+                callback,
+                json.dumps({"status": paho.mqtt.client.error_string(msg_info.rc)})
+            )
+        except Exception as ex:
+            command_failures.inc()
+            logger.error("%s: handling command failed - %s", self.name, ex)
+            if callback:
+                callback(None, str(ex))
+            self.__release_command((srv_id, cmd[mgw_dc.com.command.id]), None, str(ex))
+
+    def __release_command(self, key: tuple, resp_msg: typing.Optional[dict], error: typing.Optional[str]):
+        with self.__in_flight_lock:
+            if resp_msg:
+                self.__handled_commands.put(key, resp_msg)
+            duplicates = self.__in_flight.pop(key, ())
+        # redelivered copies are covered by the first copy's response, only callers waiting on a result are answered
+        for callback in duplicates:
+            if callback:
                 try:
-                    self.__dc_client.publish(
-                        topic=mgw_dc.com.gen_response_topic(self.__device.id, srv_id),
-                        payload=json.dumps(resp_msg),
-                        qos=1
-                    )
+                    callback(resp_msg, error)
                 except Exception as ex:
-                    logger.error(
-                        "{}: could not send response for '{}' - {}".format(
-                            self.__command_handler.name,
-                            cmd[mgw_dc.com.command.id],
-                            ex
-                        )
-                    )
-            except queue.Empty:
-                pass
-            except Exception as ex:
-                logger.error("{}: handling command failed - {}".format(self.__command_handler.name, ex))
-        logger.debug("{} exited".format(self.__command_handler.name))
+                    logger.error("%s: answering duplicate command failed - %s", self.name, ex)
+
+    def __finish_command(self, srv_id: str, cmd: dict, received: float, callback: typing.Optional[typing.Callable], resp: str):
+        resp_msg = mgw_dc.com.gen_response_msg(cmd[mgw_dc.com.command.id], resp)
+        self.__release_command((srv_id, cmd[mgw_dc.com.command.id]), resp_msg, None)
+        # responses of group commands are aggregated by the caller
+        if callback:
+            callback(resp_msg, None)
+        else:
+            self.__publish_response(srv_id, cmd, resp_msg)
+        command_latency.observe(time.monotonic() - received, srv_id)
+
+    def __on_publish(self, client, userdata, mid):
+        # called by the network thread while paho holds its message lock, completion is left to the pool
+        with self.__unacked_lock:
+            entry = self.__unacked.pop(mid, None)
+            if not entry and self.__publishing:
+                self.__early_acks.add(mid)
+        if entry:
+            _get_command_pool().submit(self.__finish_set_command, *entry[1:])
+
+    def __expire_unacked(self) -> typing.Optional[float]:
+        now = time.monotonic()
+        with self.__unacked_lock:
+            expired = [mid for mid, entry in self.__unacked.items() if entry[0] <= now]
+            entries = [self.__unacked.pop(mid) for mid in expired]
+            # the timeout may be changed at runtime, so entries are not necessarily in deadline order
+            due = min(entry[0] for entry in self.__unacked.values()) if self.__unacked else None
+        for entry in entries:
+            logger.error(
+                "%s: command '%s' not acknowledged by device within %ss",
+                self.name,
+                entry[2][mgw_dc.com.command.id],
+                conf.Session.command_ack_timeout
+            )
+            _get_command_pool().submit(self.__finish_set_command, *entry[1:])
+        return due
+
+    def __publish_response(self, srv_id: str, cmd: dict, resp_msg: dict):
+        logger.debug("%s: '%s'", self.name, resp_msg)
+        try:
+            self.__dc_client.publish(
+                topic=mgw_dc.com.gen_response_topic(self.__device.id, srv_id),
+                payload=json.dumps(resp_msg),
+                qos=1
+            )
+        except Exception as ex:
+            logger.error(
+                "%s: could not send response for '%s' - %s",
+                self.name,
+                cmd[mgw_dc.com.command.id],
+                ex
+            )
 
     def __handle_state_data(self, data: dict):
-        self.device_state = self.__device.model.parse_device_state(data) if self.__device.model.parse_device_state else data
+        if self.__device.model.parse_device_state:
+            self.__device.model.parse_device_state(self.device_state, data)
+        else:
+            self.device_state.replace(data)
         try:
             self.__dc_client.publish(
                 topic=mgw_dc.com.gen_event_topic(self.__device.id, self.__device.model.push_state_srv[0]),
-                payload=json.dumps(self.__device.model.push_state_srv[1](self.device_state)),
+                payload=json.dumps(self.__device.model.push_state_srv[1](self.device_state.data)),
                 qos=1
             )
         except Exception as ex:
-            logger.error("{}: can't publish state - {}".format(self.name, ex))
+            logger.error("%s: can't publish state - %s", self.name, ex)
 
     def __handle_sensor_data(self, data: dict):
         try:
+            readings = self.__device.model.push_readings_srv[1](data)
+            interval = self.__sensor_interval.interval
+            if self.__sensor_interval.update(readings) < interval:
+                self.__wake_sensor_trigger()
+            if self.__sensor_history:
+                self.__sensor_history.append(self.__device.id, readings)
+            if conf.Session.event_batch_size > 1:
+                self.__batch_readings(readings)
+                return
+            if self.__sensor_batch:
+                self.__flush_readings()
             self.__dc_client.publish(
                 topic=mgw_dc.com.gen_event_topic(self.__device.id, self.__device.model.push_readings_srv[0]),
-                payload=json.dumps(self.__device.model.push_readings_srv[1](data)),
+                payload=json.dumps(readings),
                 qos=1
             )
         except Exception as ex:
-            logger.error("{}: can't publish readings - {}".format(self.name, ex))
+            logger.error("%s: can't publish readings - %s", self.name, ex)
+
+    def __batch_readings(self, readings: dict):
+        with self.__sensor_batch_lock:
+            self.__sensor_batch.append(readings)
+            if len(self.__sensor_batch) == 1:
+                self.__sensor_batch_deadline = time.monotonic() + conf.Session.event_batch_latency
+                self.__wake_sensor_trigger()
+            full = len(self.__sensor_batch) >= conf.Session.event_batch_size
+        if full:
+            self.__flush_readings()
+
+    def __flush_readings(self):
+        with self.__sensor_batch_lock:
+            batch, self.__sensor_batch = self.__sensor_batch, list()
+        if not batch:
+            return
+        try:
+            self.__dc_client.publish(
+                topic=mgw_dc.com.gen_event_topic(self.__device.id, self.__device.model.push_readings_srv[0]),
+                payload=json.dumps(batch),
+                qos=1
+            )
+        except Exception as ex:
+            logger.error("%s: can't publish %s batched readings - %s", self.name, len(batch), ex)
 
     def __on_message(self, client, userdata, message: paho.mqtt.client.MQTTMessage):
         try:
-            logger.debug("{}: got message '{}'".format(self.name, message.payload.decode()))
+            logger.debug("%s: got message '%s'", self.name, Lazy(message.payload.decode))
             payload = json.loads(message.payload)
             if payload[self.__device.model.msg_type_field] in self.__device.model.device_state_msg_types:
+                messages.inc(self.__device.id, "state")
                 self.__handle_state_data(payload)
             elif payload[self.__device.model.msg_type_field] in self.__device.model.sensor_data_msg_types:
+                messages.inc(self.__device.id, "sensor")
                 self.__handle_sensor_data(payload)
             else:
-                logger.warning("{}: message type '{}' not supported".format(self.name, payload[self.__device.model.msg_type_field]))
+                messages.inc(self.__device.id, "other")
+                logger.warning("%s: message type '%s' not supported", self.name, payload[self.__device.model.msg_type_field])
         except Exception as ex:
-            logger.error("{}: parsing message failed - {}".format(self.name, ex))
+            logger.error("%s: parsing message failed - %s", self.name, ex)
 
     def __on_connect(self, client, userdata, flags, rc):
         if rc == 0:
-            logger.info("{}: connected".format(self.name))
+            logger.info("%s: connected", self.name)
+            connects.inc(self.__device.id)
+            if self.__tls_context:
+                self.__tls_context.store_session(client.socket())
+            self.__connected.set()
+            self.__emit(SessionEvent.online)
             try:
                 self.__device.state = mgw_dc.dm.device_state.online
-                self.__dc_client.publish(
-                    topic=mgw_dc.dm.gen_device_topic(conf.Client.id),
-                    payload=json.dumps(mgw_dc.dm.gen_set_device_msg(self.__device)),
-                    qos=1
-                )
+                self.__announcer.announce(self.__device)
                 self.__dc_client.subscribe(topic=mgw_dc.com.gen_command_topic(self.__device.id), qos=1)
+                if self.__serves_history():
+                    self.__dc_client.unsubscribe(topic=mgw_dc.com.gen_command_topic(self.__device.id, "getSensorHistory"))
             except Exception as ex:
-                logger.error("{}: setting state failed - {}".format(self.name, ex))
+                logger.error("%s: setting state failed - %s", self.name, ex)
             try:
                 self.__session_client.subscribe(topic=self.__device.model.state_topic.format(self.__serial))
                 self.__session_client.publish(
@@ -215,33 +529,44 @@ class Session(threading.Thread):
                     payload=json.dumps(self.__device.model.gen_state_req_msg()),
                     qos=1
                 )
-                if self.__sensor_trigger and not self.__sensor_trigger.is_alive():
-                    self.__sensor_trigger.start()
-                if not self.__command_handler.is_alive():
-                    self.__command_handler.start()
+                if not self.__sensor_started:
+                    self.__sensor_started = True
+                    self.__wake_sensor_trigger()
+                if not self.__commands_ready:
+                    self.__commands_ready = True
+                    self.__dispatch_commands()
                 self.__disconnect_count = 0
             except Exception as ex:
-                logger.error("{}: handling connect failed - {}".format(self.name, ex))
+                logger.error("%s: handling connect failed - %s", self.name, ex)
                 self.__session_client.disconnect()
         else:
-            logger.error("{}: could not connect - {}".format(self.name, paho.mqtt.client.connack_string(rc)))
+            logger.error("%s: could not connect - %s", self.name, paho.mqtt.client.connack_string(rc))
 
     def __on_disconnect(self, client, userdata, rc):
+        disconnects.inc(self.__device.id)
         if rc == 0:
-            logger.info("{}: disconnected".format(self.name))
+            logger.info("%s: disconnected", self.name)
         else:
-            logger.warning("{}: disconnected unexpectedly".format(self.name))
-        if self.__disconnect_count > conf.Session.max_disconnects:
+            logger.warning("%s: disconnected unexpectedly", self.name)
+        self.__flush_readings()
+        self.__emit(SessionEvent.offline)
+        if self.__stop:
+            try:
+                self.__dc_client.unsubscribe(topic=mgw_dc.com.gen_command_topic(self.__device.id))
+                if self.__serves_history():
+                    self.__dc_client.unsubscribe(topic=mgw_dc.com.gen_command_topic(self.__device.id, "getSensorHistory"))
+            except Exception as ex:
+                logger.warning("%s: unsubscribing failed - %s", self.name, ex)
+        elif self.__disconnect_count > conf.Session.max_disconnects:
             self.__session_client.disconnect()
         else:
             try:
                 self.__device.state = mgw_dc.dm.device_state.offline
-                self.__dc_client.publish(
-                    topic=mgw_dc.dm.gen_device_topic(conf.Client.id),
-                    payload=json.dumps(mgw_dc.dm.gen_set_device_msg(self.__device)),
-                    qos=1
-                )
+                self.__announcer.announce(self.__device)
                 self.__dc_client.unsubscribe(topic=mgw_dc.com.gen_command_topic(self.__device.id))
+                # history stays available while the device is offline
+                if self.__serves_history():
+                    self.__dc_client.subscribe(topic=mgw_dc.com.gen_command_topic(self.__device.id, "getSensorHistory"), qos=1)
             except Exception as ex:
-                logger.warning("{}: setting state failed - {}".format(self.name, ex))
+                logger.warning("%s: setting state failed - %s", self.name, ex)
         self.__disconnect_count += 1
@@ -0,0 +1,100 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ("SessionRegistry", )
+
+
+from util import get_logger
+from .session import Session, SessionEvent
+import collections.abc
+import threading
+import typing
+
+
+logger = get_logger(__name__.split(".", 1)[-1])
+
+
+class SessionRegistry(collections.abc.Mapping):
+    """
+    Maps device IDs to sessions. Writers replace the whole dict under a lock (copy-on-write) so lookups from other
+    threads never lock and always see a consistent snapshot. Sessions report lifecycle events via notify(), which
+    are passed on to subscribers for registered sessions only.
+    """
+
+    def __init__(self):
+        self.__sessions: typing.Dict[str, Session] = dict()
+        self.__states: typing.Dict[str, str] = dict()
+        self.__counts: typing.Dict[str, int] = {event: 0 for event in SessionEvent.all}
+        self.__listeners: typing.Dict[str, typing.List[typing.Callable[[Session], None]]] = {
+            event: list() for event in SessionEvent.all
+        }
+        self.__lock = threading.Lock()
+
+    def __getitem__(self, device_id: str) -> Session:
+        return self.__sessions[device_id]
+
+    def __iter__(self) -> typing.Iterator[str]:
+        return iter(self.__sessions)
+
+    def __len__(self) -> int:
+        return len(self.__sessions)
+
+    def __drop_state(self, device_id: str):
+        state = self.__states.pop(device_id, None)
+        if state:
+            self.__counts[state] -= 1
+
+    def put(self, session: Session) -> typing.Optional[Session]:
+        with self.__lock:
+            sessions = dict(self.__sessions)
+            replaced = sessions.get(session.device_id)
+            sessions[session.device_id] = session
+            self.__drop_state(session.device_id)
+            self.__sessions = sessions
+        return replaced
+
+    def remove(self, device_id: str, session: typing.Optional[Session] = None) -> bool:
+        with self.__lock:
+            current = self.__sessions.get(device_id)
+            if current is None or (session is not None and current is not session):
+                return False
+            sessions = dict(self.__sessions)
+            del sessions[device_id]
+            self.__drop_state(device_id)
+            self.__sessions = sessions
+        return True
+
+    def state(self, device_id: str) -> typing.Optional[str]:
+        return self.__states.get(device_id)
+
+    def count(self, *events: str) -> int:
+        return sum(self.__counts[event] for event in events)
+
+    def subscribe(self, event: str, callback: typing.Callable[[Session], None]):
+        self.__listeners[event].append(callback)
+
+    def notify(self, event: str, session: Session):
+        with self.__lock:
+            if self.__sessions.get(session.device_id) is not session:
+                return
+            self.__drop_state(session.device_id)
+            self.__states[session.device_id] = event
+            self.__counts[event] += 1
+        for callback in self.__listeners[event]:
+            try:
+                callback(session)
+            except Exception as ex:
+                logger.error("handling '{}' of '{}' failed - {}".format(event, session.device_id, ex))
@@ -0,0 +1,468 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ("WorkerPool", "ShardedSession")
+
+
+from util import get_logger, init_logger, conf, MQTTClient, TimeSeriesStore, registry
+from .device import Device
+from .model import model_map
+from .session import Session, SessionEvent
+from .announcer import Announcer
+import multiprocessing.connection
+import multiprocessing
+import concurrent.futures
+import collections
+import itertools
+import threading
+import typing
+import time
+import zlib
+
+
+logger = get_logger(__name__.split(".", 1)[-1])
+
+
+class Link:
+    """
+    Message channel over a pipe. Outgoing messages are queued and a sender thread writes everything queued so far
+    as one pickled batch, which keeps the number of pipe writes low under load without delaying single messages.
+    Calls block until the other side replies with the matching request ID, asynchronous calls pass the reply to
+    a callback instead.
+    """
+
+    def __init__(self, conn: multiprocessing.connection.Connection, name: str):
+        self.__conn = conn
+        self.__outbox = collections.deque()
+        self.__condition = threading.Condition()
+        self.__pending: typing.Dict[int, list] = dict()
+        self.__pending_lock = threading.Lock()
+        self.__req_ids = itertools.count()
+        self.__closed = False
+        self.__sender = threading.Thread(target=self.__send_batches, name="{}-sender".format(name), daemon=True)
+        self.__sender.start()
+
+    def __send_batches(self):
+        while True:
+            with self.__condition:
+                while not self.__outbox and not self.__closed:
+                    self.__condition.wait()
+                if self.__closed:
+                    return
+                batch = list(self.__outbox)
+                self.__outbox.clear()
+            try:
+                self.__conn.send(batch)
+            except Exception as ex:
+                logger.error("sending {} messages failed - {}".format(len(batch), ex))
+
+    def send(self, *msg):
+        with self.__condition:
+            self.__outbox.append(msg)
+            self.__condition.notify()
+
+    def call(self, *msg, timeout: float):
+        req_id = next(self.__req_ids)
+        pending = [threading.Event(), None, None]
+        with self.__pending_lock:
+            self.__pending[req_id] = pending
+        self.send("call", req_id, *msg)
+        if not pending[0].wait(timeout):
+            with self.__pending_lock:
+                self.__pending.pop(req_id, None)
+            raise RuntimeError("no reply after {}s".format(timeout))
+        if pending[2]:
+            raise RuntimeError(pending[2])
+        return pending[1]
+
+    def call_async(self, *msg, callback: typing.Callable[[typing.Any, typing.Optional[str]], None]):
+        req_id = next(self.__req_ids)
+        with self.__pending_lock:
+            self.__pending[req_id] = callback
+        self.send("call", req_id, *msg)
+
+    def reply(self, req_id: int, result=None, error: typing.Optional[str] = None):
+        self.send("reply", req_id, result, error)
+
+    def resolve(self, req_id: int, result, error: typing.Optional[str]):
+        with self.__pending_lock:
+            pending = self.__pending.pop(req_id, None)
+        if callable(pending):
+            pending(result, error)
+        elif pending:
+            pending[1] = result
+            pending[2] = error
+            pending[0].set()
+
+    def fail_pending(self, error: str):
+        with self.__pending_lock:
+            req_ids = list(self.__pending)
+        for req_id in req_ids:
+            self.resolve(req_id, None, error)
+
+    def receive(self) -> list:
+        return self.__conn.recv()
+
+    def close(self):
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify()
+        self.fail_pending("link closed")
+        try:
+            self.__conn.close()
+        except Exception:
+            pass
+
+
+class UpstreamProxy:
+    def __init__(self, link: Link):
+        self.__link = link
+
+    def publish(self, topic: str, payload: str, qos: int) -> None:
+        self.__link.send("publish", topic, payload, qos)
+
+    def subscribe(self, topic: str, qos: int) -> None:
+        self.__link.send("subscribe", topic, qos)
+
+    def unsubscribe(self, topic: str) -> None:
+        self.__link.send("unsubscribe", topic)
+
+
+class AnnouncerProxy:
+    def __init__(self, link: Link):
+        self.__link = link
+
+    def announce(self, device: Device, force: bool = False):
+        self.__link.send("announce", device.id, device.state, force)
+
+
+class HistoryProxy:
+    def __init__(self, link: Link):
+        self.__link = link
+
+    def append(self, series: str, values: dict, timestamp: typing.Optional[float] = None):
+        self.__link.send("append", series, values, timestamp or time.time())
+
+    def query(self, series: str, start: typing.Optional[float] = None, end: typing.Optional[float] = None, resolution: int = 0) -> typing.List[dict]:
+        return self.__link.call("query", series, start, end, resolution, timeout=30)
+
+
+class Worker:
+    def __init__(self, conn: multiprocessing.connection.Connection, index: int, history: bool):
+        self.__name = "session-worker-{}".format(index)
+        self.__link = Link(conn, self.__name)
+        self.__upstream = UpstreamProxy(self.__link)
+        self.__announcer = AnnouncerProxy(self.__link)
+        self.__history = HistoryProxy(self.__link) if history else None
+        self.__sessions: typing.Dict[str, Session] = dict()
+        self.__starter = concurrent.futures.ThreadPoolExecutor(
+            max_workers=conf.Discovery.session_workers,
+            thread_name_prefix="{}-starter".format(self.__name)
+        )
+
+    def __on_lifecycle_event(self, event: str, session: Session):
+        if event == SessionEvent.exited and self.__sessions.get(session.device_id) is session:
+            del self.__sessions[session.device_id]
+        self.__link.send("event", session.device_id, event)
+
+    def __start_session(self, req_id: int, device_id: str, model: str, name: str, local_credentials: str, ip: str, port: int):
+        try:
+            session = Session(
+                mqtt_client=self.__upstream,
+                device=Device(id=device_id, model=model, name=name, local_credentials=local_credentials),
+                ip=ip,
+                port=port,
+                announcer=self.__announcer,
+                sensor_history=self.__history,
+                lifecycle_callback=self.__on_lifecycle_event
+            )
+            session.connect()
+            self.__sessions[device_id] = session
+            session.start()
+            self.__link.reply(req_id)
+        except Exception as ex:
+            self.__link.reply(req_id, error=str(ex))
+
+    def __report_stats(self):
+        while True:
+            time.sleep(5)
+            self.__link.send(
+                "stats",
+                {device_id: session.command_queue_size() for device_id, session in list(self.__sessions.items())}
+            )
+            # session metrics are updated in this process, the parent adds them to its own when exposing
+            if conf.Metrics.enabled:
+                self.__link.send("metrics", registry.snapshot())
+
+    def run(self):
+        logger.info("starting {} ...".format(self.__name))
+        threading.Thread(target=self.__report_stats, name="{}-stats".format(self.__name), daemon=True).start()
+        while True:
+            try:
+                batch = self.__link.receive()
+            except (EOFError, OSError):
+                break
+            for msg in batch:
+                try:
+                    if msg[0] == "command":
+                        session = self.__sessions.get(msg[1])
+                        if session:
+                            session.put_command(msg[2])
+                        else:
+                            logger.warning("{}: no session for '{}'".format(self.__name, msg[1]))
+                    elif msg[0] == "call" and msg[2] == "command":
+                        session = self.__sessions.get(msg[3])
+                        if session:
+                            session.put_command(
+                                msg[4],
+                                callback=lambda resp_msg, error, req_id=msg[1]: self.__link.reply(req_id, resp_msg, error)
+                            )
+                        else:
+                            self.__link.reply(msg[1], error="no session")
+                    elif msg[0] == "call" and msg[2] == "start":
+                        self.__starter.submit(self.__start_session, msg[1], *msg[3:])
+                    elif msg[0] == "stop":
+                        session = self.__sessions.get(msg[1])
+                        if session:
+                            session.stop()
+                    elif msg[0] == "reconfigure":
+                        for (section, key), value in msg[1].items():
+                            setattr(getattr(conf, section), key, value)
+                        init_logger(conf.Logger.level, conf.Logger.rate_limit_interval, conf.Logger.rate_limit_burst)
+                        for session in list(self.__sessions.values()):
+                            session.reconfigure()
+                    elif msg[0] == "remove_series":
+                        registry.remove_series(msg[1], msg[2])
+                    elif msg[0] == "reply":
+                        self.__link.resolve(*msg[1:])
+                except Exception as ex:
+                    logger.error("{}: handling '{}' failed - {}".format(self.__name, msg[0], ex))
+        logger.info("{} exited".format(self.__name))
+
+
+def run_worker(conn: multiprocessing.connection.Connection, index: int, history: bool):
+    init_logger(conf.Logger.level, conf.Logger.rate_limit_interval, conf.Logger.rate_limit_burst)
+    Worker(conn, index, history).run()
+
+
+class ShardedSession:
+    """
+    Stands in for a Session running in a worker process, so the registry, Router and Discovery can treat both alike.
+    """
+
+    def __init__(self, pool: "WorkerPool", device: Device, ip: str, port: int, lifecycle_callback: typing.Optional[typing.Callable[[str, "ShardedSession"], None]] = None):
+        self.__pool = pool
+        self.__device = device
+        self.__ip = ip
+        self.__port = port
+        self.__lifecycle_callback = lifecycle_callback
+        self.__alive = False
+        self.__connected = threading.Event()
+        self.command_queue_length = 0
+        self.name = "session-{}".format(device.id)
+
+    @property
+    def device_id(self) -> str:
+        return self.__device.id
+
+    @property
+    def device(self) -> Device:
+        return self.__device
+
+    def connect(self):
+        self.__pool.start_session(self, self.__ip, self.__port)
+        self.__alive = True
+
+    def start(self):
+        pass
+
+    def is_alive(self) -> bool:
+        return self.__alive
+
+    def wait_for_connect(self, timeout: float) -> bool:
+        return self.__connected.wait(timeout=timeout)
+
+    def put_command(self, cmd: tuple, callback: typing.Optional[typing.Callable[[typing.Optional[dict], typing.Optional[str]], None]] = None):
+        self.__pool.send_command(self.__device.id, cmd, callback)
+
+    def command_queue_size(self) -> int:
+        return self.command_queue_length
+
+    def reconfigure(self):
+        pass
+
+    def stop(self):
+        self.__pool.stop_session(self.__device.id)
+
+    def read_sensor_history(self, start: typing.Optional[float] = None, end: typing.Optional[float] = None, resolution: int = 0) -> typing.List[dict]:
+        return self.__pool.query_history(self.__device.id, start, end, resolution)
+
+    def handle_event(self, event: str):
+        if event == SessionEvent.online:
+            self.__connected.set()
+        elif event == SessionEvent.exited:
+            self.__alive = False
+        if self.__lifecycle_callback:
+            self.__lifecycle_callback(event, self)
+
+
+class WorkerPool:
+    """
+    Runs device sessions in worker processes. Devices are assigned to workers by a stable hash of their ID, so a
+    restarted session always lands on the same worker. The parent keeps the upstream connection and relays
+    publications, announcements and sensor history on behalf of the workers.
+    """
+
+    def __init__(self, size: int, mqtt_client: MQTTClient, announcer: Announcer, sensor_history: typing.Optional[TimeSeriesStore] = None):
+        self.__size = size
+        self.__mqtt_client = mqtt_client
+        self.__announcer = announcer
+        self.__sensor_history = sensor_history
+        self.__context = multiprocessing.get_context("spawn")
+        self.__links: typing.List[typing.Optional[Link]] = [None] * size
+        self.__sessions: typing.List[typing.Dict[str, ShardedSession]] = [dict() for _ in range(size)]
+        self.__models = {model: key for key, model in model_map.items()}
+
+    def __shard(self, device_id: str) -> int:
+        return zlib.crc32(device_id.encode()) % self.__size
+
+    def __spawn(self, index: int):
+        parent_conn, child_conn = self.__context.Pipe()
+        process = self.__context.Process(
+            target=run_worker,
+            args=(child_conn, index, self.__sensor_history is not None),
+            name="session-worker-{}".format(index),
+            daemon=True
+        )
+        process.start()
+        child_conn.close()
+        link = Link(parent_conn, "session-worker-{}-link".format(index))
+        self.__links[index] = link
+        threading.Thread(
+            target=self.__receive,
+            args=(index, link, process),
+            name="session-worker-{}-receiver".format(index),
+            daemon=True
+        ).start()
+
+    def __handle_call(self, link: Link, req_id: int, method: str, *args):
+        try:
+            if method == "query":
+                link.reply(req_id, self.__sensor_history.query(*args))
+            else:
+                raise RuntimeError("unknown method '{}'".format(method))
+        except Exception as ex:
+            link.reply(req_id, error=str(ex))
+
+    def __receive(self, index: int, link: Link, process: multiprocessing.Process):
+        sessions = self.__sessions[index]
+        while True:
+            try:
+                batch = link.receive()
+            except (EOFError, OSError):
+                break
+            for msg in batch:
+                try:
+                    if msg[0] == "publish":
+                        self.__mqtt_client.publish(topic=msg[1], payload=msg[2], qos=msg[3])
+                    elif msg[0] == "event":
+                        session = sessions.get(msg[1])
+                        if session:
+                            if msg[2] == SessionEvent.exited:
+                                del sessions[msg[1]]
+                            session.handle_event(msg[2])
+                    elif msg[0] == "announce":
+                        session = sessions.get(msg[1])
+                        if session:
+                            session.device.state = msg[2]
+                            self.__announcer.announce(session.device, force=msg[3])
+                    elif msg[0] == "subscribe":
+                        self.__mqtt_client.subscribe(topic=msg[1], qos=msg[2])
+                    elif msg[0] == "unsubscribe":
+                        self.__mqtt_client.unsubscribe(topic=msg[1])
+                    elif msg[0] == "append":
+                        if self.__sensor_history:
+                            self.__sensor_history.append(*msg[1:])
+                    elif msg[0] == "stats":
+                        for device_id, session in list(sessions.items()):
+                            session.command_queue_length = msg[1].get(device_id, 0)
+                    elif msg[0] == "metrics":
+                        registry.set_remote("session-worker-{}".format(index), msg[1])
+                    elif msg[0] == "call":
+                        threading.Thread(target=self.__handle_call, args=(link, *msg[1:]), daemon=True).start()
+                    elif msg[0] == "reply":
+                        link.resolve(*msg[1:])
+                except Exception as ex:
+                    logger.error("session-worker-{}: handling '{}' failed - {}".format(index, msg[0], ex))
+        logger.error("session-worker-{} exited with code {} - restarting ...".format(index, process.exitcode))
+        link.close()
+        # a restarted worker starts its counters from zero
+        registry.drop_remote("session-worker-{}".format(index))
+        for device_id, session in list(sessions.items()):
+            del sessions[device_id]
+            session.handle_event(SessionEvent.exited)
+        time.sleep(1)
+        self.__spawn(index)
+
+    def start(self):
+        logger.info("starting {} session workers ...".format(self.__size))
+        for index in range(self.__size):
+            self.__spawn(index)
+
+    def start_session(self, session: ShardedSession, ip: str, port: int):
+        index = self.__shard(session.device_id)
+        device = session.device
+        self.__sessions[index][session.device_id] = session
+        try:
+            self.__links[index].call(
+                "start",
+                device.id,
+                self.__models[device.model],
+                device.name,
+                device.local_credentials,
+                ip,
+                port,
+                timeout=conf.Discovery.connect_timeout + 5
+            )
+        except Exception:
+            if self.__sessions[index].get(session.device_id) is session:
+                del self.__sessions[index][session.device_id]
+            raise
+
+    def stop_session(self, device_id: str):
+        self.__links[self.__shard(device_id)].send("stop", device_id)
+
+    def remove_series(self, device_id: str):
+        registry.remove_series("device", device_id)
+        link = self.__links[self.__shard(device_id)]
+        if link:
+            link.send("remove_series", "device", device_id)
+
+    def send_command(self, device_id: str, cmd: tuple, callback: typing.Optional[typing.Callable] = None):
+        if callback:
+            self.__links[self.__shard(device_id)].call_async("command", device_id, cmd, callback=callback)
+        else:
+            self.__links[self.__shard(device_id)].send("command", device_id, cmd)
+
+    def query_history(self, device_id: str, start: typing.Optional[float], end: typing.Optional[float], resolution: int) -> typing.List[dict]:
+        if not self.__sensor_history:
+            raise RuntimeError("sensor history not enabled")
+        return self.__sensor_history.query(device_id, start=start, end=end, resolution=resolution)
+
+    def reconfigure(self, values: typing.Dict[typing.Tuple[str, str], typing.Any]):
+        for link in self.__links:
+            if link:
+                link.send("reconfigure", values)
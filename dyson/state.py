@@ -0,0 +1,70 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ("DeviceState", )
+
+
+import threading
+import typing
+
+
+_missing = object()
+
+
+class DeviceState:
+    """
+    Device state of a session. 'data' is a plain dict that codec functions read directly. The set base is the
+    state minus dropped keys plus extras and is patched with keys changed since it was built.
+    """
+
+    __slots__ = ("data", "__lock", "__dirty", "__set_base")
+
+    def __init__(self):
+        self.data: dict = dict()
+        self.__lock = threading.Lock()
+        self.__dirty: typing.Set[str] = set()
+        self.__set_base: typing.Optional[dict] = None
+
+    def replace(self, data: dict):
+        with self.__lock:
+            self.data = data
+            self.__set_base = None
+            self.__dirty.clear()
+
+    def merge(self, changes: typing.Dict[str, typing.Sequence]):
+        """changes as sent in STATE-CHANGE messages: key -> (previous value, current value)"""
+        # only the session's message thread writes 'data', so reading it needs no lock
+        data = self.data
+        changed = [key for key, (_, val) in changes.items() if data.get(key, _missing) != val]
+        if changed:
+            with self.__lock:
+                for key in changed:
+                    data[key] = changes[key][1]
+                self.__dirty.update(changed)
+
+    def set_data(self, drop_keys: typing.Container[str], extra: dict, key: str, value) -> dict:
+        with self.__lock:
+            if self.__set_base is None:
+                self.__set_base = {k: v for k, v in self.data.items() if k not in drop_keys}
+                self.__set_base.update(extra)
+            elif self.__dirty:
+                for k in self.__dirty:
+                    if k not in drop_keys and k not in extra:
+                        self.__set_base[k] = self.data[k]
+            self.__dirty.clear()
+            data = self.__set_base.copy()
+        data[key] = value
+        return data
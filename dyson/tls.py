@@ -0,0 +1,96 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ("is_tls_port", "ResumingContext")
+
+
+from util import get_logger, conf, registry
+import threading
+import typing
+import time
+import ssl
+
+
+logger = get_logger(__name__.split(".", 1)[-1])
+
+handshakes = registry.counter("dyson_dc_device_tls_handshakes_total", "TLS handshakes with devices.", labels=("resumed", ))
+
+_context: typing.Optional[ssl.SSLContext] = None
+_context_lock = threading.Lock()
+_sessions: typing.Dict[typing.Tuple[str, int], ssl.SSLSession] = dict()
+_sessions_lock = threading.Lock()
+
+
+def is_tls_port(port: int) -> bool:
+    return str(port) in str(conf.Session.tls_ports).split(";")
+
+
+def get_context() -> ssl.SSLContext:
+    global _context
+    with _context_lock:
+        if not _context:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            # devices are addressed by ip, certificates can only be checked against a CA
+            context.check_hostname = False
+            if conf.Session.tls_ca_file:
+                context.load_verify_locations(cafile=conf.Session.tls_ca_file)
+                context.verify_mode = ssl.CERT_REQUIRED
+            else:
+                context.verify_mode = ssl.CERT_NONE
+            _context = context
+        return _context
+
+
+def _get_session(key: typing.Tuple[str, int]) -> typing.Optional[ssl.SSLSession]:
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session and session.time + session.timeout < time.time():
+            del _sessions[key]
+            return None
+        return session
+
+
+def _put_session(key: typing.Tuple[str, int], session: ssl.SSLSession):
+    with _sessions_lock:
+        _sessions.pop(key, None)
+        while _sessions and len(_sessions) >= conf.Session.tls_session_cache:
+            del _sessions[next(iter(_sessions))]
+        if conf.Session.tls_session_cache > 0:
+            _sessions[key] = session
+
+
+class ResumingContext:
+    """
+    Hands the shared client context to paho and offers the last TLS session of the same device address for
+    resumption, so reconnects skip the full handshake.
+    """
+
+    def __init__(self, ip: str, port: int):
+        self.__key = (ip, port)
+        self.__context = get_context()
+
+    @property
+    def check_hostname(self) -> bool:
+        return self.__context.check_hostname
+
+    def wrap_socket(self, sock, **kwargs) -> ssl.SSLSocket:
+        return self.__context.wrap_socket(sock, session=_get_session(self.__key), **kwargs)
+
+    def store_session(self, sock: typing.Any):
+        if isinstance(sock, ssl.SSLSocket) and sock.session:
+            handshakes.inc(str(sock.session_reused).lower())
+            logger.debug("%s:%s: tls session reused: %s", *self.__key, sock.session_reused)
+            _put_session(self.__key, sock.session)
@@ -14,25 +14,40 @@
    limitations under the License.
 """
 
+from .cache import *
+from .cluster import *
 from .config import *
 from .logger import *
+from .metrics import *
 from .mqtt import *
+from .profiler import *
+from .rate_limiter import *
+from .reload import *
 from .router import *
+from .scheduler import *
 from .storage import *
+from .timeseries import *
 import sys
 import random
 import time
-import Crypto.Cipher.AES
 import base64
 import typing
 
 
 __all__ = (
+    cache.__all__,
+    cluster.__all__,
     config.__all__,
     logger.__all__,
+    metrics.__all__,
     mqtt.__all__,
+    profiler.__all__,
+    rate_limiter.__all__,
+    reload.__all__,
     router.__all__,
-    storage.__all__
+    scheduler.__all__,
+    storage.__all__,
+    timeseries.__all__
 )
 
 
@@ -91,5 +106,6 @@ def decrypt_password(encrypted_password):
           b'\x11\x12\x13\x14\x15\x16\x17\x18\x19\x1a\x1b\x1c\x1d\x1e\x1f '
     init_vector = b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00' \
                   b'\x00\x00\x00\x00'
+    import Crypto.Cipher.AES
     cipher = Crypto.Cipher.AES.new(key, Crypto.Cipher.AES.MODE_CBC, init_vector)
     return unpad(cipher.decrypt(base64.b64decode(encrypted_password)).decode('utf-8'))
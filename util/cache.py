@@ -0,0 +1,58 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ("TTLCache", )
+
+
+import collections
+import threading
+import typing
+import time
+
+
+class TTLCache:
+    """
+    Bounded mapping dropping the least recently used entry when full and entries older than ttl seconds on access.
+    """
+
+    def __init__(self, size: int, ttl: float):
+        self.__size = size
+        self.__ttl = ttl
+        self.__entries: typing.OrderedDict[typing.Hashable, typing.Tuple[float, typing.Any]] = collections.OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key: typing.Hashable, default: typing.Any = None) -> typing.Any:
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                return default
+            if entry[0] < time.monotonic():
+                del self.__entries[key]
+                return default
+            self.__entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: typing.Hashable, value: typing.Any):
+        if self.__size <= 0:
+            return
+        with self.__lock:
+            self.__entries[key] = (time.monotonic() + self.__ttl, value)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.__size:
+                self.__entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self.__entries)
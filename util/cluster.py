@@ -0,0 +1,171 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ("HashRing", "Cluster")
+
+
+from .logger import get_logger
+import paho.mqtt.client
+import threading
+import hashlib
+import bisect
+import typing
+import json
+import time
+
+
+logger = get_logger(__name__.split(".", 1)[-1])
+
+
+def hash_key(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    def __init__(self, members: typing.Iterable[str], vnodes: int):
+        self.members = frozenset(members)
+        points = sorted((hash_key("{}#{}".format(member, i)), member) for member in self.members for i in range(vnodes))
+        self.__hashes = [point[0] for point in points]
+        self.__members = [point[1] for point in points]
+
+    def owner(self, key: str) -> typing.Optional[str]:
+        if not self.__hashes:
+            return None
+        return self.__members[bisect.bisect(self.__hashes, hash_key(key)) % len(self.__hashes)]
+
+
+class Cluster(threading.Thread):
+    """
+    Tracks the instances sharing a broker and maps keys to instances via a consistent hash ring. Every instance
+    publishes a retained heartbeat to '<topic>/<instance id>' and clears it on shutdown or, via its last will, when it
+    dies. Members not heard from within the lease timeout are dropped.
+    """
+
+    def __init__(self, instance_id: str, host: str, port: int, topic: str, heartbeat_interval: float, lease_timeout: float, vnodes: int):
+        super().__init__(name="cluster", daemon=True)
+        self.instance_id = instance_id
+        self.__host = host
+        self.__port = port
+        self.__topic = topic
+        self.__heartbeat_interval = heartbeat_interval
+        self.__lease_timeout = lease_timeout
+        self.__vnodes = vnodes
+        self.__members: typing.Dict[str, float] = dict()
+        self.__lock = threading.Lock()
+        self.ring = HashRing((instance_id, ), vnodes)
+        self.on_change: typing.Optional[typing.Callable[[], None]] = None
+        self.__ready = threading.Event()
+        self.__stop = threading.Event()
+        self.__client = paho.mqtt.client.Client(client_id="{}-cluster".format(instance_id))
+        self.__client.on_connect = self.__on_connect
+        self.__client.on_subscribe = self.__on_subscribe
+        self.__client.on_message = self.__on_message
+        self.__client.will_set(topic=self.__gen_topic(instance_id), payload=None, qos=1, retain=True)
+
+    def __gen_topic(self, instance_id: str) -> str:
+        return "{}/{}".format(self.__topic, instance_id)
+
+    def __on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            logger.info("joining cluster at '{}' as '{}'".format(self.__topic, self.instance_id))
+            self.__client.subscribe("{}/+".format(self.__topic), 1)
+            self.__publish_heartbeat()
+        else:
+            logger.error("could not connect to '{}' - {}".format(self.__host, paho.mqtt.client.connack_string(rc)))
+
+    def __on_subscribe(self, client, userdata, mid, granted_qos):
+        # retained heartbeats arrive right after the subscription, give them a moment before claiming devices
+        threading.Timer(1, self.__ready.set).start()
+
+    def __on_message(self, client, userdata, message: paho.mqtt.client.MQTTMessage):
+        instance_id = message.topic.rsplit("/", 1)[-1]
+        if instance_id == self.instance_id:
+            return
+        changed = False
+        with self.__lock:
+            if not message.payload:
+                changed = self.__members.pop(instance_id, None) is not None
+                if changed:
+                    logger.info("'{}' left the cluster".format(instance_id))
+            else:
+                # liveness is judged by local receive time only, clocks of other instances may be off and a stale
+                # retained heartbeat simply expires after the lease timeout
+                try:
+                    json.loads(message.payload)
+                except Exception as ex:
+                    logger.warning("invalid heartbeat from '{}' - {}".format(instance_id, ex))
+                    return
+                changed = instance_id not in self.__members
+                self.__members[instance_id] = time.monotonic()
+                if changed:
+                    logger.info("'{}' joined the cluster".format(instance_id))
+        if changed:
+            self.__update_ring()
+
+    def __publish_heartbeat(self):
+        self.__client.publish(
+            self.__gen_topic(self.instance_id),
+            json.dumps({"time": time.time()}),
+            qos=1,
+            retain=True
+        )
+
+    def __expire_members(self):
+        now = time.monotonic()
+        with self.__lock:
+            expired = [instance_id for instance_id, seen in self.__members.items() if now - seen > self.__lease_timeout]
+            for instance_id in expired:
+                logger.warning("lease of '{}' expired".format(instance_id))
+                del self.__members[instance_id]
+        if expired:
+            self.__update_ring()
+
+    def __update_ring(self):
+        with self.__lock:
+            self.ring = HashRing((self.instance_id, *self.__members), self.__vnodes)
+        logger.info("cluster members: {}".format(", ".join(sorted(self.ring.members))))
+        if self.on_change:
+            self.on_change()
+
+    def owns(self, key: str) -> bool:
+        return self.ring.owner(key) == self.instance_id
+
+    def wait_ready(self, timeout: typing.Optional[float] = None) -> bool:
+        return self.__ready.wait(timeout)
+
+    def run(self):
+        logger.info("starting {} ...".format(self.name))
+        while not self.__stop.is_set():
+            try:
+                self.__client.connect(self.__host, self.__port, keepalive=max(int(self.__heartbeat_interval), 1))
+                break
+            except Exception as ex:
+                logger.error("could not connect to '{}' on '{}' - {}".format(self.__host, self.__port, ex))
+                self.__stop.wait(5)
+        self.__client.loop_start()
+        while not self.__stop.wait(self.__heartbeat_interval):
+            if self.__client.is_connected():
+                self.__publish_heartbeat()
+            self.__expire_members()
+
+    def stop(self):
+        self.__stop.set()
+        try:
+            self.__client.publish(self.__gen_topic(self.instance_id), None, qos=1, retain=True).wait_for_publish(2)
+            self.__client.disconnect()
+            self.__client.loop_stop()
+        except Exception as ex:
+            logger.warning("leaving cluster failed - {}".format(ex))
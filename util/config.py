@@ -32,6 +32,8 @@ class Conf:
     class Logger:
         level = "info"
         enable_mqtt = False
+        rate_limit_interval = 60
+        rate_limit_burst = 5
 
     @simple_env_var.section
     class Client:
@@ -45,13 +47,29 @@ class Conf:
         cloud_auth_api = "v1/userregistration/authenticate"
         cloud_provisioning_api = "v1/provisioningservice/manifest"
         cloud_delay = 600
+        cloud_timeout = 10
+        cloud_backoff = 30
+        cloud_backoff_max = 3600
         grace_period = 86400
         db_path = "/opt/storage"
+        source = "static"
+        provisioning_file = "/opt/devices.json"
         device_id_prefix = None
         delay = 240
+        broker_timeout = 30
+        fast_resume = True
         ports = "1883;8883"
         probe_timeout = 2
+        probe_ttl = 900
+        probe_negative_ttl = 960
+        session_workers = 16
+        connect_timeout = 10
+        connect_retries = 3
+        connect_retry_delay = 15
+        announce_rate = 50
+        announce_burst = 100
         ip_file = "/opt/host_ip"
+        arp_file = "/proc/net/arp"
         device_wifi_ssid = None
         device_wifi_password = None
         device_name = None
@@ -65,9 +83,65 @@ class Conf:
     @simple_env_var.section
     class Session:
         sensor_interval = 10
+        sensor_interval_max = 0
+        sensor_interval_growth = 1.5
+        sensor_thresholds = "temperature:0.3;humidity:2;particles:2;volatile_components:1;pm25:2;pm10:2;nitrogen_dioxide:1"
         keepalive = 5
         logging = False
         max_disconnects = 10
+        command_cache_size = 64
+        command_workers = 32
+        command_ack_timeout = 10
+        event_batch_size = 0
+        event_batch_latency = 60
+        command_cache_ttl = 3600
+        tls_ports = "8883"
+        tls_ca_file = None
+        tls_session_cache = 1024
+
+    @simple_env_var.section
+    class History:
+        enabled = False
+        resolutions = "0;60;900"
+        retentions = "86400;1209600;31536000"
+        block_size = 360
+        flush_interval = 300
+        max_pending_blocks = 1000
+
+    @simple_env_var.section
+    class Metrics:
+        enabled = False
+        host = "0.0.0.0"
+        port = 9100
+
+    @simple_env_var.section
+    class Profiler:
+        enabled = False
+        interval = 0.01
+        max_duration = 300
+
+    @simple_env_var.section
+    class Cluster:
+        enabled = False
+        topic = "dyson-dc/cluster"
+        heartbeat_interval = 5
+        lease_timeout = 15
+        vnodes = 64
+        handover_delay = 5
+
+    @simple_env_var.section
+    class Group:
+        enabled = False
+        timeout = 15
+
+    @simple_env_var.section
+    class Sharding:
+        workers = 0
+
+    @simple_env_var.section
+    class Reload:
+        file = None
+        interval = 10
 
     @simple_env_var.section
     class StartDelay:
@@ -78,6 +152,10 @@ class Conf:
     @simple_env_var.section
     class Senergy:
         dt_pure_cool_link = None
+        dt_pure_hot_cool_link = None
+        dt_pure_cool = None
+        dt_pure_cool_desk = None
+        dt_pure_hot_cool = None
 
 
 conf = Conf()
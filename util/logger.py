@@ -14,10 +14,13 @@
    limitations under the License.
 """
 
-__all__ = ("get_logger", "init_logger")
+__all__ = ("get_logger", "init_logger", "Lazy")
 
 
+import threading
 import logging
+import typing
+import time
 
 
 logging_levels = {
@@ -34,22 +37,70 @@ class LoggingLevelError(Exception):
         super().__init__("level '{}' not in {}".format(msg, tuple(logging_levels)))
 
 
+class Lazy:
+    __slots__ = ("__func", "__args")
+
+    def __init__(self, func: typing.Callable, *args):
+        self.__func = func
+        self.__args = args
+
+    def __str__(self):
+        return str(self.__func(*self.__args))
+
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, interval: float, burst: int, level: int = logging.WARNING):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self.__level = level
+        self.__windows: typing.Dict[tuple, list] = dict()
+        self.__lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < self.__level or self.interval <= 0:
+            return True
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        with self.__lock:
+            window = self.__windows.get(key)
+            if not window or now - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                self.__windows[key] = [now, 1, 0]
+                if len(self.__windows) > 1024:
+                    for old_key in [k for k, w in self.__windows.items() if now - w[0] >= self.interval]:
+                        del self.__windows[old_key]
+                if suppressed:
+                    record.msg = "{} (suppressed {} similar messages)".format(record.msg, suppressed)
+                return True
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+
 msg_fmt = '%(asctime)s - %(levelname)s: [%(name)s] %(message)s'
 date_fmt = '%m.%d.%Y %I:%M:%S %p'
 
 
+rate_limit_filter = RateLimitFilter(interval=0, burst=0)
+
 handler = logging.StreamHandler()
 handler.setFormatter(logging.Formatter(fmt=msg_fmt, datefmt=date_fmt))
+handler.addFilter(rate_limit_filter)
 
 logger = logging.getLogger("dyson-dc")
 logger.propagate = False
 logger.addHandler(handler)
 
 
-def init_logger(level):
+def init_logger(level, rate_limit_interval: float = 0, rate_limit_burst: int = 5):
     if level not in logging_levels.keys():
         raise LoggingLevelError(level)
     logger.setLevel(logging_levels[level])
+    rate_limit_filter.interval = rate_limit_interval
+    rate_limit_filter.burst = rate_limit_burst
 
 
 def get_logger(name: str) -> logging.Logger:
@@ -0,0 +1,252 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ("Counter", "Gauge", "Histogram", "MetricsServer", "registry")
+
+
+from .logger import get_logger
+import http.server
+import threading
+import typing
+import bisect
+import math
+
+
+logger = get_logger(__name__.split(".", 1)[-1])
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(names: typing.Sequence[str], values: typing.Sequence, extra: str = "") -> str:
+    items = ['{}="{}"'.format(name, _escape(value)) for name, value in zip(names, values)]
+    if extra:
+        items.append(extra)
+    return "{{{}}}".format(",".join(items)) if items else ""
+
+
+def _fmt_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, doc: str, labels: typing.Sequence[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.label_names = tuple(labels)
+        self._values: typing.Dict[tuple, typing.Any] = dict()
+        self._lock = threading.Lock()
+
+    def remove(self, *labels):
+        with self._lock:
+            self._values.pop(labels, None)
+
+    def remove_series(self, label: str, value):
+        if label not in self.label_names:
+            return
+        index = self.label_names.index(label)
+        with self._lock:
+            for labels in [labels for labels in self._values if labels[index] == value]:
+                del self._values[labels]
+
+    def snapshot(self) -> typing.Dict[tuple, typing.Any]:
+        with self._lock:
+            return {labels: list(value) if isinstance(value, list) else value for labels, value in self._values.items()}
+
+    def _merged(self, remote: typing.Sequence[typing.Dict[tuple, typing.Any]]) -> typing.List[tuple]:
+        values = self.snapshot()
+        for snapshot in remote:
+            for labels, value in snapshot.items():
+                current = values.get(labels)
+                if current is None:
+                    values[labels] = list(value) if isinstance(value, list) else value
+                elif isinstance(current, list):
+                    values[labels] = [a + b for a, b in zip(current, value)]
+                else:
+                    values[labels] = current + value
+        return list(values.items())
+
+    def _samples(self, remote: typing.Sequence[dict] = ()) -> typing.Iterable[typing.Tuple[str, str, float]]:
+        for labels, value in self._merged(remote):
+            yield "", _fmt_labels(self.label_names, labels), value
+
+    def collect(self, remote: typing.Sequence[dict] = ()) -> typing.List[str]:
+        lines = ["# HELP {} {}".format(self.name, self.doc), "# TYPE {} {}".format(self.name, self.type)]
+        for suffix, labels, value in self._samples(remote):
+            lines.append("{}{}{} {}".format(self.name, suffix, labels, _fmt_value(value)))
+        return lines
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, doc: str, labels: typing.Sequence[str] = (), func: typing.Optional[typing.Callable[[], float]] = None):
+        super().__init__(name, doc, labels)
+        self.func = func
+
+    def set(self, value: float, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def _samples(self, remote: typing.Sequence[dict] = ()):
+        if self.func:
+            try:
+                yield "", "", self.func()
+            except Exception as ex:
+                logger.warning("collecting '%s' failed - %s", self.name, ex)
+        else:
+            yield from super()._samples(remote)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, doc: str, buckets: typing.Sequence[float], labels: typing.Sequence[str] = ()):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            data = self._values.get(labels)
+            if data is None:
+                data = [0] * (len(self.buckets) + 1) + [0.0]
+                self._values[labels] = data
+            data[index] += 1
+            data[-1] += value
+
+    def _samples(self, remote: typing.Sequence[dict] = ()):
+        for labels, data in self._merged(remote):
+            count = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf, ), data):
+                count += bucket_count
+                yield "_bucket", _fmt_labels(self.label_names, labels, 'le="{}"'.format(_fmt_value(float(bound)))), count
+            yield "_sum", _fmt_labels(self.label_names, labels), data[-1]
+            yield "_count", _fmt_labels(self.label_names, labels), count
+
+
+class Registry:
+    """
+    Holds the metrics of this process. Snapshots of other processes (session workers) are added to the local values
+    of metrics with the same name when exposed.
+    """
+
+    def __init__(self):
+        self.__metrics: typing.Dict[str, _Metric] = dict()
+        self.__remote: typing.Dict[str, typing.Dict[str, dict]] = dict()
+        self.__lock = threading.Lock()
+
+    def register(self, metric: _Metric):
+        with self.__lock:
+            if metric.name in self.__metrics:
+                return self.__metrics[metric.name]
+            self.__metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, doc: str, labels: typing.Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, doc, labels))
+
+    def gauge(self, name: str, doc: str, labels: typing.Sequence[str] = (), func: typing.Optional[typing.Callable[[], float]] = None) -> Gauge:
+        return self.register(Gauge(name, doc, labels, func))
+
+    def histogram(self, name: str, doc: str, buckets: typing.Sequence[float], labels: typing.Sequence[str] = ()) -> Histogram:
+        return self.register(Histogram(name, doc, buckets, labels))
+
+    def snapshot(self) -> typing.Dict[str, dict]:
+        with self.__lock:
+            metrics = list(self.__metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics if not getattr(metric, "func", None)}
+
+    def set_remote(self, source: str, snapshot: typing.Dict[str, dict]):
+        with self.__lock:
+            self.__remote[source] = snapshot
+
+    def drop_remote(self, source: str):
+        with self.__lock:
+            self.__remote.pop(source, None)
+
+    def remove_series(self, label: str, value):
+        # drops all series of e.g. a removed device, including those last reported by other processes
+        with self.__lock:
+            metrics = list(self.__metrics.values())
+            indexes = {metric.name: metric.label_names.index(label) for metric in metrics if label in metric.label_names}
+            # snapshots are replaced, not changed, expose() may be reading them
+            self.__remote = {
+                source: {
+                    name: {
+                        labels: val for labels, val in values.items() if name not in indexes or labels[indexes[name]] != value
+                    } for name, values in snapshot.items()
+                } for source, snapshot in self.__remote.items()
+            }
+        for metric in metrics:
+            metric.remove_series(label, value)
+
+    def expose(self) -> str:
+        with self.__lock:
+            metrics = list(self.__metrics.values())
+            remote = list(self.__remote.values())
+        lines = list()
+        for metric in metrics:
+            lines.extend(metric.collect([snapshot[metric.name] for snapshot in remote if metric.name in snapshot]))
+        lines.append("")
+        return "\n".join(lines)
+
+
+registry = Registry()
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.expose().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+class MetricsServer(threading.Thread):
+    def __init__(self, host: str, port: int):
+        super().__init__(name="metrics-server", daemon=True)
+        self.__server = http.server.ThreadingHTTPServer((host, port), _Handler)
+        self.__server.daemon_threads = True
+
+    def run(self):
+        logger.info("starting {} on '{}' ...".format(self.name, self.__server.server_address[1]))
+        self.__server.serve_forever()
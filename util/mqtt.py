@@ -19,13 +19,24 @@ __all__ = ("MQTTClient", )
 
 from .logger import get_logger
 from .config import conf
+from .metrics import registry
+import threading
 import paho.mqtt.client
+import typing
 import time
 import mgw_dc
 
 
 logger = get_logger(__name__.split(".", 1)[-1])
 
+publish_latency = registry.histogram(
+    "dyson_dc_upstream_publish_latency_seconds",
+    "Time from publishing a message upstream until the broker acknowledged it.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+publish_failures = registry.counter("dyson_dc_upstream_publish_failures_total", "Upstream publish calls that failed.")
+connects = registry.counter("dyson_dc_upstream_connects_total", "Successful connections to the upstream broker.")
+
 
 class MQTTClient:
     def __init__(self):
@@ -36,22 +47,33 @@ class MQTTClient:
         self.__client.on_connect = self.__on_connect
         self.__client.on_disconnect = self.__on_disconnect
         self.__client.on_message = self.__on_message
+        self.__client.on_publish = self.__on_publish
         self.__client.will_set(topic=mgw_dc.dm.gen_last_will_topic(conf.Client.id), payload="1", qos=2)
         if conf.Logger.enable_mqtt:
             self.__client.enable_logger(logger)
         self.connected = self.__client.is_connected
+        self.__connected_event = threading.Event()
         self.on_connect = None
         self.on_message = None
+        self.__inflight = dict()
+        self.__acked = dict()
+        self.__subscriptions = list()
+        self.__inflight_lock = threading.RLock()
 
     def __on_connect(self, client, userdata, flags, rc):
         if rc == 0:
             logger.info("connected to '{}'".format(conf.MsgBroker.host))
+            connects.inc()
+            self.__connected_event.set()
             self.__client.subscribe(mgw_dc.dm.gen_refresh_topic(), 1)
+            for topic, qos in self.__subscriptions:
+                self.__client.subscribe(topic, qos)
             self.on_connect(True)
         else:
             logger.error("could not connect to '{}' - {}".format(conf.MsgBroker.host, paho.mqtt.client.connack_string(rc)))
 
     def __on_disconnect(self, client, userdata, rc):
+        self.__connected_event.clear()
         if rc == 0:
             logger.info("disconnected from '{}'".format(conf.MsgBroker.host))
         else:
@@ -60,6 +82,18 @@ class MQTTClient:
     def __on_message(self, client, userdata, message: paho.mqtt.client.MQTTMessage):
         self.on_message(message.topic, message.payload)
 
+    def __on_publish(self, client, userdata, mid):
+        # paho calls this while holding its outgoing message lock, publish() must not call paho under __inflight_lock
+        acked = time.monotonic()
+        with self.__inflight_lock:
+            started = self.__inflight.pop(mid, None)
+            if started is None:
+                if len(self.__acked) > 10000:
+                    self.__acked.clear()
+                self.__acked[mid] = acked
+        if started is not None:
+            publish_latency.observe(acked - started)
+
     def start(self):
         while True:
             try:
@@ -72,23 +106,40 @@ class MQTTClient:
                 )
                 time.sleep(5)
 
+    def wait_for_connect(self, timeout: typing.Optional[float] = None) -> bool:
+        return self.__connected_event.wait(timeout)
+
+    def add_subscription(self, topic: str, qos: int) -> None:
+        self.__subscriptions.append((topic, qos))
+
     def subscribe(self, topic: str, qos: int) -> None:
         res = self.__client.subscribe(topic=topic, qos=qos)
         if res[0] is paho.mqtt.client.MQTT_ERR_SUCCESS:
-            logger.debug("subscribed to '{}'".format(topic))
+            logger.debug("subscribed to '%s'", topic)
         else:
             raise RuntimeError(paho.mqtt.client.error_string(res[0]).replace(".", "").lower())
 
     def unsubscribe(self, topic: str) -> None:
         res = self.__client.unsubscribe(topic=topic)
         if res[0] is paho.mqtt.client.MQTT_ERR_SUCCESS:
-            logger.debug("unsubscribed from '{}'".format(topic))
+            logger.debug("unsubscribed from '%s'", topic)
         else:
             raise RuntimeError(paho.mqtt.client.error_string(res[0]).replace(".", "").lower())
 
     def publish(self, topic: str, payload: str, qos: int) -> None:
+        started = time.monotonic()
         msg_info = self.__client.publish(topic=topic, payload=payload, qos=qos, retain=False)
         if msg_info.rc == paho.mqtt.client.MQTT_ERR_SUCCESS:
-            logger.debug("published '{}' - (q{}, m{})".format(payload, qos, msg_info.mid))
+            with self.__inflight_lock:
+                acked = self.__acked.pop(msg_info.mid, None)
+                if acked is None:
+                    if len(self.__inflight) > 10000:
+                        self.__inflight.clear()
+                    self.__inflight[msg_info.mid] = started
+            if acked is not None:
+                publish_latency.observe(acked - started)
+        if msg_info.rc == paho.mqtt.client.MQTT_ERR_SUCCESS:
+            logger.debug("published '%s' - (q%s, m%s)", payload, qos, msg_info.mid)
         else:
+            publish_failures.inc()
             raise RuntimeError(paho.mqtt.client.error_string(msg_info.rc).replace(".", "").lower())
@@ -0,0 +1,146 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ("Profiler", )
+
+
+from .logger import get_logger
+import traceback
+import queue
+import threading
+import typing
+import time
+import sys
+import os
+
+
+logger = get_logger(__name__.split(".", 1)[-1])
+
+
+class Profiler:
+    """
+    Sampling profiler and stack dumper driven by signals and admin commands.
+
+    All actions are queued and carried out by a control thread, so requesting them only needs a put on a
+    reentrant queue and is safe from signal handlers.
+    """
+
+    def __init__(self, path: str, interval: float, max_duration: float):
+        self.__path = path
+        self.__interval = interval
+        self.__max_duration = max_duration
+        self.__sampler: typing.Optional[threading.Thread] = None
+        self.__stop = threading.Event()
+        self.__requests = queue.SimpleQueue()
+        self.__control = threading.Thread(target=self.__run_control, name="profiler-control", daemon=True)
+        self.__control.start()
+
+    def __gen_path(self, kind: str, ext: str) -> str:
+        return os.path.join(self.__path, "{}-{}.{}".format(kind, time.strftime("%Y%m%dT%H%M%SZ", time.gmtime()), ext))
+
+    def __sample(self):
+        samples: typing.Dict[str, int] = dict()
+        own_ident = threading.get_ident()
+        started = time.monotonic()
+        count = 0
+        while not self.__stop.wait(self.__interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = list()
+                while frame:
+                    stack.append("{}:{}:{}".format(os.path.basename(frame.f_code.co_filename), frame.f_code.co_name, frame.f_lineno))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                key = ";".join(reversed(stack))
+                samples[key] = samples.get(key, 0) + 1
+            count += 1
+            if time.monotonic() - started > self.__max_duration:
+                logger.warning("profiler reached max duration of {}s".format(self.__max_duration))
+                break
+        path = self.__gen_path("profile", "folded")
+        try:
+            with open(path, "w") as file:
+                for key, value in sorted(samples.items()):
+                    file.write("{} {}\n".format(key, value))
+            logger.info("wrote {} samples to '{}'".format(count, path))
+        except Exception as ex:
+            logger.error("writing profile failed - {}".format(ex))
+
+    def __running(self) -> bool:
+        return self.__sampler is not None and self.__sampler.is_alive()
+
+    def __start(self):
+        if self.__running():
+            return
+        if self.__sampler:
+            self.__sampler.join()
+        logger.info("starting profiler ...")
+        self.__stop.clear()
+        self.__sampler = threading.Thread(target=self.__sample, name="profiler", daemon=True)
+        self.__sampler.start()
+
+    def __stop_sampler(self):
+        if not self.__running():
+            return
+        logger.info("stopping profiler ...")
+        self.__stop.set()
+        self.__sampler.join()
+
+    def __dump_stacks(self):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        path = self.__gen_path("stacks", "txt")
+        try:
+            with open(path, "w") as file:
+                for ident, frame in sys._current_frames().items():
+                    file.write("Thread '{}' ({}):\n".format(names.get(ident, "unknown"), ident))
+                    file.write("".join(traceback.format_stack(frame)))
+                    file.write("\n")
+            logger.info("wrote thread stacks to '{}'".format(path))
+        except Exception as ex:
+            logger.error("writing thread stacks failed - {}".format(ex))
+
+    def __run_control(self):
+        actions = {
+            "start": self.__start,
+            "stop": self.__stop_sampler,
+            "toggle": lambda: self.__stop_sampler() if self.__running() else self.__start(),
+            "dump": self.__dump_stacks
+        }
+        while True:
+            action = self.__requests.get()
+            try:
+                actions[action]()
+            except Exception as ex:
+                logger.error("profiler action '{}' failed - {}".format(action, ex))
+
+    def start(self):
+        self.__requests.put("start")
+
+    def stop(self):
+        self.__requests.put("stop")
+
+    def toggle(self):
+        self.__requests.put("toggle")
+
+    def dump_stacks(self):
+        self.__requests.put("dump")
+
+    def handle_command(self, action: str):
+        if action not in ("start", "stop", "dump"):
+            raise RuntimeError("unknown profiler action '{}'".format(action))
+        self.__requests.put(action)
@@ -0,0 +1,60 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ("TokenBucket", )
+
+
+import threading
+import time
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.__rate = rate
+        self.__burst = burst
+        self.__tokens = float(burst)
+        self.__last = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def __refill(self):
+        now = time.monotonic()
+        self.__tokens = min(self.__burst, self.__tokens + (now - self.__last) * self.__rate)
+        self.__last = now
+
+    def configure(self, rate: float, burst: int):
+        with self.__lock:
+            self.__refill()
+            self.__rate = rate
+            self.__burst = burst
+            self.__tokens = min(self.__tokens, float(burst))
+
+    def try_consume(self, tokens: int = 1) -> bool:
+        with self.__lock:
+            self.__refill()
+            if self.__tokens >= tokens:
+                self.__tokens -= tokens
+                return True
+            return False
+
+    def consume(self, tokens: int = 1):
+        while True:
+            with self.__lock:
+                self.__refill()
+                if self.__tokens >= tokens:
+                    self.__tokens -= tokens
+                    return
+                wait = (tokens - self.__tokens) / self.__rate
+            time.sleep(wait)
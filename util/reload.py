@@ -0,0 +1,209 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ("ConfigReloader", "reloadable")
+
+
+from .logger import get_logger, init_logger, logging_levels
+from .config import conf
+import threading
+import typing
+import os
+
+
+logger = get_logger(__name__.split(".", 1)[-1])
+
+reloadable = {
+    "Logger": ("level", "rate_limit_interval", "rate_limit_burst"),
+    "Discovery": (
+        "cloud_delay",
+        "grace_period",
+        "delay",
+        "ports",
+        "probe_timeout",
+        "probe_ttl",
+        "probe_negative_ttl",
+        "connect_timeout",
+        "connect_retries",
+        "connect_retry_delay",
+        "announce_rate",
+        "announce_burst"
+    ),
+    "Group": ("timeout", ),
+    "Session": (
+        "sensor_interval",
+        "sensor_interval_max",
+        "sensor_interval_growth",
+        "sensor_thresholds",
+        "event_batch_size",
+        "event_batch_latency",
+        "max_disconnects",
+        "command_ack_timeout"
+    )
+}
+
+
+# rates and intervals where zero divides by zero or makes a loop spin
+positive = {
+    "Discovery": ("cloud_delay", "delay", "probe_timeout", "connect_timeout", "announce_rate", "announce_burst"),
+    "Group": ("timeout", ),
+    "Session": ("sensor_interval", "sensor_interval_growth", "event_batch_latency", "command_ack_timeout")
+}
+
+# durations and rates that default to whole numbers but may be set to fractions
+fractional = {
+    "Logger": ("rate_limit_interval", ),
+    "Discovery": (
+        "cloud_delay",
+        "grace_period",
+        "delay",
+        "probe_timeout",
+        "probe_ttl",
+        "probe_negative_ttl",
+        "connect_timeout",
+        "connect_retry_delay",
+        "announce_rate"
+    ),
+    "Group": ("timeout", ),
+    "Session": ("sensor_interval", "sensor_interval_max", "event_batch_latency", "command_ack_timeout")
+}
+
+
+def convert(value: str, current, allow_fraction: bool = False):
+    if isinstance(current, bool):
+        if value.lower() in ("true", "1", "yes"):
+            return True
+        if value.lower() in ("false", "0", "no"):
+            return False
+        raise ValueError("'{}' is not a boolean".format(value))
+    if isinstance(current, int):
+        number = float(value)
+        if number.is_integer():
+            return int(number)
+        if allow_fraction:
+            return number
+        raise ValueError("'{}' is not a whole number".format(value))
+    if isinstance(current, float):
+        return float(value)
+    return value
+
+
+def validate(section: str, key: str, value):
+    if section == "Logger" and key == "level" and value not in logging_levels:
+        raise ValueError("level '{}' not in {}".format(value, tuple(logging_levels)))
+    if section == "Discovery" and key == "ports":
+        [int(port) for port in str(value).split(";")]
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and value < 0:
+        raise ValueError("'{}' is negative".format(value))
+    if key in positive.get(section, ()) and not value > 0:
+        raise ValueError("'{}' is not positive".format(value))
+
+
+def read_file(path: str) -> typing.Dict[str, str]:
+    items = dict()
+    with open(path, "r") as file:
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            name, value = line.split("=", 1)
+            items[name.strip().upper()] = value.strip().strip("\"'")
+    return items
+
+
+class ConfigReloader(threading.Thread):
+    """
+    Reloads settings from a file with environment variable style lines (CONF_SESSION_SENSOR_INTERVAL=30) whenever the
+    file changes or trigger() is called. Only settings listed in 'reloadable' are applied, listeners receive the
+    changed (section, key) pairs.
+    """
+
+    def __init__(self, path: str, interval: float):
+        super().__init__(name="config-reloader", daemon=True)
+        self.__path = path
+        self.__interval = interval
+        self.__listeners: typing.List[typing.Callable[[typing.Set[typing.Tuple[str, str]]], None]] = list()
+        self.__trigger = threading.Event()
+        self.__mtime = self.__get_mtime()
+        self.__sections = {name.upper(): name for name in dir(conf) if not name.startswith("_")}
+
+    def __get_mtime(self) -> typing.Optional[float]:
+        try:
+            return os.stat(self.__path).st_mtime
+        except OSError:
+            return None
+
+    def add_listener(self, callback: typing.Callable[[typing.Set[typing.Tuple[str, str]]], None]):
+        self.__listeners.append(callback)
+
+    def trigger(self):
+        self.__trigger.set()
+
+    def reload(self) -> typing.Set[typing.Tuple[str, str]]:
+        logger.info("reloading configuration from '{}' ...".format(self.__path))
+        changed = set()
+        try:
+            items = read_file(self.__path)
+        except Exception as ex:
+            logger.error("reading '{}' failed - {}".format(self.__path, ex))
+            return changed
+        for name, raw_value in items.items():
+            try:
+                _, section_name, key = name.split("_", 2)
+                section_name = self.__sections[section_name]
+                key = key.lower()
+                section = getattr(conf, section_name)
+                current = getattr(section, key)
+            except Exception:
+                logger.warning("ignoring unknown setting '{}'".format(name))
+                continue
+            try:
+                value = convert(raw_value, current, key in fractional.get(section_name, ()))
+            except Exception as ex:
+                logger.error("ignoring '{}' - {}".format(name, ex))
+                continue
+            if value == current:
+                continue
+            if key not in reloadable.get(section_name, ()):
+                logger.warning("ignoring '{}' - changing it requires a restart".format(name))
+                continue
+            try:
+                validate(section_name, key, value)
+            except Exception as ex:
+                logger.error("ignoring '{}' - {}".format(name, ex))
+                continue
+            setattr(section, key, value)
+            changed.add((section_name, key))
+            logger.info("changed '{}' from '{}' to '{}'".format(name, current, value))
+        if changed:
+            if any(section_name == "Logger" for section_name, _ in changed):
+                init_logger(conf.Logger.level, conf.Logger.rate_limit_interval, conf.Logger.rate_limit_burst)
+            for callback in self.__listeners:
+                try:
+                    callback(changed)
+                except Exception as ex:
+                    logger.error("applying configuration changes failed - {}".format(ex))
+        return changed
+
+    def run(self):
+        logger.info("starting {} ...".format(self.name))
+        while True:
+            triggered = self.__trigger.wait(self.__interval)
+            self.__trigger.clear()
+            mtime = self.__get_mtime()
+            if triggered or (mtime is not None and mtime != self.__mtime):
+                self.__mtime = mtime
+                self.reload()
@@ -27,16 +27,24 @@ logger = get_logger(__name__.split(".", 1)[-1])
 
 
 class Router:
-    def __init__(self, refresh_callback: typing.Callable, device_sessions: dict):
+    def __init__(self, refresh_callback: typing.Callable, device_sessions: typing.Mapping, admin_topic: typing.Optional[str] = None, admin_callback: typing.Optional[typing.Callable] = None, group_topic: typing.Optional[str] = None, group_callback: typing.Optional[typing.Callable] = None):
         self.__refresh_callback = refresh_callback
         self.__device_sessions = device_sessions
+        self.__admin_topic = admin_topic
+        self.__admin_callback = admin_callback
+        self.__group_topic = group_topic
+        self.__group_callback = group_callback
 
     def route(self, topic: str, payload: typing.AnyStr):
         try:
             if topic == mgw_dc.dm.gen_refresh_topic():
                 self.__refresh_callback()
+            elif self.__admin_topic and topic == self.__admin_topic:
+                self.__admin_callback(payload.decode() if isinstance(payload, bytes) else payload)
+            elif self.__group_topic and topic == self.__group_topic:
+                self.__group_callback(payload.decode() if isinstance(payload, bytes) else payload)
             else:
                 device_id, service_id = mgw_dc.com.parse_command_topic(topic)
                 self.__device_sessions[device_id].put_command((service_id, payload))
         except Exception as ex:
-            logger.error("can't route message - {}\n{}: {}".format(ex, topic, payload))
+            logger.error("can't route message - %s\n%s: %s", ex, topic, payload)
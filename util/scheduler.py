@@ -0,0 +1,86 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ("Scheduler", )
+
+
+from .logger import get_logger
+import itertools
+import threading
+import typing
+import heapq
+import time
+
+
+logger = get_logger(__name__.split(".", 1)[-1])
+
+
+class Scheduler(threading.Thread):
+    """
+    Runs jobs at monotonic due times on a single thread. A job returns its next due time or None to end. Scheduling
+    a job again replaces its pending run, so jobs can be brought forward.
+    """
+
+    def __init__(self, name: str):
+        super().__init__(name=name, daemon=True)
+        self.__heap: typing.List[typing.Tuple[float, int, typing.Callable[[], typing.Optional[float]]]] = list()
+        self.__jobs: typing.Dict[typing.Callable[[], typing.Optional[float]], int] = dict()
+        self.__seq = itertools.count()
+        self.__condition = threading.Condition()
+
+    def schedule(self, job: typing.Callable[[], typing.Optional[float]], due: float):
+        with self.__condition:
+            seq = next(self.__seq)
+            self.__jobs[job] = seq
+            heapq.heappush(self.__heap, (due, seq, job))
+            if self.__heap[0][1] == seq:
+                self.__condition.notify()
+
+    def cancel(self, job: typing.Callable[[], typing.Optional[float]]):
+        with self.__condition:
+            self.__jobs.pop(job, None)
+
+    def __next(self) -> typing.Callable[[], typing.Optional[float]]:
+        with self.__condition:
+            while True:
+                # entries of cancelled or rescheduled jobs are dropped lazily
+                while self.__heap and self.__jobs.get(self.__heap[0][2]) != self.__heap[0][1]:
+                    heapq.heappop(self.__heap)
+                if not self.__heap:
+                    self.__condition.wait()
+                    continue
+                remaining = self.__heap[0][0] - time.monotonic()
+                if remaining > 0:
+                    self.__condition.wait(remaining)
+                    continue
+                _, _, job = heapq.heappop(self.__heap)
+                del self.__jobs[job]
+                return job
+
+    def run(self):
+        logger.info("starting {} ...".format(self.name))
+        while True:
+            job = self.__next()
+            try:
+                due = job()
+            except Exception as ex:
+                logger.error("{}: job failed - {}".format(self.name, ex))
+                continue
+            if due is not None:
+                with self.__condition:
+                    if job in self.__jobs:
+                        continue
+                self.schedule(job, due)
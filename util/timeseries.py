@@ -0,0 +1,246 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ("TimeSeriesStore", )
+
+
+from .logger import get_logger
+import threading
+import sqlite3
+import typing
+import array
+import zlib
+import time
+import math
+import os
+
+
+logger = get_logger(__name__.split(".", 1)[-1])
+
+
+class TimeSeriesStore(threading.Thread):
+    __blocks_table = (
+        "blocks",
+        (
+            "series TEXT NOT NULL",
+            "tier INTEGER NOT NULL",
+            "t_start REAL NOT NULL",
+            "t_end REAL NOT NULL",
+            "count INTEGER NOT NULL",
+            "data BLOB NOT NULL"
+        )
+    )
+    __fields_table = (
+        "fields",
+        (
+            "position INTEGER PRIMARY KEY",
+            "name TEXT NOT NULL"
+        )
+    )
+
+    def __init__(self, path: str, name: str, fields: typing.Sequence[str], resolutions: typing.Sequence[int], retentions: typing.Sequence[int], block_size: int, flush_interval: int, max_pending: int = 1000):
+        super().__init__(name="time-series-store", daemon=True)
+        if len(resolutions) != len(retentions):
+            raise RuntimeError("number of resolutions and retentions differ")
+        if resolutions[0] != 0 or list(resolutions) != sorted(resolutions):
+            raise RuntimeError("resolutions must start with 0 and be ascending")
+        self.__db_path = os.path.join(path, "{}.sqlite3".format(name))
+        self.__resolutions = tuple(resolutions)
+        self.__retentions = tuple(retentions)
+        self.__block_size = block_size
+        self.__flush_interval = flush_interval
+        self.__max_pending = max_pending
+        self.__buffers: typing.Dict[typing.Tuple[str, int], typing.List[tuple]] = dict()
+        self.__buckets: typing.Dict[typing.Tuple[str, int], list] = dict()
+        # full blocks waiting for the store thread, appending never touches the database
+        self.__pending: typing.List[typing.Tuple[str, int, typing.List[tuple]]] = list()
+        self.__wakeup = threading.Event()
+        self.__lock = threading.Lock()
+        self.__write_lock = threading.RLock()
+        try:
+            with sqlite3.connect(self.__db_path) as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS {} ({})".format(
+                        TimeSeriesStore.__blocks_table[0],
+                        ", ".join(TimeSeriesStore.__blocks_table[1])
+                    )
+                )
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS {0}_series_tier_end ON {0} (series, tier, t_end)".format(
+                        TimeSeriesStore.__blocks_table[0]
+                    )
+                )
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS {} ({})".format(
+                        TimeSeriesStore.__fields_table[0],
+                        ", ".join(TimeSeriesStore.__fields_table[1])
+                    )
+                )
+                # columns of stored blocks keep their position, new fields are appended
+                stored = [
+                    row[0] for row in conn.execute(
+                        "SELECT name FROM {} ORDER BY position".format(TimeSeriesStore.__fields_table[0])
+                    )
+                ]
+                added = [field for field in dict.fromkeys(fields) if field not in stored]
+                conn.executemany(
+                    "INSERT INTO {} (position, name) VALUES (?, ?)".format(TimeSeriesStore.__fields_table[0]),
+                    [(len(stored) + i, field) for i, field in enumerate(added)]
+                )
+                self.__fields = tuple(stored + added)
+        except Exception as ex:
+            raise RuntimeError("initializing database failed - {}".format(ex))
+
+    def __pack(self, rows: typing.Sequence[tuple]) -> bytes:
+        packed = array.array("d")
+        for col in range(len(self.__fields) + 1):
+            packed.extend(row[col] for row in rows)
+        return zlib.compress(packed.tobytes(), 1)
+
+    def __unpack(self, data: bytes, count: int) -> typing.List[tuple]:
+        packed = array.array("d")
+        packed.frombytes(zlib.decompress(data))
+        # blocks written before fields were added lack their columns
+        columns = [packed[col * count:(col + 1) * count] for col in range(len(packed) // count)]
+        columns.extend([math.nan] * count for _ in range(len(self.__fields) + 1 - len(columns)))
+        return list(zip(*columns))
+
+    def __write_blocks(self, blocks: typing.Sequence[typing.Tuple[str, int, typing.List[tuple]]]):
+        if not blocks:
+            return
+        with self.__write_lock:
+            with sqlite3.connect(self.__db_path) as conn:
+                conn.executemany(
+                    "INSERT INTO {} (series, tier, t_start, t_end, count, data) VALUES (?, ?, ?, ?, ?, ?)".format(
+                        TimeSeriesStore.__blocks_table[0]
+                    ),
+                    [(series, tier, rows[0][0], rows[-1][0], len(rows), self.__pack(rows)) for series, tier, rows in blocks]
+                )
+
+    def __add_row(self, key: typing.Tuple[str, int], row: tuple):
+        buffer = self.__buffers.setdefault(key, list())
+        buffer.append(row)
+        if len(buffer) >= self.__block_size:
+            self.__pending.append((key[0], key[1], buffer))
+            self.__buffers[key] = list()
+            self.__wakeup.set()
+
+    def __bucket_row(self, bucket: list) -> tuple:
+        return (bucket[0], *(val / bucket[1] for val in bucket[2]))
+
+    def __write_pending(self):
+        with self.__write_lock:
+            with self.__lock:
+                blocks = list(self.__pending)
+            try:
+                self.__write_blocks(blocks)
+            except Exception as ex:
+                logger.error("writing {} blocks failed - {}".format(len(blocks), ex))
+                # failed blocks stay pending for the next attempt, beyond the cap the oldest are dropped
+                with self.__lock:
+                    excess = len(self.__pending) - self.__max_pending
+                    if excess > 0:
+                        del self.__pending[:excess]
+                        logger.error("dropped {} blocks exceeding {} pending blocks".format(excess, self.__max_pending))
+                return
+            with self.__lock:
+                del self.__pending[:len(blocks)]
+
+    def __flush_buffers(self):
+        with self.__lock:
+            self.__pending.extend((key[0], key[1], rows) for key, rows in self.__buffers.items() if rows)
+            self.__buffers.clear()
+        self.__write_pending()
+
+    def append(self, series: str, values: dict, timestamp: typing.Optional[float] = None):
+        timestamp = timestamp or time.time()
+        row = (timestamp, *(float(values.get(field, math.nan)) for field in self.__fields))
+        with self.__lock:
+            self.__add_row((series, 0), row)
+            for tier in range(1, len(self.__resolutions)):
+                bucket_start = timestamp - timestamp % self.__resolutions[tier]
+                bucket = self.__buckets.get((series, tier))
+                if bucket and bucket[0] != bucket_start:
+                    self.__add_row((series, tier), self.__bucket_row(bucket))
+                    bucket = None
+                if not bucket:
+                    bucket = [bucket_start, 0, [0.0] * len(self.__fields)]
+                    self.__buckets[(series, tier)] = bucket
+                bucket[1] += 1
+                for i in range(len(self.__fields)):
+                    bucket[2][i] += row[i + 1]
+
+    def flush(self):
+        # meant for shutdown, open downsampling buckets are closed with what they have so far
+        with self.__lock:
+            for key, bucket in self.__buckets.items():
+                self.__buffers.setdefault(key, list()).append(self.__bucket_row(bucket))
+            self.__buckets.clear()
+        self.__flush_buffers()
+
+    def __prune(self):
+        now = time.time()
+        with self.__write_lock:
+            with sqlite3.connect(self.__db_path) as conn:
+                for tier, retention in enumerate(self.__retentions):
+                    conn.execute(
+                        "DELETE FROM {} WHERE tier=(?) AND t_end<(?)".format(TimeSeriesStore.__blocks_table[0]),
+                        (tier, now - retention)
+                    )
+
+    def query(self, series: str, start: typing.Optional[float] = None, end: typing.Optional[float] = None, resolution: int = 0) -> typing.List[dict]:
+        start = start if start is not None else 0.0
+        end = end if end is not None else time.time()
+        tier = max(i for i, res in enumerate(self.__resolutions) if res <= max(resolution, 0))
+        # the write lock keeps blocks from being committed between reading the database and the pending blocks
+        with self.__write_lock:
+            with sqlite3.connect(self.__db_path) as conn:
+                blocks = conn.execute(
+                    "SELECT count, data FROM {} WHERE series=(?) AND tier=(?) AND t_end>=(?) AND t_start<=(?) ORDER BY t_start".format(
+                        TimeSeriesStore.__blocks_table[0]
+                    ),
+                    (series, tier, start, end)
+                ).fetchall()
+            with self.__lock:
+                pending = [block_rows for block_series, block_tier, block_rows in self.__pending if block_series == series and block_tier == tier]
+                pending.append(list(self.__buffers.get((series, tier), list())))
+                if (series, tier) in self.__buckets:
+                    pending.append([self.__bucket_row(self.__buckets[(series, tier)])])
+        rows = list()
+        for count, data in blocks:
+            rows.extend(self.__unpack(data, count))
+        for block_rows in pending:
+            rows.extend(block_rows)
+        return [
+            {"time": row[0], **{field: row[i + 1] for i, field in enumerate(self.__fields) if not math.isnan(row[i + 1])}}
+            for row in sorted(rows) if start <= row[0] <= end
+        ]
+
+    def run(self):
+        logger.info("starting {} ...".format(self.name))
+        last_flush = time.monotonic()
+        while True:
+            self.__wakeup.wait(max(last_flush + self.__flush_interval - time.monotonic(), 0))
+            self.__wakeup.clear()
+            if time.monotonic() < last_flush + self.__flush_interval:
+                self.__write_pending()
+                continue
+            self.__flush_buffers()
+            last_flush = time.monotonic()
+            try:
+                self.__prune()
+            except Exception as ex:
+                logger.error("pruning blocks failed - {}".format(ex))